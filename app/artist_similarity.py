@@ -0,0 +1,106 @@
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from app.log import log
+from app.models.spotify import SpotifyArtistSimilarity
+from app.util import chunker
+
+# number of similar artists stored per artist
+SIMILAR_ARTISTS_PER_ARTIST: int = 20
+INSERT_CHUNK_SIZE: int = 5000
+# the full artist x artist similarity matrix grows with the square of the number of artists, so it's computed this many
+# entries (a block of artists x all artists) at a time
+MAX_SIMILARITY_BLOCK_ENTRIES: int = 10_000_000
+
+
+# One row per (user, artist) that the user has any affinity with. Following an artist counts for 1, and plays add
+# log(1 + plays) on top so a handful of heavily-played artists don't drown out everything else.
+def _get_user_artist_affinities() -> List[Tuple[int, str, float]]:
+    sql = """
+with follows as (select user_id, spotify_artist_uri
+                 from managed_spotify_artists
+                 where following),
+     plays as (select spt.user_id, st.spotify_artist_uri, sum(spt.plays) as plays
+               from spotify_play_totals spt
+                        join spotify_tracks st on spt.spotify_track_uri = st.uri
+               group by 1, 2)
+select coalesce(f.user_id, p.user_id),
+       coalesce(f.spotify_artist_uri, p.spotify_artist_uri),
+       (f.user_id is not null)::int + ln(1 + coalesce(p.plays, 0))
+from follows f
+         full outer join plays p on f.user_id = p.user_id and f.spotify_artist_uri = p.spotify_artist_uri"""
+    return [(row[0], row[1], float(row[2])) for row in db.engine.execute(sql)]
+
+
+# Yields (first artist, block) pairs covering the artist x artist cosine similarity matrix, where each block holds the
+# similarities of a run of consecutive artists to all artists.
+def _get_similarity_blocks(normalized: sparse.csr_matrix) -> Iterator[Tuple[int, sparse.csr_matrix]]:
+    artists = normalized.shape[1]
+    block_size = max(1, MAX_SIMILARITY_BLOCK_ENTRIES // max(artists, 1))
+    by_artist = sparse.csc_matrix(normalized)
+    for start in range(0, artists, block_size):
+        yield start, sparse.csr_matrix(by_artist[:, start : start + block_size].T @ normalized)
+
+
+# Given a users x artists affinity matrix, returns (artist, similar artist, cosine similarity, ordinal) for the top k
+# most similar other artists of every artist, using column indices of the matrix.
+def get_top_similar_artists(user_artist: sparse.csr_matrix, k: int) -> List[Tuple[int, int, float, int]]:
+    norms = np.sqrt(np.asarray(user_artist.multiply(user_artist).sum(axis=0))).ravel()
+    norms[norms == 0] = 1
+    normalized = sparse.csr_matrix(user_artist.multiply(1 / norms))
+
+    top: List[Tuple[int, int, float, int]] = []
+    for start, similarities in _get_similarity_blocks(normalized):
+        for row in range(similarities.shape[0]):
+            artist = start + row
+            begin, end = similarities.indptr[row], similarities.indptr[row + 1]
+            columns, values = similarities.indices[begin:end], similarities.data[begin:end]
+            # an artist isn't similar to itself, & artists that share no users aren't similar at all
+            keep = (columns != artist) & (values != 0)
+            columns, values = columns[keep], values[keep]
+            # sort by similarity descending, then column ascending so ties are deterministic
+            best = np.lexsort((columns, -values))[:k]
+            top.extend((artist, int(columns[i]), float(values[i]), ordinal) for ordinal, i in enumerate(best, start=1))
+    return top
+
+
+def refresh_artist_similarities() -> int:
+    affinities = _get_user_artist_affinities()
+    user_ids = sorted({user_id for user_id, _, _ in affinities})
+    artist_uris = sorted({artist_uri for _, artist_uri, _ in affinities})
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+    artist_index = {artist_uri: i for i, artist_uri in enumerate(artist_uris)}
+    user_artist = sparse.csr_matrix(
+        (
+            [affinity for _, _, affinity in affinities],
+            (
+                [user_index[user_id] for user_id, _, _ in affinities],
+                [artist_index[artist_uri] for _, artist_uri, _ in affinities],
+            ),
+        ),
+        shape=(len(user_ids), len(artist_uris)),
+    )
+    log(f"Computing artist similarities from {len(user_ids)} users and {len(artist_uris)} artists...")
+
+    rows = [
+        {
+            "artist_uri": artist_uris[artist],
+            "similar_artist_uri": artist_uris[similar_artist],
+            "similarity": similarity,
+            "ordinal": ordinal,
+        }
+        for artist, similar_artist, similarity, ordinal in get_top_similar_artists(
+            user_artist, SIMILAR_ARTISTS_PER_ARTIST
+        )
+    ]
+    # replace the whole table in one transaction so readers never see a partial set
+    SpotifyArtistSimilarity.query.delete()
+    for chunk in chunker(rows, INSERT_CHUNK_SIZE):
+        db.session.execute(insert(SpotifyArtistSimilarity.__table__).values(chunk))
+    db.session.commit()
+    log(f"Stored {len(rows)} artist similarities.")
+    return len(rows)
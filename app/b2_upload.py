@@ -0,0 +1,91 @@
+import hashlib
+import io
+from typing import Dict, List, Optional
+
+from b2sdk.exception import B2Error
+from b2sdk.file_version import FileVersionInfo, FileVersionInfoFactory
+from b2sdk.v1 import Bucket
+
+from app.log import log
+
+# B2's smallest allowed part size (besides the last part) is 5MB. Parts are buffered in memory until uploaded, so at most
+# about three times this much of the file is held in memory at once (the first part, which is held back until there's a
+# second, plus the buffer & the part copied out of it).
+PART_SIZE: int = 10 * 1000 * 1000
+MAX_PART_UPLOAD_ATTEMPTS: int = 5
+# has B2 pick the content type from the file name's extension, as uploads of whole files do by default
+AUTO_CONTENT_TYPE: str = "b2/x-auto"
+
+
+# A write-only stream that uploads to a B2 file as it's written, so that e.g. a zip can be written straight to B2 without
+# a local copy. Whenever a part's worth of data is buffered it's uploaded as a part of a B2 large file. B2 rejects large
+# files of a single part, so the first part is held back until a second one is full; files that never fill two parts
+# are uploaded in one request on finish. Call finish() once done writing, or abort() to give up.
+class B2StreamUpload(io.RawIOBase):
+    def __init__(self, bucket: Bucket, file_name: str, file_infos: Dict[str, str], part_size: int = PART_SIZE):
+        self.bucket = bucket
+        self.file_name = file_name
+        self.file_infos = file_infos
+        self.part_size = part_size
+        # SHA1 of everything written, computed as it streams
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        # most bytes buffered at once, i.e. the memory this upload needed
+        self.peak_buffered = 0
+        self._buffer = bytearray()
+        self._first_part: Optional[bytes] = None
+        self._file_id: Optional[str] = None
+        self._part_sha1s: List[str] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.sha1.update(data)
+        self.size += len(data)
+        self.peak_buffered = max(self.peak_buffered, len(self._buffer) + len(self._first_part or b""))
+        while len(self._buffer) >= self.part_size:
+            # copies the part straight out of the buffer, then starts a new buffer from what's left over rather than
+            # shrinking this one, which would keep its full capacity & be reallocated as it grows again
+            with memoryview(self._buffer) as buffer:
+                part = bytes(buffer[: self.part_size])
+                self._buffer = bytearray(buffer[self.part_size :])
+            if self._file_id is None and self._first_part is None:
+                self._first_part = part
+                continue
+            if self._first_part is not None:
+                self._upload_part(self._first_part)
+                self._first_part = None
+            self._upload_part(part)
+        return len(data)
+
+    def _upload_part(self, part: bytes) -> None:
+        if self._file_id is None:
+            self._file_id = self.bucket.start_large_file(self.file_name, AUTO_CONTENT_TYPE, self.file_infos).file_id
+        part_number = len(self._part_sha1s) + 1
+        part_sha1 = hashlib.sha1(part).hexdigest()
+        for attempt in range(1, MAX_PART_UPLOAD_ATTEMPTS + 1):
+            try:
+                self.bucket.api.session.upload_part(self._file_id, part_number, len(part), part_sha1, io.BytesIO(part))
+                break
+            except B2Error as e:
+                if not e.should_retry_upload() or attempt == MAX_PART_UPLOAD_ATTEMPTS:
+                    raise
+                log(f"Upload of part {part_number} of {self.file_name} failed, will retry: {e!r}")
+        self._part_sha1s.append(part_sha1)
+
+    def finish(self) -> FileVersionInfo:
+        if self._file_id is None:
+            data = (self._first_part or b"") + bytes(self._buffer)
+            return self.bucket.upload_bytes(data, self.file_name, file_infos=self.file_infos)
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        response = self.bucket.api.session.finish_large_file(self._file_id, self._part_sha1s)
+        return FileVersionInfoFactory.from_api_response(response)
+
+    # cancels the large file, if one was started, so its parts don't linger in the bucket
+    def abort(self) -> None:
+        if self._file_id is not None:
+            self.bucket.cancel_large_file(self._file_id)
@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, List, Optional
+
+from flask_sqlalchemy import BaseQuery
+
+from app import kv
+from app.log import log
+from app.util import chunker
+
+# Framework for long-running enrichment jobs that fill in missing data from an external API. Candidates are paged
+# through with keyset pagination (key > last key, ordered by key) rather than loaded up front, and the last key of every
+# completed page is checkpointed to kv in the same transaction as the page's writes, so a job that is stopped or crashes
+# resumes where it left off instead of spending API quota on rows it already did.
+
+CHECKPOINT_KEY_PREFIX: str = "backfill_checkpoint"
+
+
+class BackfillJob:
+    def __init__(
+        self,
+        name: str,
+        key_column,
+        candidates: Callable[[], BaseQuery],
+        fetch: Callable[[Any, List[tuple]], Any],
+        write: Callable[[Any, Any], None],
+        batch_size: int,
+        workers: int = 4,
+        get_client: Callable[[], Any] = lambda: None,
+    ):
+        # used for the checkpoint key, so must stay stable across runs
+        self.name = name
+        # unique, text column that candidates are ordered & paged by
+        self.key_column = key_column
+        # query selecting key_column first, followed by anything else fetch needs
+        self.candidates = candidates
+        # called with (client, rows) from worker threads, so must only call the API and not touch the database
+        self.fetch = fetch
+        # called with (client, fetch's result) on the main thread. Should not commit; the framework commits each page.
+        self.write = write
+        # rows per fetch call, usually the API's multi-get limit
+        self.batch_size = batch_size
+        self.workers = workers
+        # called once per page on the main thread, e.g. to get a Spotify client with a fresh token
+        self.get_client = get_client
+
+
+def _get_checkpoint_key(job: BackfillJob) -> str:
+    return f"{CHECKPOINT_KEY_PREFIX}:{job.name}"
+
+
+def _get_candidates_after(job: BackfillJob, last_key: Optional[str]) -> BaseQuery:
+    candidates = job.candidates()
+    return candidates.filter(job.key_column > last_key) if last_key else candidates
+
+
+# Returns the number of candidates processed. Pass restart=True to ignore any checkpoint from a previous run.
+def run_backfill(job: BackfillJob, restart: bool = False) -> int:
+    checkpoint_key = _get_checkpoint_key(job)
+    last_key = None if restart else kv.get(checkpoint_key) or None
+    total = _get_candidates_after(job, last_key).count()
+    log(f"Backfill {job.name}: {total} candidates to process" + (f", resuming after {last_key}." if last_key else "."))
+
+    processed = 0
+    started = time.time()
+    with ThreadPoolExecutor(job.workers) as executor:
+        while True:
+            rows = [
+                tuple(row)
+                for row in _get_candidates_after(job, last_key)
+                .order_by(job.key_column)
+                .limit(job.batch_size * job.workers)
+            ]
+            if not rows:
+                break
+            client = job.get_client()
+            for result in executor.map(lambda batch: job.fetch(client, batch), chunker(rows, job.batch_size)):
+                job.write(client, result)
+            last_key = str(rows[-1][0])
+            # commits the page's writes along with the checkpoint
+            kv.put(checkpoint_key, last_key)
+
+            processed += len(rows)
+            rate = processed / max(time.time() - started, 0.001)
+            eta = timedelta(seconds=round(max(total - processed, 0) / rate))
+            log(f"Backfill {job.name}: {processed} / {total} processed ({rate:.1f}/s, ETA {eta}).")
+
+    # candidates that were fixed are no longer returned, so the next run can start from the beginning
+    kv.put(checkpoint_key, "")
+    elapsed = timedelta(seconds=round(time.time() - started))
+    log(f"Backfill {job.name}: done, processed {processed} candidates in {elapsed}.")
+    return processed
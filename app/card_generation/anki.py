@@ -1,18 +1,55 @@
-from typing import List
+import hashlib
+import itertools
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from datetime import datetime, timedelta
+from typing import IO, Callable, Dict, List, Optional, Tuple, cast
 
 import genanki
-from genanki import Deck
+from b2sdk.file_version import FileVersionInfo
+from b2sdk.v1 import Bucket
+from genanki import Deck, Model, Note
+from sentry_sdk import capture_exception
+from sqlalchemy.dialects.postgresql import insert
 
-from app.card_generation.readwise import generate_readwise_highlight_clozes, generate_readwise_people
-from app.card_generation.spotify import generate_tracks, generate_artists
-from app.card_generation.untappd import generate_beer
-from app.card_generation.videos import generate_videos
+from app import app, db
+from app.b2_upload import B2StreamUpload
+from app.card_generation.people_getter import _get_person_model
+from app.card_generation.readwise import (
+    generate_readwise_highlight_clozes,
+    generate_readwise_people,
+    get_highlight_model,
+    get_highlights_version,
+)
+from app.card_generation.spotify import (
+    generate_tracks,
+    generate_artists,
+    get_track_model,
+    get_artist_model,
+    get_artists_version,
+    get_tracks_version,
+)
+from app.card_generation.untappd import generate_beer, get_beer_model, get_beer_version
+from app.card_generation.videos import generate_videos, get_video_model, get_video_person_model, get_videos_version
 from app.log import log
+from app.models.anki import AnkiNoteManifestEntry, AnkiSectionVersion
 from app.models.base import User, GateDef
 from app.util import today_datetime
 
 SPOTIFY_TRACK_DECK_ID: int = 1586000000000
 TEST_FILENAME = "test_filename.apkg"
+DEFAULT_SECTION_TIMEOUT: timedelta = timedelta(minutes=30)
+# a section whose version hasn't changed is still generated again once its notes are this old, since some of what they're
+# built from (Wikipedia, Untappd, people's ages, ...) isn't covered by its version
+SECTION_MAX_REUSE_AGE: timedelta = timedelta(days=7)
+# how long a deck waits for its timed out sections to stop before giving up on them, so that a section stuck before its
+# next note (e.g. on a slow API call) can't hold up the deck for longer than its timeout plus this
+CANCELLED_SECTION_GRACE: timedelta = timedelta(minutes=1)
 
 """
 Things to keep in mind when adding new models / templates:
@@ -37,32 +74,374 @@ versions of the code (edited it multiple times & tried importing to test functio
 """
 
 
-# returns number of notes generated
-def generate_full_apkg(user: User, filename: str) -> int:
-    deck: Deck = Deck(SPOTIFY_TRACK_DECK_ID, "Spotify Tracks")
-    tags: List[str] = [] if user.default_spotify_anki_tag is None else [user.default_spotify_anki_tag]
+# guid -> (section that generated the note, hash of the note)
+NoteManifest = Dict[str, Tuple[str, str]]
+# section name -> version of the inputs it was generated from
+SectionVersions = Dict[str, str]
 
-    log(f"Generating tracks... {today_datetime()}")
-    generate_tracks(user, deck, tags)
 
-    if user.is_gated(GateDef.INTERNAL_USER):
-        log(f"Generating artists... {today_datetime()}")
-        generate_artists(user, deck, tags)
+class Section:
+    def __init__(
+        self,
+        name: str,
+        generators: List[Callable[[User, Deck, List[str]], None]],
+        models: List[Callable[[User], Model]],
+        timeout: timedelta = DEFAULT_SECTION_TIMEOUT,
+        get_version: Optional[Callable[[User], str]] = None,
+    ):
+        # stored with each note in the manifest, so must stay stable across runs
+        self.name = name
+        # called in turn on a worker thread, each adding its notes to the deck it's given
+        self.generators = generators
+        # every model the generators use, needed to rebuild the section's notes from the manifest
+        self.models = models
+        # how long after generation starts the section is given up on
+        self.timeout = timeout
+        # Cheap signal of whether the section's notes could have changed: returns something that changes whenever the
+        # inputs the generators read do. If it's the same as when the notes in the last package were generated, those
+        # notes are reused instead of calling the generators. Sections without one are always generated.
+        self.get_version = get_version
 
-    if user.is_gated(GateDef.GENERATE_VIDEO_NOTES):
-        log(f"Generating videos... {today_datetime()}")
-        generate_videos(user, deck, tags)
 
-    if user.readwise_access_token is not None:
-        log(f"Generating highlights... {today_datetime()}")
-        generate_readwise_highlight_clozes(user, deck, tags)
-        generate_readwise_people(user, deck, tags)
+class SectionCancelled(Exception):
+    pass
 
+
+# Generators add their notes one at a time, so checking whether the section has been given up on whenever they do lets
+# a timed out section stop at its next note, rather than keep running in the background until it's done.
+class _CancellableDeck(Deck):
+    def __init__(self, cancelled: threading.Event):
+        super().__init__(SPOTIFY_TRACK_DECK_ID, "Spotify Tracks")
+        self.cancelled = cancelled
+
+    def add_note(self, note: Note) -> None:
+        if self.cancelled.is_set():
+            raise SectionCancelled()
+        super().add_note(note)
+
+
+def _get_sections(user: User) -> List[Section]:
+    sections: List[Section] = [Section("tracks", [generate_tracks], [get_track_model], get_version=get_tracks_version)]
+    if user.is_gated(GateDef.INTERNAL_USER):
+        sections.append(Section("artists", [generate_artists], [get_artist_model], get_version=get_artists_version))
+    if user.is_gated(GateDef.GENERATE_VIDEO_NOTES):
+        sections.append(
+            Section(
+                "videos",
+                [generate_videos],
+                [get_video_model, get_video_person_model],
+                get_version=get_videos_version,
+            )
+        )
+    if user.readwise_access_token is not None:
+        sections.append(
+            Section(
+                "highlights",
+                [generate_readwise_highlight_clozes, generate_readwise_people],
+                [get_highlight_model, _get_person_model],
+                get_version=get_highlights_version,
+            )
+        )
     if user.untappd_username and user.is_gated(GateDef.GENERATE_BEER_NOTES):
-        log(f"Generating beer... {today_datetime()}")
-        generate_beer(user, deck, tags)
+        sections.append(
+            Section(
+                "beer",
+                [generate_beer],
+                [get_beer_model],
+                timeout=timedelta(minutes=10),
+                get_version=get_beer_version,
+            )
+        )
+    return sections
+
+
+# Only hashes what the model is defined with: models are reused across builds, and writing a package adds defaults
+# (ordinals, fonts, ...) to their fields & templates in place.
+def _get_model_hash(model: Model) -> str:
+    fields = [field["name"] for field in model.fields]
+    templates = [[template["name"], template["qfmt"], template["afmt"]] for template in model.templates]
+    return _hash([model.model_id, model.name, fields, templates, model.css, model.model_type])
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def get_note_hash(note: Note, model_hash: str) -> str:
+    return _hash([model_hash, note.fields, sorted(note.tags)])
+
+
+# also covers the tags & models, since the reused notes come with the tags & models they were generated with
+def _get_section_version(user: User, section: Section, tags: List[str]) -> Optional[str]:
+    if section.get_version is None:
+        return None
+    model_hashes = [_get_model_hash(get_model(user)) for get_model in section.models]
+    return _hash([section.get_version(user), tags, model_hashes])
+
+
+# The version each section was last generated from, for the sections whose notes can be rebuilt from the manifest and
+# were generated recently enough to be reused. Notes saved before the manifest stored them can't be rebuilt.
+def _get_reusable_section_versions(user: User) -> SectionVersions:
+    incomplete_sections = {
+        row[0]
+        for row in db.session.query(AnkiNoteManifestEntry.section)
+        .filter_by(user_id=user.id)
+        .filter(AnkiNoteManifestEntry.fields.is_(None))  # type: ignore
+        .distinct()
+    }
+    return {
+        section_version.section: section_version.version
+        for section_version in AnkiSectionVersion.query.filter_by(user_id=user.id).all()
+        if section_version.section not in incomplete_sections
+        and section_version.generated_at > datetime.utcnow() - SECTION_MAX_REUSE_AGE
+    }
+
+
+# Runs on a worker thread, so uses its own app context & session. The user is loaded again rather than shared, since
+# the caller's instance belongs to the caller's session. Returns the section's version, along with its notes, or None
+# instead of notes if the version matches reusable_version, in which case the generators aren't called. Raises
+# SectionCancelled once cancelled is set.
+def _generate_section(
+    user_id: int, section: Section, tags: List[str], reusable_version: Optional[str], cancelled: threading.Event
+) -> Tuple[Optional[str], Optional[List[Note]]]:
+    with app.app_context():
+        try:
+            user = User.query.get(user_id)
+            version = _get_section_version(user, section, tags)
+            if version is not None and version == reusable_version:
+                return version, None
+            deck = _CancellableDeck(cancelled)
+            for generator in section.generators:
+                if cancelled.is_set():
+                    raise SectionCancelled()
+                generator(user, deck, tags)
+            return version, deck.notes
+        finally:
+            db.session.remove()
+
+
+# the section's notes as of the last uploaded package
+def _get_last_good_notes(user: User, section: Section) -> List[Note]:
+    models: Dict[int, Model] = {model.model_id: model for model in [get_model(user) for get_model in section.models]}
+    entries = (
+        AnkiNoteManifestEntry.query.filter_by(user_id=user.id, section=section.name)
+        .filter(AnkiNoteManifestEntry.fields.isnot(None))  # type: ignore
+        .order_by(AnkiNoteManifestEntry.id)
+        .all()
+    )
+    return [
+        genanki.Note(
+            model=models[entry.model_id], fields=json.loads(entry.fields), tags=json.loads(entry.tags), guid=entry.guid
+        )
+        for entry in entries
+        if entry.model_id in models
+    ]
 
+
+# Sections read independent data & mostly wait on APIs, so they're generated concurrently and then merged into the deck
+# in the order above. A section whose version is unchanged reuses its notes from the last uploaded package without being
+# generated, and one that fails or runs past its timeout is replaced by those notes rather than failing the whole deck.
+# Also records which section produced which note, so that tonight's notes can be compared against the manifest of the
+# last uploaded package, and the version of each section that was generated, to be saved along with that manifest.
+def generate_deck(user: User) -> Tuple[Deck, NoteManifest, SectionVersions]:
+    tags: List[str] = [] if user.default_spotify_anki_tag is None else [user.default_spotify_anki_tag]
+    sections = _get_sections(user)
+    reusable_versions = _get_reusable_section_versions(user)
+
+    log(f"Generating {', '.join(section.name for section in sections)}... {today_datetime()}")
+    started = time.time()
+    # one thread per section, so that every section starts right away and its timeout counts from when it started
+    executor = ThreadPoolExecutor(len(sections))
+    cancelled = {section.name: threading.Event() for section in sections}
+    futures = [
+        executor.submit(
+            _generate_section, user.id, section, tags, reusable_versions.get(section.name), cancelled[section.name]
+        )
+        for section in sections
+    ]
+    notes_by_section: List[Tuple[Section, List[Note]]] = []
+    versions: SectionVersions = {}
+    for section, future in zip(sections, futures):
+        try:
+            version, maybe_notes = future.result(
+                timeout=max(started + section.timeout.total_seconds() - time.time(), 0)
+            )
+            if maybe_notes is None:
+                notes = _get_last_good_notes(user, section)
+                log(f"Inputs of {section.name} haven't changed. Reused its {len(notes)} notes from the last apkg.")
+            else:
+                notes = maybe_notes
+                if version is not None:
+                    versions[section.name] = version
+                log(f"Generated {len(notes)} {section.name} notes in {time.time() - started:.1f}s.")
+        except Exception as e:
+            reason = f"timed out after {section.timeout}" if isinstance(e, TimeoutError) else f"failed: {e!r}"
+            cancelled[section.name].set()
+            notes = _get_last_good_notes(user, section)
+            log(f"Generating {section.name} {reason}. Will reuse the {len(notes)} notes from the last apkg.")
+            capture_exception(e)
+        notes_by_section.append((section, notes))
+    # timed out sections stop at their next note, so give them a little while to do so rather than let them keep running
+    # into the next deck, but don't hold up this one for a section that's stuck
+    stragglers = [section.name for section, future in zip(sections, futures) if not future.done()]
+    if stragglers:
+        log(f"Waiting for cancelled {', '.join(stragglers)} to stop...")
+        _, not_done = wait(futures, timeout=CANCELLED_SECTION_GRACE.total_seconds())
+        if not_done:
+            abandoned = [section.name for section, future in zip(sections, futures) if future in not_done]
+            log(
+                f"Cancelled {', '.join(abandoned)} still running after {CANCELLED_SECTION_GRACE}. Not waiting any longer."
+            )
+        else:
+            log(f"Cancelled {', '.join(stragglers)} stopped after {time.time() - started:.1f}s.")
+    executor.shutdown(wait=False)
+
+    deck: Deck = Deck(SPOTIFY_TRACK_DECK_ID, "Spotify Tracks")
+    manifest: NoteManifest = {}
+    model_hashes: Dict[int, str] = {}
+    for section, notes in notes_by_section:
+        for note in notes:
+            deck.add_note(note)
+            if id(note.model) not in model_hashes:
+                model_hashes[id(note.model)] = _get_model_hash(note.model)
+            manifest[note.guid] = (section.name, get_note_hash(note, model_hashes[id(note.model)]))
+    return deck, manifest, versions
+
+
+# order-independent, so notes generated in a different order still hash the same
+def get_manifest_hash(manifest: NoteManifest) -> str:
+    return _hash(sorted([guid, note_hash] for guid, (_, note_hash) in manifest.items()))
+
+
+def get_saved_manifest(user: User) -> NoteManifest:
+    return {
+        entry.guid: (entry.section, entry.note_hash)
+        for entry in AnkiNoteManifestEntry.query.filter_by(user_id=user.id).all()
+    }
+
+
+# returns the guids that were added, changed & removed in current relative to previous
+def diff_manifests(previous: NoteManifest, current: NoteManifest) -> Tuple[List[str], List[str], List[str]]:
+    added = [guid for guid in current if guid not in previous]
+    changed = [guid for guid in current if guid in previous and previous[guid][1] != current[guid][1]]
+    removed = [guid for guid in previous if guid not in current]
+    return added, changed, removed
+
+
+def log_manifest_changes(previous: NoteManifest, current: NoteManifest) -> None:
+    added, changed, removed = diff_manifests(previous, current)
+    for section in sorted(set(section for section, _ in list(previous.values()) + list(current.values()))):
+        section_added = len([guid for guid in added if current[guid][0] == section])
+        section_changed = len([guid for guid in changed if current[guid][0] == section])
+        section_removed = len([guid for guid in removed if previous[guid][0] == section])
+        log(f"Section {section}: {section_added} notes added, {section_changed} changed, {section_removed} removed.")
+
+
+# Brings the saved manifest in line with current, only writing the notes that were added, changed or removed, or that
+# were saved before the manifest stored notes. Does not commit, so that it can be committed along with the
+# ApkgGeneration for the package it describes.
+def save_manifest(user: User, previous: NoteManifest, current: NoteManifest, deck: Deck) -> None:
+    added, changed, removed = diff_manifests(previous, current)
+    incomplete = [
+        row[0]
+        for row in db.session.query(AnkiNoteManifestEntry.guid)
+        .filter_by(user_id=user.id)
+        .filter(AnkiNoteManifestEntry.fields.is_(None))  # type: ignore
+        if row[0] in current and row[0] not in changed
+    ]
+    changed += incomplete
+    notes: Dict[str, Note] = {note.guid: note for note in deck.notes}
+    if removed:
+        AnkiNoteManifestEntry.query.filter(
+            AnkiNoteManifestEntry.user_id == user.id, AnkiNoteManifestEntry.guid.in_(removed)  # type: ignore
+        ).delete(synchronize_session=False)
+    if added or changed:
+        statement = insert(AnkiNoteManifestEntry.__table__).values(
+            [
+                {
+                    "user_id": user.id,
+                    "guid": guid,
+                    "section": current[guid][0],
+                    "note_hash": current[guid][1],
+                    "model_id": notes[guid].model.model_id,
+                    "fields": json.dumps(notes[guid].fields),
+                    "tags": json.dumps(list(notes[guid].tags)),
+                }
+                for guid in added + changed
+            ]
+        )
+        db.session.execute(
+            statement.on_conflict_do_update(
+                constraint="_user_id_and_guid",
+                set_={
+                    "section": statement.excluded.section,
+                    "note_hash": statement.excluded.note_hash,
+                    "model_id": statement.excluded.model_id,
+                    "fields": statement.excluded.fields,
+                    "tags": statement.excluded.tags,
+                },
+            )
+        )
+
+
+# Records the versions of the sections that were generated for the manifest being saved. Does not commit, for the same
+# reason as save_manifest.
+def save_section_versions(user: User, versions: SectionVersions) -> None:
+    if not versions:
+        return
+    statement = insert(AnkiSectionVersion.__table__).values(
+        [
+            {"user_id": user.id, "section": section, "version": version, "generated_at": datetime.utcnow()}
+            for section, version in versions.items()
+        ]
+    )
+    db.session.execute(
+        statement.on_conflict_do_update(
+            constraint="_user_id_and_section",
+            set_={"version": statement.excluded.version, "generated_at": statement.excluded.generated_at},
+        )
+    )
+
+
+# Same package as genanki.Package.write_to_file, but written to any writable stream, which needn't be seekable. SQLite
+# needs a path to build the collection in, so that still goes through a temporary file; the zip around it doesn't.
+def _write_package(deck: Deck, stream: IO[bytes]) -> None:
+    with tempfile.NamedTemporaryFile(suffix=".anki2") as collection:
+        connection = sqlite3.connect(collection.name)
+        timestamp = time.time()
+        genanki.Package(deck).write_to_db(connection.cursor(), timestamp, itertools.count(int(timestamp * 1000)))
+        connection.commit()
+        connection.close()
+        with zipfile.ZipFile(stream, "w") as package:
+            package.write(collection.name, "collection.anki2")
+            package.writestr("media", json.dumps({}))
+
+
+def write_apkg(deck: Deck, filename: str) -> None:
     log(f"Packaging into file... {today_datetime()}")
     if filename != TEST_FILENAME:
-        genanki.Package(deck).write_to_file(filename)
+        with open(filename, "wb") as file:
+            _write_package(deck, file)
+
+
+# Packages the deck straight into a new B2 file, without writing the package to disk first.
+def upload_apkg(deck: Deck, bucket: Bucket, file_name: str, file_infos: Dict[str, str]) -> FileVersionInfo:
+    log(f"Packaging & uploading to B2... {today_datetime()}")
+    upload = B2StreamUpload(bucket, file_name, file_infos)
+    try:
+        _write_package(deck, cast(IO[bytes], upload))
+        file_version = upload.finish()
+    except Exception:
+        upload.abort()
+        raise
+    log(
+        f"Uploaded {upload.size} bytes with SHA1 {upload.sha1.hexdigest()}. Buffered at most {upload.peak_buffered} bytes."
+    )
+    return file_version
+
+
+# returns number of notes generated
+def generate_full_apkg(user: User, filename: str) -> int:
+    deck, _, _ = generate_deck(user)
+    write_apkg(deck, filename)
     return len(deck.notes)
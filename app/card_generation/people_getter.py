@@ -6,7 +6,7 @@ import genanki
 import spacy
 from wikipedia import wikipedia, WikipediaPage, PageError, WikipediaException
 
-from app.card_generation.util import zdNote, get_template, AnkiCard, get_rs_anki_css, get_default_css
+from app.card_generation.util import cached_model, zdNote, get_template, AnkiCard, get_rs_anki_css, get_default_css
 from app.log import log
 from app.util import JsonDict
 from app.models.base import User
@@ -55,6 +55,7 @@ def get_people(highlight_data: Dict[str, str]) -> List[Person]:
     ]
 
 
+@cached_model()
 def _get_person_model(user):
     templates: List[JsonDict] = [
         get_template(AnkiCard.PERSON_NAME_TO_IMAGE, user),
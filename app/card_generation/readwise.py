@@ -9,10 +9,17 @@ from google.cloud import translate_v2 as translate
 from app import db, kv, app
 from app.card_generation.highlight_clozer import get_clozed_highlight_and_keyword, detect_language
 from app.card_generation.people_getter import get_people, maybe_get_wikipedia_info, _get_person_model
-from app.card_generation.util import zdNote, get_rs_anki_css, get_default_css, get_template, AnkiCard
+from app.card_generation.util import (
+    cached_model,
+    zdNote,
+    get_rs_anki_css,
+    get_default_css,
+    get_template,
+    AnkiCard,
+)
 from app.log import log
 from app.models.base import User, GateDef
-from app.util import JsonDict
+from app.util import JsonDict, get_rows_fingerprint
 
 READWISE_HIGHLIGHT_CLOZE_MODEL_ID = 1604800000000
 
@@ -61,6 +68,7 @@ def _get_person_notes_from_highlight(highlights, tags, user):
     return person_notes
 
 
+@cached_model()
 def get_highlight_model(user: User):
     templates: List[JsonDict] = [get_template(AnkiCard.HIGHLIGHT_CLOZE_1, user)]
     return genanki.Model(
@@ -85,8 +93,8 @@ def get_highlight_model(user: User):
     )
 
 
-def get_highlights(user: User):
-    prepared_sql = f"""
+def _get_highlights_sql(user: User) -> str:
+    return f"""
         select rh.id, text, title, author, cover_image_url
         from readwise_books b
             join managed_readwise_books mrb on b.id = mrb.readwise_book_id
@@ -94,7 +102,17 @@ def get_highlights(user: User):
         where mrb.user_id = {user.id}
         order by mrb.id asc, rh.id asc
     """
-    highlights = list(db.engine.execute(prepared_sql))
+
+
+# Changes whenever the user's highlights do. The notes also depend on Wikipedia & Google Translate, which this can't
+# see; see SECTION_MAX_REUSE_AGE.
+def get_highlights_version(user: User) -> str:
+    people = user.is_gated(GateDef.GENERATE_READWISE_PERSON_NOTES)
+    return f"{get_rows_fingerprint(_get_highlights_sql(user))},{people}"
+
+
+def get_highlights(user: User):
+    highlights = list(db.engine.execute(_get_highlights_sql(user)))
     return [
         {
             "id": highlight[0],
@@ -1,13 +1,11 @@
-import re
-from collections import defaultdict
+import json
 from typing import Dict, List, Optional
 
 import genanki
-from dateutil import parser
 from genanki import Model, Deck
 
-from app import db
 from app.card_generation.util import (
+    cached_model,
     create_html_unordered_list,
     zdNote,
     get_template,
@@ -15,11 +13,18 @@ from app.card_generation.util import (
     get_default_css,
     get_rs_anki_css,
 )
+from app.listening_profile import get_artist_listening_profiles, refresh_artist_listening_profiles
 from app.log import log
 from app.models.base import User, GateDef
 from app.models.spotify import LegacySpotifyTrackNoteGuidMapping
-from app.spotify import get_tracks, get_common_artists
-from app.util import JsonDict, today_datetime
+from app.spotify import (
+    get_tracks,
+    get_common_artists,
+    get_common_artists_sql,
+    get_deck_tracks_sql,
+    sync_deck_track_inputs,
+)
+from app.util import JsonDict, get_rows_fingerprint, today_datetime
 
 SPOTIFY_TRACK_MODEL_ID: int = 1586000000000
 SPOTIFY_ARTIST_MODEL_ID: int = 1587000000000
@@ -38,18 +43,30 @@ class SpotifyTrackNote(zdNote):
         self._guid = val
 
 
+# Changes whenever any row generate_tracks reads does: the deck's tracks, once followed artists & saved tracks have been
+# synced with Spotify, and the guids of notes imported before guids were based on the track URI.
+def get_tracks_version(user: User) -> str:
+    sync_deck_track_inputs(user)
+    mappings_sql = f"""
+select spotify_track_uri, anki_guid
+from legacy_spotify_track_note_guid_mappings
+where user_id = {user.id}"""
+    return f"{get_rows_fingerprint(get_deck_tracks_sql(user))},{get_rows_fingerprint(mappings_sql)}"
+
+
+# Only called after get_tracks_version, which has just synced what the tracks are read from.
 def generate_tracks(user: User, deck: Deck, tags: List[str]):
     legacy_mappings: Dict[str, str] = {
         lm.spotify_track_uri: lm.anki_guid
         for lm in LegacySpotifyTrackNoteGuidMapping.query.filter_by(user_id=user.id).all()
     }
     track_model = get_track_model(user)
-    for track in get_tracks(user):
+    for track in get_tracks(user, sync=False):
         inner_artists = []
         for inner_artist in track["artists"]:
             inner_artists.append(inner_artist["name"])
-        album_name = track["album"]["name"].replace('"', "'")
-        release_year = parser.parse(track["album"]["release_date"]).date().year
+        album_name = track["album_name"].replace('"', "'")
+        release_year = f" ({track['album_released_at'].year})" if track["album_released_at"] else ""
         track_as_note = SpotifyTrackNote(
             model=track_model,
             tags=tags,
@@ -57,8 +74,8 @@ def generate_tracks(user: User, deck: Deck, tags: List[str]):
                 track["uri"],
                 track["name"].replace('"', "'"),
                 ", ".join(inner_artists).replace('"', "'"),
-                f"<i>{album_name}</i> ({release_year})",
-                f"<img src='{track['album']['images'][0]['url']}'>",
+                f"<i>{album_name}</i>{release_year}",
+                f"<img src='{track['album_image_url']}'>" if track["album_image_url"] else "",
             ],
         )
         if track["uri"] in legacy_mappings:
@@ -66,47 +83,25 @@ def generate_tracks(user: User, deck: Deck, tags: List[str]):
         deck.add_note(track_as_note)
 
 
-def generate_artists(user: User, deck: Deck, tags: List[str]) -> None:
-    log(f"getting top played tracks, albums, & collaborators... {today_datetime()}")
-    top_played_tracks_sql = f"""
-select spotify_artist_uri, spotify_track_uri, st.name, count(*) from spotify_tracks st
-join spotify_artists sa on st.spotify_artist_uri = sa.uri
-join spotify_plays sp on st.uri = sp.spotify_track_uri
-where user_id = {user.id}
-group by 1, 2, 3
-order by 4 desc"""
-    top_played_tracks = list(db.engine.execute(top_played_tracks_sql))
+# Changes whenever any row generate_artists reads does: the user's artist listening profiles, which are brought up to
+# date first, and the artists they've played enough.
+def get_artists_version(user: User) -> str:
+    refresh_artist_listening_profiles(user)
+    profiles_sql = f"""
+select artist_uri, top_tracks_json, top_albums_json, top_collaborators_json
+from artist_listening_profiles
+where user_id = {user.id}"""
+    artists_sql = f"""
+select *
+from spotify_artists
+where uri in ({get_common_artists_sql(user)})"""
+    return f"{get_rows_fingerprint(profiles_sql)},{get_rows_fingerprint(artists_sql)}"
 
-    top_played_albums_sql = f"""
-select sar.uri, spotify_album_uri, sal.name, released_at, count(*)
-from spotify_tracks st
-         join spotify_artists sar on st.spotify_artist_uri = sar.uri
-         join spotify_plays sp on st.uri = sp.spotify_track_uri
-         join spotify_albums sal on sal.uri = st.spotify_album_uri
-where user_id = {user.id} and album_type='album'
-group by 1, 2, 3, 4
-order by 4 desc"""
-    top_played_albums = list(db.engine.execute(top_played_albums_sql))
 
-    top_collaborators_sql = f"""
-with tracks_by_artist_with_plays as (select sf.spotify_artist_uri, sp.spotify_track_uri
-                                     from spotify_plays sp
-                                              join spotify_features sf on sp.spotify_track_uri = sf.spotify_track_uri
-                                     where user_id = {user.id}),
-    plays_per_song as (select tbawp.spotify_artist_uri, st.uri, count(*) as plays_for_song
-                       from spotify_tracks st
-                                join tracks_by_artist_with_plays tbawp on st.uri = tbawp.spotify_track_uri
-                       group by 1, 2)
-select pps.spotify_artist_uri, sa.name, sum(plays_for_song)
-from spotify_features sf
-         join plays_per_song pps on pps.uri = sf.spotify_track_uri
-         join spotify_artists sa on sf.spotify_artist_uri = sa.uri
-group by 1, 2
-order by 1 asc, 3 desc"""
-    top_collaborators = list(db.engine.execute(top_collaborators_sql))
-    collaborators_grouped_by_artist_uri = defaultdict(list)
-    for artist_uri, collaborator_name, _ in top_collaborators:
-        collaborators_grouped_by_artist_uri[artist_uri].append(collaborator_name)
+def generate_artists(user: User, deck: Deck, tags: List[str]) -> None:
+    log(f"refreshing artist listening profiles... {today_datetime()}")
+    refresh_artist_listening_profiles(user)
+    profiles = get_artist_listening_profiles(user)
 
     log(f"getting common artists... {today_datetime()}")
     artist_model = get_artist_model(user)
@@ -118,21 +113,15 @@ order by 1 asc, 3 desc"""
             img_src = f"https://www.zdone.co/static/images/artists/{artist.image_override_name}"
 
         if img_src:
-            top_played_tracks_for_artist = [
-                clean_track_name(row[2]) for row in top_played_tracks if row[0] == artist.uri
-            ]
-            top_played_tracks_for_artist = list(dict.fromkeys(top_played_tracks_for_artist))
-            songs = create_html_unordered_list(top_played_tracks_for_artist)
-
-            top_played_albums_for_artist = {
-                clean_album_name(row[2]): row[3].year for row in top_played_albums if row[0] == artist.uri
-            }
+            profile = profiles.get(artist.uri)
+            songs = create_html_unordered_list(json.loads(profile.top_tracks_json) if profile else [])
             albums = create_html_unordered_list(
-                [f"<i>{name}</i> ({year})" for name, year in top_played_albums_for_artist.items()], max_length=10
+                [f"<i>{name}</i> ({year})" for name, year in json.loads(profile.top_albums_json)] if profile else [],
+                max_length=10,
+            )
+            collaborators = create_html_unordered_list(
+                json.loads(profile.top_collaborators_json) if profile else [], max_length=10
             )
-
-            this_artist_top_collaborators = collaborators_grouped_by_artist_uri[artist.uri]
-            this_artist_top_collaborators.remove(artist.name)
 
             genres = ""
             similar_artists = ""
@@ -150,7 +139,7 @@ order by 1 asc, 3 desc"""
                     genres,
                     similar_artists,
                     years_active,
-                    create_html_unordered_list(this_artist_top_collaborators, max_length=10),
+                    collaborators,
                     "",
                     "",
                     "",
@@ -165,6 +154,7 @@ order by 1 asc, 3 desc"""
             deck.add_note(artist_as_note)
 
 
+@cached_model(GateDef.SPOTIFY_GENERATE_ALBUM_ART_CARD_FOR_TRACK_NOTES, GateDef.USE_SPOTIFY_TRACK_LEGACY_MODEL_ID)
 def get_track_model(user: User) -> Model:
     should_generate_albumart_card: bool = user.is_gated(GateDef.SPOTIFY_GENERATE_ALBUM_ART_CARD_FOR_TRACK_NOTES)
     legacy_model_id: int = 1579060616046
@@ -190,6 +180,7 @@ def get_track_model(user: User) -> Model:
     )
 
 
+@cached_model()
 def get_artist_model(user: User) -> Model:
     return genanki.Model(
         SPOTIFY_ARTIST_MODEL_ID,
@@ -235,54 +226,3 @@ def get_artist_model(user: User) -> Model:
             get_template(AnkiCard.EXTRA_ARTIST_TEMPLATE_10, user),
         ],
     )
-
-
-def clean_album_name(name: str) -> str:
-    REGEXES: List[str] = [
-        " \\((\\d{4} )?Remaster(ed)?( \\d{4})?\\)$",
-        " \\((Super |25th Anniversary )?Deluxe( Edition)?(; Remaster)?\\)$",
-        " \\(Bonus Track Version\\)$",
-        " \\(The Remaster\\)$",
-        " \\(Big Machine Radio Release Special\\)$",
-        " \\((Wembley |Expanded )Edition\\)$",
-        " \\(Remastered( Version)?\\)$",
-        " \\(Radio Edit\\)$",
-        " \\(Without Dialogue\\)$",
-        " \\((Original Mono & )?Stereo (Mix )?Version(s)?\\)$",
-        " \\(Deluxe / Remastered 2015\\)$",
-        " \\(With Bonus Selections\\)$",
-        " \\(Benny Benassi Presents The Biz\\)",
-        " \\((Unmixed|The) Extended (Mixes|Versions)\\)",
-    ]
-    for regex in REGEXES:
-        name = re.sub(regex, "", name)
-    return name
-
-
-def clean_track_name(name: str) -> str:
-    REGEXES: List[str] = [
-        " - (\\d{4} )?(r|R)emaster(ed)?( \\d{4})?$",
-        " - (Stereo|Original)( Mix)?$",
-        " - Bonus Track$",
-        " - Radio Edit$",
-        " (\\(|\\[)(feat\\.|with).*?(\\)|\\])",
-        " - [A-z ]+ Remix",
-        " - [A-z ]+ (Radio )?Mix",
-        " - (\\d{4}|Stereo|Acoustic|Single) Version",
-        " - Panic! At The Disco Version",
-        " - With Introduction",
-        " \\(Remix\\)",
-        " - Remix",
-        " - Extended",
-        ' - From "[A-z ]+" Soundtrack',
-        " - Featured in [A-z ]+",
-        " - Avicii By Avicii",
-        " \\(Isak Original Extended\\) - Benny Benassi Presents The Biz",
-        " - Album Version / Stereo",
-        " - Live At The Lyceum, London/1975",
-        " - Edit",
-        " - Live at Folsom State Prison, Folsom, CA - January 1968",
-    ]
-    for regex in REGEXES:
-        name = re.sub(regex, "", name)
-    return name
@@ -1,19 +1,19 @@
-import json
 from typing import List
-from urllib.request import urlopen
 
 import genanki
+import requests
 from genanki import Deck
-from untappd import Untappd
+from untappd import Untappd, UntappdException
 
-from app import kv
-from app.card_generation.util import get_default_css, get_rs_anki_css, get_template, AnkiCard, zdNote
+from app import kv, http_client
+from app.card_generation.util import cached_model, get_default_css, get_rs_anki_css, get_template, AnkiCard, zdNote
 from app.models.base import User
 from app.util import JsonDict
 
 BEER_MODEL_ID = 1607000000000
 
 
+@cached_model()
 def get_beer_model(user):
     templates: List[JsonDict] = [
         get_template(AnkiCard.LABEL_TO_NAME, user),
@@ -42,10 +42,27 @@ def get_beer_model(user):
     )
 
 
+# The untappd library sends its requests with requests.get/post directly, which would bypass http_client's connection
+# reuse, retries and record/replay. This sends them through the shared session instead.
+class SharedSessionUntappd(Untappd):
+    class Requester(Untappd.Requester):
+        def _process_request(self, url, http_method, payload):
+            try:
+                if http_method == "GET":
+                    response = http_client.get_session().get(url, headers=self.headers, params=payload)
+                else:
+                    response = http_client.get_session().post(url, headers=self.headers, data=payload)
+            except requests.exceptions.RequestException as e:
+                raise UntappdException("Error connecting with Untappd API") from e
+            data = self._decode_json_response(response)
+            if response.status_code == requests.codes.ok:
+                return data
+            return self._check_response(data)
+
+
 def get_country(lat, lon):
     url = f"https://maps.googleapis.com/maps/api/geocode/json?latlng={lat},{lon}&key={kv.get('GOOGLE_MAPS_API_KEY')}"
-    v = urlopen(url).read()
-    j = json.loads(v)
+    j = http_client.get(url).json()
     components = j["results"][0]["address_components"]
     country = None
     for c in components:
@@ -54,15 +71,29 @@ def get_country(lat, lon):
     return country
 
 
-def generate_beer(user: User, deck: Deck, tags: List[str]) -> None:
-    client = Untappd(
+def _get_client() -> Untappd:
+    return SharedSessionUntappd(
         client_id=kv.get("UNTAPPD_CLIENT_ID"),
         client_secret=kv.get("UNTAPPD_CLIENT_SECRET"),
         redirect_url="https://www.zdone.co/",
     )
+
+
+def _get_beer_responses(client: Untappd, user: User) -> List[JsonDict]:
+    return client.user.beers(user.untappd_username)["response"]["beers"]["items"]
+
+
+# Changes whenever the user's list of beers does, at the cost of one request rather than two per beer. Details of beers
+# already on the list can change without this noticing; see SECTION_MAX_REUSE_AGE.
+def get_beer_version(user: User) -> str:
+    return ",".join(str(beer_response["beer"]["bid"]) for beer_response in _get_beer_responses(_get_client(), user))
+
+
+def generate_beer(user: User, deck: Deck, tags: List[str]) -> None:
+    client = _get_client()
     beer_model = get_beer_model(user)
 
-    for beer_response in client.user.beers(user.untappd_username)["response"]["beers"]["items"]:
+    for beer_response in _get_beer_responses(client, user):
         beer = client.beer.info(beer_response["beer"]["bid"])["response"]["beer"]
         brewery = beer["brewery"]
         label_image_src = beer["beer_label_hd"]
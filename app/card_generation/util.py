@@ -1,13 +1,14 @@
+import functools
 import re
 from enum import Enum
 from time import time
-from typing import List
+from typing import Callable, Dict, List, Tuple
 
 import genanki
 from jinja2 import Environment, PackageLoader, select_autoescape, StrictUndefined, TemplateNotFound
 from jsmin import jsmin
 
-from app.models.base import User
+from app.models.base import GateDef, User
 from app.util import JsonDict
 
 env: Environment = Environment(
@@ -90,6 +91,25 @@ class AnkiCard(Enum):
         )
 
 
+# Builds a model once per combination of the user settings it depends on: their API key & whether they use rsAnki, plus
+# the given gates. Later calls with the same settings, e.g. for other sections or other builds in the same nightly run,
+# get the same instance back. Decorated functions must not read anything else from the user.
+def cached_model(*gates: GateDef) -> Callable[[Callable[[User], genanki.Model]], Callable[[User], genanki.Model]]:
+    def decorator(get_model: Callable[[User], genanki.Model]) -> Callable[[User], genanki.Model]:
+        models: Dict[Tuple, genanki.Model] = {}
+
+        @functools.wraps(get_model)
+        def get_cached_model(user: User) -> genanki.Model:
+            key = (user.api_key, user.uses_rsAnki_javascript) + tuple(user.is_gated(gate) for gate in gates)
+            if key not in models:
+                models[key] = get_model(user)
+            return models[key]
+
+        return get_cached_model
+
+    return decorator
+
+
 class zdNote(genanki.Note):
     @property
     def guid(self):
@@ -129,6 +149,8 @@ def get_template(card_type: AnkiCard, user: User) -> JsonDict:
     }
 
 
+# Rendering is the bulk of building a model, and only depends on these arguments, so each combination is rendered once.
+@functools.lru_cache(maxsize=None)
 def render_template(card_type: AnkiCard, is_front: bool, api_key: str, rs_anki_enabled: bool) -> str:
     script_include = get_rs_anki_custom_script(is_front) if rs_anki_enabled else get_default_script()
 
@@ -155,10 +177,15 @@ def render_template(card_type: AnkiCard, is_front: bool, api_key: str, rs_anki_e
         raise e
 
 
+# The inline JavaScript is minified once, at import. Per-user & per-card values only appear inside string literals,
+# which minifying leaves alone, so they are written as placeholders and substituted into the minified code.
+API_KEY_PLACEHOLDER: str = "__ZDONE_API_KEY__"
+ID_FIELD_PLACEHOLDER: str = "__ZDONE_ID_FIELD__"
+TEMPLATE_NAME_PLACEHOLDER: str = "__ZDONE_TEMPLATE_NAME__"
+
 # see https://developers.google.com/youtube/iframe_api_reference for docs
-def get_minified_js_for_youtube_video() -> str:
-    return jsmin(
-        """
+_YOUTUBE_VIDEO_JS: str = jsmin(
+    """
   var tag = document.createElement('script');
 
   tag.src = "https://www.youtube.com/iframe_api";
@@ -188,23 +215,19 @@ def get_minified_js_for_youtube_video() -> str:
     event.target.mute();
     event.target.playVideo();
   }"""
-    )
-
+)
 
-def get_minified_js_for_review_log(api_key: str, card_type: AnkiCard) -> str:
-    return jsmin(
-        f"""
+_REVIEW_LOG_JS: str = jsmin(
+    f"""
 function logReview() {{
-  $.getScript("https://www.zdone.co/api/{api_key}/log/{{{{{card_type.id_field_name}}}}}/{card_type.name}");
+  $.getScript("https://www.zdone.co/api/{API_KEY_PLACEHOLDER}/log/{{{{{ID_FIELD_PLACEHOLDER}}}}}/{TEMPLATE_NAME_PLACEHOLDER}");
 }};
 logReview();
 """
-    )
-
+)
 
-def get_minified_js_for_song_jump(api_key: str) -> str:
-    return jsmin(
-        f"""
+_SONG_JUMP_JS: str = jsmin(
+    f"""
 function pr(data) {{
   if (typeof data.reason !== 'undefined') {{
     $("#error").html(data.reason);
@@ -215,7 +238,7 @@ function pr(data) {{
   }}
 }}
 function jump() {{
-  $.getScript("https://www.zdone.co/api/{api_key}/play/{{{{Track URI}}}}/pr");
+  $.getScript("https://www.zdone.co/api/{API_KEY_PLACEHOLDER}/play/{{{{Track URI}}}}/pr");
 }};
 jump();
 $(document).keypress(function(e) {{
@@ -224,9 +247,25 @@ $(document).keypress(function(e) {{
     }}
 }});
 """
+)
+
+
+def get_minified_js_for_youtube_video() -> str:
+    return _YOUTUBE_VIDEO_JS
+
+
+def get_minified_js_for_review_log(api_key: str, card_type: AnkiCard) -> str:
+    return (
+        _REVIEW_LOG_JS.replace(API_KEY_PLACEHOLDER, api_key)
+        .replace(ID_FIELD_PLACEHOLDER, str(card_type.id_field_name))
+        .replace(TEMPLATE_NAME_PLACEHOLDER, card_type.name)
     )
 
 
+def get_minified_js_for_song_jump(api_key: str) -> str:
+    return _SONG_JUMP_JS.replace(API_KEY_PLACEHOLDER, api_key)
+
+
 def get_rs_anki_custom_script(is_front) -> str:
     return f"""<script type="text/javascript" src="_jquery-1.11.2.min.js"></script>
 <div id="categoryIdentifier{"Front" if is_front else "Back"}">{{{{Tags}}}}</div>
@@ -9,6 +9,7 @@ from sqlalchemy import and_
 
 from app import db
 from app.card_generation.util import (
+    cached_model,
     zdNote,
     create_html_unordered_list,
     AnkiCard,
@@ -17,6 +18,7 @@ from app.card_generation.util import (
     get_default_css,
 )
 from app.log import log
+from app.util import get_rows_fingerprint
 from app.models.base import User
 from app.models.videos import Video, YouTubeVideoOverride, YouTubeVideo, VideoPerson, VideoCredit, ManagedVideo
 
@@ -32,6 +34,31 @@ where film_or_tv='{type}'"""
     return set([row[0] for row in list(db.engine.execute(sql))])
 
 
+# Changes whenever any row generate_videos reads does: the user's managed videos, everyone credited on them along with all
+# of their credits & the videos those are for, and the YouTube trailer data.
+def get_videos_version(user: User) -> str:
+    credited_sql = f"""
+select vc.person_id
+from video_credits vc
+         join managed_videos mv on vc.video_id = mv.video_id
+where mv.user_id = {user.id}"""
+    videos_sql = f"""
+select video_id from managed_videos where user_id = {user.id}
+union
+select video_id from video_credits where person_id in ({credited_sql})"""
+    return ",".join(
+        get_rows_fingerprint(sql)
+        for sql in [
+            f"select * from managed_videos where user_id = {user.id}",
+            f"select * from videos where id in ({videos_sql})",
+            f"select * from video_persons where id in ({credited_sql})",
+            f"select * from video_credits where person_id in ({credited_sql})",
+            "select * from youtube_video_overrides",
+            "select * from youtube_videos",
+        ]
+    )
+
+
 def generate_videos(user: User, deck: Deck, tags: List[str]) -> None:
     video_id_to_html_formatted_name_and_year: Dict[str, str] = {}
     films = get_video_type_ids("film")
@@ -223,6 +250,7 @@ group by 1, 2"""
         deck.add_note(person_as_note)
 
 
+@cached_model()
 def get_video_model(user: User) -> Model:
     return genanki.Model(
         VIDEO_MODEL_ID,
@@ -264,6 +292,7 @@ def get_video_model(user: User) -> Model:
     )
 
 
+@cached_model()
 def get_video_person_model(user: User) -> Model:
     return genanki.Model(
         VIDEO_PERSON_MODEL_ID,
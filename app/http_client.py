@@ -0,0 +1,128 @@
+import os
+import random
+import threading
+from typing import Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError
+
+from app import http_replay
+
+# Every outbound integration (Spotify, Readwise, TMDB, YouTube, HN, last.fm, Untappd, Google geocoding) goes through the
+# single session below, so TLS connections are kept alive and reused across calls and threads instead of re-negotiated
+# per request. Transient failures are retried here, which means callers should not wrap calls in their own retry loops.
+
+# (connect, read) seconds, used whenever the caller doesn't pass a timeout of its own
+DEFAULT_TIMEOUT: tuple = (5, 30)
+MAX_RETRIES: int = 5
+# exponential backoff is base * 2^(retry - 1), capped, then "full jitter" is applied (uniform between 0 and that value)
+BACKOFF_BASE_SECONDS: float = 0.5
+BACKOFF_MAX_SECONDS: float = 30
+# a Retry-After longer than this is more likely a daily quota than a short rate limit, so fail instead of sleeping
+MAX_RETRY_AFTER_SECONDS: int = 60
+RETRY_STATUSES: frozenset = frozenset([429, 500, 502, 503, 504])
+# any status in RETRY_STATUSES is retried for these. Other methods (playlist adds, starting playback, notifications) may
+# already have been applied when a 5xx comes back, so they're only retried on a 429, which means it wasn't processed.
+IDEMPOTENT_METHODS: frozenset = frozenset(["GET", "HEAD", "OPTIONS"])
+WRITE_RETRY_STATUSES: frozenset = frozenset([429])
+RETRY_METHODS: frozenset = frozenset(["GET", "HEAD", "OPTIONS", "POST", "PUT", "DELETE"])
+# maximum number of in-flight requests per host, across all threads. Also used as the connection pool size per host.
+DEFAULT_MAX_CONCURRENCY_PER_HOST: int = 8
+MAX_CONCURRENCY_PER_HOST: Dict[str, int] = {
+    "api.spotify.com": 10,
+    "hacker-news.firebaseio.com": 16,
+    "readwise.io": 2,
+    "maps.googleapis.com": 4,
+}
+# "live" (default), "record" to save every response as a fixture, or "replay" to answer every request from those
+# fixtures via the stand-in server in app.http_replay
+HTTP_MODE: str = os.environ.get("ZDONE_HTTP_MODE", "live")
+FIXTURES_DIR: str = os.environ.get("ZDONE_HTTP_FIXTURES_DIR", http_replay.DEFAULT_FIXTURES_DIR)
+REPLAY_URL: str = os.environ.get("ZDONE_HTTP_REPLAY_URL", f"http://127.0.0.1:{http_replay.DEFAULT_PORT}")
+
+
+class JitteredRetry(Retry):
+    def get_backoff_time(self) -> float:
+        consecutive_errors = len([h for h in self.history if h.redirect_location is None])
+        if consecutive_errors <= 1:
+            return 0
+        backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (consecutive_errors - 1)))
+        return random.uniform(0, backoff)
+
+    def is_retry(self, method, status_code, has_retry_after=False) -> bool:
+        if method.upper() not in IDEMPOTENT_METHODS and status_code not in WRITE_RETRY_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    # with raise_on_status=False, urllib3 hands the response back to the caller when increment gives up
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None:
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > MAX_RETRY_AFTER_SECONDS:
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After of {retry_after}s is too long to wait"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self) -> None:
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._semaphores_lock = threading.Lock()
+        super().__init__(
+            pool_connections=len(MAX_CONCURRENCY_PER_HOST) * 2,
+            pool_maxsize=max([DEFAULT_MAX_CONCURRENCY_PER_HOST] + list(MAX_CONCURRENCY_PER_HOST.values())),
+            max_retries=JitteredRetry(
+                total=MAX_RETRIES,
+                read=False,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=RETRY_METHODS,
+                respect_retry_after_header=True,
+                # hand the last response back to the caller rather than raising, so clients can surface API errors
+                raise_on_status=False,
+            ),
+        )
+
+    def _get_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._semaphores_lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(
+                    MAX_CONCURRENCY_PER_HOST.get(host, DEFAULT_MAX_CONCURRENCY_PER_HOST)
+                )
+            return self._semaphores[host]
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = DEFAULT_TIMEOUT
+        with self._get_semaphore(urlparse(request.url).hostname or ""):
+            if HTTP_MODE == "replay":
+                request.headers[http_replay.ORIGINAL_URL_HEADER] = request.url
+                request.url = REPLAY_URL + urlparse(request.url).path
+            response = super().send(request, **kwargs)
+            if HTTP_MODE == "record":
+                http_replay.save_fixture(FIXTURES_DIR, request, response)
+            return response
+
+
+class SharedSession(requests.Session):
+    def __init__(self) -> None:
+        super().__init__()
+        adapter = RateLimitedAdapter()
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    # spotipy closes its session when a client is garbage collected, which would tear down the pools for everyone else
+    def close(self) -> None:
+        pass
+
+
+_session = SharedSession()
+
+
+def get_session() -> requests.Session:
+    return _session
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return _session.get(url, **kwargs)
@@ -0,0 +1,191 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+
+# Record/replay for outbound HTTP, so that jobs like generate_full_apkg, the refresh crons and api_play_song can be
+# benchmarked end to end without network access, and reproducibly.
+#
+# With ZDONE_HTTP_MODE=record, every response that goes through app.http_client is saved as a fixture under
+# ZDONE_HTTP_FIXTURES_DIR. With ZDONE_HTTP_MODE=replay, app.http_client sends every request to the stand-in server at
+# ZDONE_HTTP_REPLAY_URL instead, which answers from those fixtures. Start the server with:
+#
+#     python -m app.http_replay --fixtures fixtures/http --latency-ms 50 --error-rate 0.01 --requests-per-second 20
+#
+# The server can add latency, fail a share of requests with a 503 and rate limit each host with a 429, and requests go
+# through http_client's normal retry & per-host concurrency handling, so those paths are exercised as well.
+
+DEFAULT_FIXTURES_DIR: str = "fixtures/http"
+DEFAULT_PORT: int = 8765
+# the request's real URL is passed to the stand-in server in this header
+ORIGINAL_URL_HEADER: str = "X-Zdone-Original-Url"
+# query parameters that hold credentials. They are left out of fixtures, which also lets fixtures recorded with one
+# set of credentials be replayed with another.
+SECRET_QUERY_PARAMS: frozenset = frozenset(["api_key", "key", "access_token", "client_secret"])
+# fields of JSON response bodies that hold credentials, e.g. the tokens returned by OAuth token endpoints. Their values
+# are replaced before fixtures are written, so on replay clients get back a placeholder, which the server ignores.
+SECRET_BODY_FIELDS: frozenset = frozenset(["access_token", "refresh_token", "id_token", "client_secret", "api_key"])
+REDACTED: str = "redacted"
+# response headers worth keeping; everything else (dates, cookies, request ids) would only make fixtures noisy
+KEPT_RESPONSE_HEADERS: frozenset = frozenset(["content-type", "location", "retry-after"])
+
+
+def _get_fixture_url(url: str) -> str:
+    parsed = urlparse(url)
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k not in SECRET_QUERY_PARAMS)
+    return parsed._replace(query=urlencode(query)).geturl()
+
+
+def _hash(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()[:16]
+
+
+# Fixtures are stored as <dir>/<host>/<method & url hash>-<body hash>.json. Bodies often contain values that change from
+# run to run (playback offsets, refresh tokens), so replay falls back to any fixture for the same method & url.
+def _get_fixture_path(fixtures_dir: str, method: str, url: str, body: Optional[bytes], any_body: bool = False) -> str:
+    fixture_url = _get_fixture_url(url)
+    url_hash = _hash(f"{method} {fixture_url}".encode())
+    body_hash = "*" if any_body else _hash(body or b"")
+    return os.path.join(fixtures_dir, urlparse(url).hostname or "", f"{url_hash}-{body_hash}.json")
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: REDACTED if k in SECRET_BODY_FIELDS and v else _redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _redact_content(content: str) -> str:
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return content
+    redacted = _redact(parsed)
+    # only re-serialized when something was redacted, so other responses are saved exactly as they were received
+    return json.dumps(redacted) if redacted != parsed else content
+
+
+def save_fixture(fixtures_dir: str, request: requests.PreparedRequest, response: requests.Response) -> None:
+    body = request.body.encode() if isinstance(request.body, str) else request.body
+    path = _get_fixture_path(fixtures_dir, request.method or "GET", request.url or "", body)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "method": request.method,
+                "url": _get_fixture_url(request.url or ""),
+                "status": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() in KEPT_RESPONSE_HEADERS},
+                "content": _redact_content(response.content.decode("utf-8", errors="replace")),
+            },
+            f,
+            indent=2,
+        )
+
+
+def load_fixture(fixtures_dir: str, method: str, url: str, body: Optional[bytes]) -> Optional[Dict]:
+    path = _get_fixture_path(fixtures_dir, method, url, body)
+    if not os.path.exists(path):
+        matches = sorted(glob.glob(_get_fixture_path(fixtures_dir, method, url, body, any_body=True)))
+        if not matches:
+            return None
+        path = matches[0]
+    with open(path) as f:
+        return json.load(f)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int,
+        fixtures_dir: str,
+        latency_ms: int = 0,
+        error_rate: float = 0,
+        requests_per_second: Optional[float] = None,
+    ):
+        super().__init__(("127.0.0.1", port), _ReplayHandler)
+        self.fixtures_dir = fixtures_dir
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.requests_per_second = requests_per_second
+        # per host: (start of the current one-second window, number of requests let through in it)
+        self._rate_limits: Dict[str, Tuple[float, int]] = {}
+        self._rate_limits_lock = threading.Lock()
+
+    def is_rate_limited(self, host: str) -> bool:
+        if self.requests_per_second is None:
+            return False
+        with self._rate_limits_lock:
+            window_start, count = self._rate_limits.get(host, (0.0, 0))
+            now = time.time()
+            if now - window_start >= 1:
+                window_start, count = now, 0
+            if count >= self.requests_per_second:
+                return True
+            self._rate_limits[host] = (window_start, count + 1)
+            return False
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        url = self.headers.get(ORIGINAL_URL_HEADER, "")
+        time.sleep(self.server.latency_ms / 1000)
+
+        if self.server.is_rate_limited(urlparse(url).hostname or ""):
+            self._respond(429, {"Retry-After": "1"}, "rate limited by replay server")
+        elif random.random() < self.server.error_rate:
+            self._respond(503, {}, "error injected by replay server")
+        elif fixture := load_fixture(self.server.fixtures_dir, self.command, url, body):
+            self._respond(fixture["status"], fixture["headers"], fixture["content"])
+        else:
+            self._respond(404, {}, f"no fixture recorded for {self.command} {_get_fixture_url(url)}")
+
+    def _respond(self, status: int, headers: Dict[str, str], content: str) -> None:
+        encoded = content.encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+# Starts a stand-in server in a background thread, e.g. for use in tests. Call shutdown() on the result to stop it.
+def start_replay_server(fixtures_dir: str, port: int = 0, **kwargs) -> ReplayServer:
+    server = ReplayServer(port, fixtures_dir, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded HTTP fixtures in place of external APIs.")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--requests-per-second", type=float, default=None, help="per host; unlimited if not given")
+    args = parser.parse_args()
+    print(f"Serving fixtures from {args.fixtures} at http://127.0.0.1:{args.port}")
+    ReplayServer(args.port, args.fixtures, args.latency_ms, args.error_rate, args.requests_per_second).serve_forever()
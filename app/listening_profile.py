@@ -0,0 +1,153 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from app import db
+from app.log import log
+from app.models.base import User
+from app.models.spotify import ArtistListeningProfile
+from app.name_cleaning import CLEANING_RULES_VERSION, clean_album_name, clean_track_name
+from app.util import chunker
+
+# Per-user, per-artist top tracks, albums & collaborators for artist notes. Rather than aggregating the user's whole play
+# history on every deck generation, every profile stores a hash of the rows it was computed from (the user's play totals
+# of the artist's tracks, along with those tracks' names, albums & featured artists), and only profiles whose hash has
+# changed are recomputed. The hash includes the cleaning rules version, so that a change to the rules, which changes
+# stored names, rebuilds every profile.
+
+# longest list stored of each kind; artist notes show at most 10
+PROFILE_LIST_LENGTH: int = 10
+ARTISTS_PER_CHUNK: int = 500
+
+
+# artist -> hash of the rows its profile is computed from, for every artist on a track the user played, including
+# featured artists, since they get a list of collaborators too. Reads the per-track play totals, which are updated along
+# with every play, rather than the plays themselves.
+def _get_profile_inputs_hashes(user: User) -> Dict[str, str]:
+    sql = f"""
+with played as (select spotify_track_uri as uri, plays
+                from spotify_play_totals
+                where user_id = {user.id}),
+     track_inputs as (select p.uri,
+                             concat_ws('|', p.plays, st.name, st.clean_name, st.spotify_artist_uri, sal.uri, sal.name,
+                                       sal.clean_name, sal.released_at, sal.album_type,
+                                       string_agg(sa.uri || ':' || sa.name, ',' order by sa.uri)) as inputs
+                      from played p
+                               join spotify_tracks st on p.uri = st.uri
+                               left join spotify_albums sal on st.spotify_album_uri = sal.uri
+                               left join spotify_features sf on p.uri = sf.spotify_track_uri
+                               left join spotify_artists sa on sf.spotify_artist_uri = sa.uri
+                      group by p.uri, p.plays, st.uri, sal.uri),
+     artist_tracks as (select st.spotify_artist_uri as artist_uri, st.uri
+                       from played p
+                                join spotify_tracks st on p.uri = st.uri
+                       union
+                       select sf.spotify_artist_uri, sf.spotify_track_uri
+                       from played p
+                                join spotify_features sf on p.uri = sf.spotify_track_uri)
+select at.artist_uri, md5('{CLEANING_RULES_VERSION}' || string_agg(ti.inputs, ',' order by ti.uri))
+from artist_tracks at
+         join track_inputs ti on at.uri = ti.uri
+group by 1"""
+    return {row[0]: row[1] for row in db.engine.execute(sql)}
+
+
+def _get_top_tracks(user: User, artist_uris: List[str]) -> Dict[str, List[str]]:
+    sql = f"""
+select spotify_artist_uri, st.name, st.clean_name
+from spotify_tracks st
+         join spotify_play_totals spt on st.uri = spt.spotify_track_uri
+where user_id = {user.id} and spotify_artist_uri = any(:artist_uris)
+order by spt.plays desc, st.uri"""
+    names: Dict[str, List[str]] = defaultdict(list)
+    for artist_uri, name, clean_name in db.engine.execute(text(sql), artist_uris=artist_uris):
+        # names are cleaned when tracks are stored; only rows from before that need cleaning here
+        names[artist_uri].append(clean_name or clean_track_name(name))
+    return {artist_uri: list(dict.fromkeys(tracks))[:PROFILE_LIST_LENGTH] for artist_uri, tracks in names.items()}
+
+
+def _get_top_albums(user: User, artist_uris: List[str]) -> Dict[str, List[Tuple[str, int]]]:
+    sql = f"""
+select distinct st.spotify_artist_uri, sal.uri, sal.name, sal.clean_name, sal.released_at
+from spotify_tracks st
+         join spotify_play_totals spt on st.uri = spt.spotify_track_uri
+         join spotify_albums sal on sal.uri = st.spotify_album_uri
+where user_id = {user.id} and album_type = 'album' and st.spotify_artist_uri = any(:artist_uris)
+order by 5 desc, 2"""
+    years: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for artist_uri, _, name, clean_name, released_at in db.engine.execute(text(sql), artist_uris=artist_uris):
+        years[artist_uri][clean_name or clean_album_name(name)] = released_at.year
+    return {artist_uri: list(albums.items())[:PROFILE_LIST_LENGTH] for artist_uri, albums in years.items()}
+
+
+def _get_top_collaborators(user: User, artist_uris: List[str]) -> Dict[str, List[str]]:
+    sql = f"""
+with plays_per_song as (select sf.spotify_artist_uri, spt.spotify_track_uri as uri, spt.plays as plays_for_song
+                        from spotify_play_totals spt
+                                 join spotify_features sf on spt.spotify_track_uri = sf.spotify_track_uri
+                        where user_id = {user.id} and sf.spotify_artist_uri = any(:artist_uris))
+select pps.spotify_artist_uri, sa.name, sum(plays_for_song)
+from plays_per_song pps
+         join spotify_features sf on pps.uri = sf.spotify_track_uri
+         join spotify_artists sa on sf.spotify_artist_uri = sa.uri
+where sf.spotify_artist_uri != pps.spotify_artist_uri
+group by 1, 2
+order by 1 asc, 3 desc, 2 asc"""
+    names: Dict[str, List[str]] = defaultdict(list)
+    for artist_uri, name, _ in db.engine.execute(text(sql), artist_uris=artist_uris):
+        names[artist_uri].append(name)
+    return {artist_uri: collaborators[:PROFILE_LIST_LENGTH] for artist_uri, collaborators in names.items()}
+
+
+# Returns the number of profiles recomputed. Commits.
+def refresh_artist_listening_profiles(user: User) -> int:
+    inputs_hashes = _get_profile_inputs_hashes(user)
+    stored_hashes = {
+        row[0]: row[1]
+        for row in db.session.query(ArtistListeningProfile.artist_uri, ArtistListeningProfile.inputs_hash).filter_by(
+            user_id=user.id
+        )
+    }
+    artist_uris = sorted(uri for uri, inputs_hash in inputs_hashes.items() if stored_hashes.get(uri) != inputs_hash)
+    # artists that are no longer on any track the user played, e.g. once a track's featured artists were corrected
+    gone = sorted(set(stored_hashes) - set(inputs_hashes))
+    if not artist_uris and not gone:
+        return 0
+
+    now = datetime.utcnow()
+    for chunk in chunker(gone, ARTISTS_PER_CHUNK):
+        ArtistListeningProfile.query.filter(
+            ArtistListeningProfile.user_id == user.id, ArtistListeningProfile.artist_uri.in_(chunk)  # type: ignore
+        ).delete(synchronize_session=False)
+    for chunk in chunker(artist_uris, ARTISTS_PER_CHUNK):
+        top_tracks = _get_top_tracks(user, chunk)
+        top_albums = _get_top_albums(user, chunk)
+        top_collaborators = _get_top_collaborators(user, chunk)
+        ArtistListeningProfile.query.filter(
+            ArtistListeningProfile.user_id == user.id, ArtistListeningProfile.artist_uri.in_(chunk)  # type: ignore
+        ).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(
+            ArtistListeningProfile,
+            [
+                {
+                    "user_id": user.id,
+                    "artist_uri": artist_uri,
+                    "top_tracks_json": json.dumps(top_tracks.get(artist_uri, [])),
+                    "top_albums_json": json.dumps(top_albums.get(artist_uri, [])),
+                    "top_collaborators_json": json.dumps(top_collaborators.get(artist_uri, [])),
+                    "refreshed_at": now,
+                    "inputs_hash": inputs_hashes[artist_uri],
+                }
+                for artist_uri in chunk
+            ],
+        )
+    db.session.commit()
+    log(f"Refreshed {len(artist_uris)} and removed {len(gone)} artist listening profiles for user {user.username}.")
+    return len(artist_uris)
+
+
+def get_artist_listening_profiles(user: User) -> Dict[str, ArtistListeningProfile]:
+    return {profile.artist_uri: profile for profile in ArtistListeningProfile.query.filter_by(user_id=user.id).all()}
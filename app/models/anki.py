@@ -1,4 +1,7 @@
 import datetime
+from typing import Optional
+
+from sqlalchemy import UniqueConstraint
 
 from app import db
 from app.models.base import BaseModel
@@ -16,6 +19,42 @@ class ApkgGeneration(BaseModel):
     file_size: int = db.Column(db.BigInteger, nullable=False)
     # the number of notes in this package, used to notify users when their newly generated deck has new notes
     notes: int = db.Column(db.Integer, nullable=False)
+    # hash of the note manifest this package was built from; if tonight's manifest hashes the same, the package would be
+    # identical to this one, so packaging & uploading are skipped
+    manifest_hash: Optional[str] = db.Column(db.Text, nullable=True)
+
+
+# one row per note in a user's most recently uploaded package, used to tell which notes changed since then
+class AnkiNoteManifestEntry(BaseModel):
+    __tablename__ = "anki_note_manifest_entries"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    guid: str = db.Column(db.Text, nullable=False)
+    # the generate_full_apkg section that produced the note, e.g. 'tracks'
+    section: str = db.Column(db.Text, nullable=False)
+    # hash of the note's fields, tags & model
+    note_hash: str = db.Column(db.Text, nullable=False)
+    # the note itself, so that a section that fails to generate can reuse its notes from the last package
+    model_id: int = db.Column(db.BigInteger, nullable=True)
+    # JSON lists of strings
+    fields: str = db.Column(db.Text, nullable=True)
+    tags: str = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (UniqueConstraint("user_id", "guid", name="_user_id_and_guid"),)
+
+
+# a version of the inputs each section of a user's deck was last generated from (see Section.get_version); if tonight's
+# version matches, the section's notes are reused from the manifest instead of being generated again
+class AnkiSectionVersion(BaseModel):
+    __tablename__ = "anki_section_versions"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    section: str = db.Column(db.Text, nullable=False)
+    version: str = db.Column(db.Text, nullable=False)
+    # when the section was last actually generated, always UTC
+    generated_at: datetime.datetime = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (UniqueConstraint("user_id", "section", name="_user_id_and_section"),)
 
 
 class AnkiReviewLog(BaseModel):
@@ -1,3 +1,4 @@
+import datetime
 import enum
 from typing import Optional
 
@@ -61,8 +62,12 @@ class User(UserMixin, BaseModel):
 
     spotify_token_json: str = db.Column(db.String(1024))
     spotify_playlist_uri: Optional[str] = db.Column(db.String(128), unique=True, nullable=True)
+    # snapshot of the playlist as of our last sync. If Spotify reports a different one, the playlist was edited elsewhere
+    spotify_playlist_snapshot_id: Optional[str] = db.Column(db.String(128), nullable=True)
     last_spotify_track: Optional[str] = db.Column(db.String(128), db.ForeignKey("spotify_tracks.uri"), nullable=True)
     last_random_play_offset: Optional[int] = db.Column(db.Integer, nullable=True)
+    # always UTC. Last time all saved tracks were re-downloaded to catch tracks that were removed from the library.
+    last_saved_tracks_full_sync: Optional[datetime.datetime] = db.Column(db.DateTime, nullable=True)
 
     last_fm_username: str = db.Column(db.String(128), unique=True)
     last_fm_last_refresh_time = db.Column(db.DateTime)
@@ -15,6 +15,8 @@ class SpotifyArtist(BaseModel):
     good_image: bool = db.Column(db.Boolean, nullable=False, server_default="false")
     image_override_name: str = db.Column(db.String(128), nullable=True)
     last_top_tracks_refresh: datetime.datetime = db.Column(db.DateTime, nullable=True)
+    # app.spotify.uniform_artist_name(name), used to match artists with last.fm. Computed on insert.
+    normalized_name: Optional[str] = db.Column(db.Text, nullable=True, index=True)
 
     def get_bare_uri(self):
         return self.uri.split("spotify:artist:")[1]
@@ -44,6 +46,9 @@ class SpotifyAlbum(BaseModel):
     album_type: str = db.Column(db.String(128), nullable=False)
     spotify_image_url: str = db.Column(db.Text)
     released_at: Optional[datetime.date] = db.Column(db.Date, nullable=True)
+    # app.name_cleaning.clean_album_name(name), under rules version clean_name_version
+    clean_name: Optional[str] = db.Column(db.Text, nullable=True)
+    clean_name_version: Optional[int] = db.Column(db.Integer, nullable=True)
 
     def get_bare_uri(self):
         return self.uri.split("spotify:album:")[1]
@@ -56,7 +61,15 @@ class SpotifyTrack(BaseModel):
     spotify_artist_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_artists.uri"), nullable=False)
     spotify_album_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_albums.uri"), nullable=False)
     duration_milliseconds: int = db.Column(db.Integer, nullable=False)
-    api_response: str = db.Column(db.Text)  # simple dump of the exact json that was returned by the API
+    # simple dump of the exact json that was returned by the API. Deferred since it's several KB per track and the fields
+    # we actually use are also stored in columns here and on the album/artist tables; load it explicitly when needed.
+    api_response: str = db.deferred(db.Column(db.Text))
+    # whether the track can be played in the US market, as of playability_checked_at. null if never checked
+    is_playable: Optional[bool] = db.Column(db.Boolean, nullable=True)
+    playability_checked_at: Optional[datetime.datetime] = db.Column(db.DateTime, nullable=True)
+    # app.name_cleaning.clean_track_name(name), under rules version clean_name_version
+    clean_name: Optional[str] = db.Column(db.String(1024), nullable=True)
+    clean_name_version: Optional[int] = db.Column(db.Integer, nullable=True)
 
 
 class SpotifyFeature(BaseModel):
@@ -79,6 +92,95 @@ class SpotifyPlay(BaseModel):
     created_at: datetime.datetime = db.Column(db.DateTime, nullable=False)
 
 
+# Rollups of spotify_plays, kept up to date as plays are recorded (see app.spotify.record_spotify_play) so that
+# listening stats don't have to re-aggregate the whole play history. Days are the date of SpotifyPlay.created_at.
+class SpotifyPlayDaily(BaseModel):
+    __tablename__ = "spotify_play_daily"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    day: datetime.date = db.Column(db.Date, nullable=False)
+    spotify_track_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_tracks.uri"), nullable=False)
+    plays: int = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "spotify_track_uri", name="_user_id_day_and_spotify_track_uri"),
+    )
+
+
+class SpotifyPlayTotal(BaseModel):
+    __tablename__ = "spotify_play_totals"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    spotify_track_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_tracks.uri"), nullable=False)
+    first_played_on: datetime.date = db.Column(db.Date, nullable=False)
+    plays: int = db.Column(db.Integer, nullable=False)
+    __table_args__ = (UniqueConstraint("user_id", "spotify_track_uri", name="_user_id_and_played_spotify_track_uri"),)
+
+
+# Each user's all-time last.fm playcount per artist, keyed by uniform_artist_name so it can be joined to SpotifyArtist
+class LastFmArtistPlaycount(BaseModel):
+    __tablename__ = "last_fm_artist_playcounts"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    normalized_name: str = db.Column(db.Text, nullable=False)
+    playcount: int = db.Column(db.Integer, nullable=False)
+    __table_args__ = (UniqueConstraint("user_id", "normalized_name", name="_user_id_and_normalized_name"),)
+
+
+# Mirror of the contents of each user's "Anki Plays" playlist, kept up to date by app.spotify.update_spotify_anki_playlist.
+# There's deliberately no foreign key on the track uri: the playlist can be edited outside of zdone, so it may contain
+# tracks that we have never stored.
+class SpotifyPlaylistTrack(BaseModel):
+    __tablename__ = "spotify_playlist_tracks"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    spotify_track_uri: str = db.Column(db.String(128), nullable=False)
+    __table_args__ = (UniqueConstraint("user_id", "spotify_track_uri", name="_user_id_and_playlist_spotify_track_uri"),)
+
+
+# Mirror of each user's Spotify "Liked Songs", kept up to date by app.spotify.sync_saved_tracks
+class SpotifySavedTrack(BaseModel):
+    __tablename__ = "spotify_saved_tracks"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    spotify_track_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_tracks.uri"), nullable=False)
+    # always UTC, as returned by Spotify
+    added_at: datetime.datetime = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint("user_id", "spotify_track_uri", name="_user_id_and_saved_spotify_track_uri"),)
+
+
+# Precomputed figures for the /spotify page, so it doesn't run several aggregate queries on every render. Refreshed by
+# app.spotify.refresh_music_dashboard_stats nightly and whenever the user's follows change.
+class MusicDashboardStats(BaseModel):
+    __tablename__ = "music_dashboard_stats"
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    percent_best_selling: int = db.Column(db.Integer, nullable=False)
+    percent_most_streamed: int = db.Column(db.Integer, nullable=False)
+    percent_highest_certified: int = db.Column(db.Integer, nullable=False)
+    # JSON lists of [name, bare uri] pairs
+    recommendations_json: str = db.Column(db.Text, nullable=False)
+    next_to_follow_json: str = db.Column(db.Text, nullable=False)
+    refreshed_at: datetime.datetime = db.Column(db.DateTime, nullable=False)
+
+
+# What generate_artists shows for each artist a user has listened to, kept up to date by
+# app.listening_profile.refresh_artist_listening_profiles
+class ArtistListeningProfile(BaseModel):
+    __tablename__ = "artist_listening_profiles"
+    id: int = db.Column(db.Integer, primary_key=True)
+    user_id: int = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    artist_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_artists.uri"), nullable=False)
+    # JSON list of cleaned track names, most played first
+    top_tracks_json: str = db.Column(db.Text, nullable=False)
+    # JSON list of [cleaned album name, release year] pairs, most recently released first
+    top_albums_json: str = db.Column(db.Text, nullable=False)
+    # JSON list of names of other artists on the user's plays of this artist's tracks, most played first
+    top_collaborators_json: str = db.Column(db.Text, nullable=False)
+    refreshed_at: datetime.datetime = db.Column(db.DateTime, nullable=False)
+    # hash of every row the profile was computed from, so that it's recomputed once any of them change
+    inputs_hash: Optional[str] = db.Column(db.Text, nullable=True)
+    __table_args__ = (UniqueConstraint("user_id", "artist_uri", name="_user_id_and_artist_uri"),)
+
+
 class TopTrack(BaseModel):
     __tablename__ = "top_tracks"
     id: int = db.Column(db.Integer, primary_key=True)
@@ -93,6 +195,22 @@ class TopTrack(BaseModel):
     )
 
 
+# The artists most similar to each artist, by cosine similarity of who follows & plays them. Recomputed nightly by
+# app.artist_similarity.refresh_artist_similarities.
+class SpotifyArtistSimilarity(BaseModel):
+    __tablename__ = "spotify_artist_similarities"
+    id: int = db.Column(db.Integer, primary_key=True)
+    artist_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_artists.uri"), nullable=False)
+    similar_artist_uri: str = db.Column(db.String(128), db.ForeignKey("spotify_artists.uri"), nullable=False)
+    similarity: float = db.Column(db.Float, nullable=False)
+    ordinal: int = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        UniqueConstraint("artist_uri", "similar_artist_uri"),
+        UniqueConstraint("artist_uri", "ordinal"),
+        CheckConstraint("ordinal >= 1"),
+    )
+
+
 class BestSellingArtist(BaseModel):
     __tablename__ = "best_selling_artists"
     id: int = db.Column(db.Integer, primary_key=True)
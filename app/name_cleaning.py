@@ -0,0 +1,83 @@
+import functools
+import re
+from typing import List, Pattern
+
+# Strips remaster/edition/featuring suffixes from Spotify track & album names, so cards show e.g. "Hey Jude" instead of
+# "Hey Jude - Remastered 2015". Cleaned names are stored on SpotifyTrack & SpotifyAlbum when rows are inserted.
+#
+# Bump CLEANING_RULES_VERSION whenever either rule list changes: rows cleaned under an older version are re-cleaned by
+# reclean_names in app.spotify.
+CLEANING_RULES_VERSION: int = 1
+
+ALBUM_NAME_RULES: List[str] = [
+    " \\((\\d{4} )?Remaster(ed)?( \\d{4})?\\)$",
+    " \\((Super |25th Anniversary )?Deluxe( Edition)?(; Remaster)?\\)$",
+    " \\(Bonus Track Version\\)$",
+    " \\(The Remaster\\)$",
+    " \\(Big Machine Radio Release Special\\)$",
+    " \\((Wembley |Expanded )Edition\\)$",
+    " \\(Remastered( Version)?\\)$",
+    " \\(Radio Edit\\)$",
+    " \\(Without Dialogue\\)$",
+    " \\((Original Mono & )?Stereo (Mix )?Version(s)?\\)$",
+    " \\(Deluxe / Remastered 2015\\)$",
+    " \\(With Bonus Selections\\)$",
+    " \\(Benny Benassi Presents The Biz\\)",
+    " \\((Unmixed|The) Extended (Mixes|Versions)\\)",
+]
+
+TRACK_NAME_RULES: List[str] = [
+    " - (\\d{4} )?(r|R)emaster(ed)?( \\d{4})?$",
+    " - (Stereo|Original)( Mix)?$",
+    " - Bonus Track$",
+    " - Radio Edit$",
+    " (\\(|\\[)(feat\\.|with).*?(\\)|\\])",
+    " - [A-z ]+ Remix",
+    " - [A-z ]+ (Radio )?Mix",
+    " - (\\d{4}|Stereo|Acoustic|Single) Version",
+    " - Panic! At The Disco Version",
+    " - With Introduction",
+    " \\(Remix\\)",
+    " - Remix",
+    " - Extended",
+    ' - From "[A-z ]+" Soundtrack',
+    " - Featured in [A-z ]+",
+    " - Avicii By Avicii",
+    " \\(Isak Original Extended\\) - Benny Benassi Presents The Biz",
+    " - Album Version / Stereo",
+    " - Live At The Lyceum, London/1975",
+    " - Edit",
+    " - Live at Folsom State Prison, Folsom, CA - January 1968",
+]
+
+# number of distinct names whose cleaned form is remembered, per rule set
+CACHE_SIZE: int = 2 ** 16
+
+
+class NameCleaner:
+    def __init__(self, rules: List[str]):
+        self._rules: List[Pattern] = [re.compile(rule) for rule in rules]
+        # Most names match no rule at all, so a single search over the alternation of every rule settles them in one
+        # pass. Names that do match still go through the rules one at a time, in order, since each rule applies to the
+        # output of the previous one.
+        self._any_rule: Pattern = re.compile("|".join(f"(?:{rule})" for rule in rules))
+        self.clean = functools.lru_cache(maxsize=CACHE_SIZE)(self._clean)
+
+    def _clean(self, name: str) -> str:
+        if not self._any_rule.search(name):
+            return name
+        for rule in self._rules:
+            name = rule.sub("", name)
+        return name
+
+
+_album_name_cleaner = NameCleaner(ALBUM_NAME_RULES)
+_track_name_cleaner = NameCleaner(TRACK_NAME_RULES)
+
+
+def clean_album_name(name: str) -> str:
+    return _album_name_cleaner.clean(name)
+
+
+def clean_track_name(name: str) -> str:
+    return _track_name_cleaner.clean(name)
@@ -1,19 +1,19 @@
-import requests
 from requests import Response
 from sentry_sdk import capture_exception
 
-from app import db
+from app import db, http_client
 from app.log import log
 from app.models.base import User
 from app.models.books import ReadwiseBook, ManagedReadwiseBook, ReadwiseHighlight
-from app.util import JsonDict
+from app.util import JsonDict, get_missing_keys
 
 READWISE_BASE_URL = "https://readwise.io/api/v2"
 
 
-def upsert_book(user: User, book: JsonDict):
+# is_new lets callers that already know (via get_missing_keys) that the book isn't in the database skip the lookup
+def upsert_book(user: User, book: JsonDict, is_new: bool = False):
     id = f'zdone:book:readwise:{book["id"]}'
-    maybe_book = ReadwiseBook.query.filter_by(id=id).one_or_none()
+    maybe_book = None if is_new else ReadwiseBook.query.filter_by(id=id).one_or_none()
     if not maybe_book:
         maybe_book = ReadwiseBook()
         db.session.add(maybe_book)
@@ -33,7 +33,7 @@ def upsert_book(user: User, book: JsonDict):
     db.session.commit()
 
 
-def upsert_highlight(user: User, highlight: JsonDict):
+def upsert_highlight(user: User, highlight: JsonDict, is_new: bool = False):
     id = f'zdone:highlight:readwise:{highlight["id"]}'
     corresponding_managed_book_id = (
         ManagedReadwiseBook.query.filter_by(
@@ -43,7 +43,7 @@ def upsert_highlight(user: User, highlight: JsonDict):
         .id
     )
 
-    maybe_highlight = ReadwiseHighlight.query.filter_by(id=id).one_or_none()
+    maybe_highlight = None if is_new else ReadwiseHighlight.query.filter_by(id=id).one_or_none()
     if not maybe_highlight:
         maybe_highlight = ReadwiseHighlight()
         db.session.add(maybe_highlight)
@@ -66,20 +66,13 @@ def upsert_highlight(user: User, highlight: JsonDict):
 
 
 def get(user: User, endpoint: str, page: int = 1) -> Response:
-    tries = 0
-    saved_exception = None
     headers = {"Authorization": f"Token {user.readwise_access_token}"}
     query_string = {"page_size": 1000, "page": page}
 
-    while tries < 10:
-        tries += 1
-        try:
-            return requests.get(url=f"{READWISE_BASE_URL}/{endpoint}/", headers=headers, params=query_string)
-        except Exception as e:
-            saved_exception = e
-            continue
-    if saved_exception:
-        capture_exception(saved_exception)
+    try:
+        return http_client.get(url=f"{READWISE_BASE_URL}/{endpoint}/", headers=headers, params=query_string)
+    except Exception as e:
+        capture_exception(e)
     return Response()
 
 
@@ -106,9 +99,15 @@ def refresh_highlights_and_books(user: User) -> None:
         return
 
     log(f"Refreshing all books...")
-    for book in get_paginated(user, "books"):
-        upsert_book(user, book)
+    books = get_paginated(user, "books")
+    new_book_ids = get_missing_keys(ReadwiseBook.id, [f'zdone:book:readwise:{book["id"]}' for book in books])
+    for book in books:
+        upsert_book(user, book, f'zdone:book:readwise:{book["id"]}' in new_book_ids)
 
     log(f"Refreshing all highlights...")
-    for highlight in get_paginated(user, "highlights"):
-        upsert_highlight(user, highlight)
+    highlights = get_paginated(user, "highlights")
+    new_highlight_ids = get_missing_keys(
+        ReadwiseHighlight.id, [f'zdone:highlight:readwise:{highlight["id"]}' for highlight in highlights]
+    )
+    for highlight in highlights:
+        upsert_highlight(user, highlight, f'zdone:highlight:readwise:{highlight["id"]}' in new_highlight_ids)
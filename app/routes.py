@@ -36,11 +36,9 @@ from .spotify import (
     follow_unfollow_artists,
     get_random_song_family,
     get_tracks,
-    get_top_recommendations,
     get_artists_images,
     populate_null,
-    get_percentage_best_selling_artists,
-    get_next_to_follow,
+    get_music_dashboard_stats,
 )
 from .taskutils import do_update_task, ensure_trello_setup_idempotent, api_get
 from .util import (
@@ -176,7 +174,7 @@ def spotify():
     uris = []
     total_tracks = 0
     if "total_track_counts" in request.args:
-        tracks = get_tracks(current_user)
+        tracks = list(get_tracks(current_user))
         total_tracks = len(set([t["uri"] for t in tracks]))
         for track in tracks:
             for artist in track["artists"]:
@@ -194,30 +192,24 @@ def spotify():
         )
         for managed_artist, artist in managed_artists
     ]
-    recommendations = get_top_recommendations(current_user)[:3]
-
+    stats = get_music_dashboard_stats(current_user)
     next_artists_to_follow = [
-        f'<a href="https://open.spotify.com/artist/{a[1]}">{a[0]}</a>' for a in get_next_to_follow(current_user)[:3]
+        f'<a href="https://open.spotify.com/artist/{uri}">{name}</a>'
+        for name, uri in json.loads(stats.next_to_follow_json)
     ]
 
     return render_template(
         "spotify.html",
         navigation=get_navigation(current_user, "Music"),
         managed_artists=to_return,
-        percent_top_artists_sales_formatted=get_percentage_best_selling_artists(
-            current_user, "https://en.wikipedia.org/wiki/List_of_best-selling_music_artists"
-        ),
-        percent_top_artists_streams_formatted=get_percentage_best_selling_artists(
-            current_user, "https://en.wikipedia.org/wiki/List_of_most-streamed_artists_on_Spotify"
-        ),
-        percent_top_artists_certifications_formatted=get_percentage_best_selling_artists(
-            current_user, "https://en.wikipedia.org/wiki/List_of_highest-certified_music_artists_in_the_United_States"
-        ),
+        percent_top_artists_sales_formatted=stats.percent_best_selling,
+        percent_top_artists_streams_formatted=stats.percent_most_streamed,
+        percent_top_artists_certifications_formatted=stats.percent_highest_certified,
         next_artists_to_follow=", ".join(next_artists_to_follow),
         totals_given="total_track_counts" in request.args,
         total_tracks=total_tracks,
         total_artists=len(artists_dict.keys()),
-        recommendations=recommendations,
+        recommendations=[tuple(r) for r in json.loads(stats.recommendations_json)],
         show_last_fm_plays=current_user.last_fm_last_refresh_time is not None,
         internal_user=(current_user.is_gated(GateDef.INTERNAL_USER)),
     )
@@ -360,7 +352,7 @@ def api_play_song(api_key, track_uri, callback_function_name):
         return api_key_failure()
     offset = request.args.get("offset") if "offset" in request.args else None
     try:
-        play_track(request.url, track_uri, user, offset)
+        play_track(request.url, track_uri, user, offset, fast_path=True)
     except Exception as e:
         if "No active device found" in repr(e):
             return jsonp(
@@ -1,30 +1,19 @@
-import json
 from datetime import datetime, timedelta
 
-import requests
 from sqlalchemy import or_, and_
 
-from app import kv, db
+from app import kv, db, http_client
 from app.log import log
 from app.models.hn import HnStory
 
-MAX_ITEM_RETRIES = 3
-
-
+# transient failures are already retried with backoff by http_client
 def get_item(item_id):
-    try_count = 0
-    while try_count < MAX_ITEM_RETRIES:
-        try_count += 1
-        try:
-            response = json.loads(
-                requests.get(f"https://hacker-news.firebaseio.com/v0/item/{item_id}.json?print=pretty").text
-            )
-            if response and response["type"] == "story" and "deleted" not in response:
-                return response
-            else:
-                break
-        except Exception as e:
-            log(f"Received exception {e}. Will re-try item {item_id} {MAX_ITEM_RETRIES - try_count} more times.")
+    try:
+        response = http_client.get(f"https://hacker-news.firebaseio.com/v0/item/{item_id}.json").json()
+        if response and response["type"] == "story" and "deleted" not in response:
+            return response
+    except Exception as e:
+        log(f"Received exception {e} for item {item_id}.")
     return None
 
 
@@ -73,7 +62,7 @@ if __name__ == "__main__":
 
     log("Beginning new story update...")
     current_item = int(kv.get("HN_ITEM_OFFSET"))
-    max_item = int(requests.get("https://hacker-news.firebaseio.com/v0/maxitem.json").text)
+    max_item = int(http_client.get("https://hacker-news.firebaseio.com/v0/maxitem.json").text)
     total_to_do = max_item - current_item
     log(f"Current max is #{max_item}, which is {total_to_do} ahead of current item #{current_item}.")
     while current_item < max_item:
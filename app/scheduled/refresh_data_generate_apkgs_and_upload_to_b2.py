@@ -1,17 +1,25 @@
-import os
 import uuid
 from datetime import datetime
 
 from sentry_sdk import capture_exception
 from spotipy import SpotifyException
 
-from app import app, db
-from app.card_generation.anki import generate_full_apkg
+from app import db
+from app.artist_similarity import refresh_artist_similarities
+from app.card_generation.anki import (
+    generate_deck,
+    get_manifest_hash,
+    get_saved_manifest,
+    log_manifest_changes,
+    save_manifest,
+    save_section_versions,
+    upload_apkg,
+)
 from app.log import log
 from app.models.anki import ApkgGeneration
 from app.models.base import User, GateDef
 from app.readwise import refresh_highlights_and_books
-from app.spotify import follow_unfollow_artists
+from app.spotify import follow_unfollow_artists, refresh_music_dashboard_stats, reclean_names
 from app.themoviedb import refresh_videos
 from app.util import get_b2_api, get_pushover_client
 
@@ -21,6 +29,8 @@ def refresh_user(user: User):
         log(f"Beginning refresh of followed Spotify artists for user {user.username}...")
         try:
             follow_unfollow_artists(user)
+            # recommendations depend on other users' follows & scrobbles, so refresh even if this user's didn't change
+            refresh_music_dashboard_stats(user)
             log(f"Successfully completed Spotify artist refresh for user {user.username}.")
         except SpotifyException as e:
             log(f"Received SpotifyException during artist refresh for user {user.username}!")
@@ -52,21 +62,34 @@ def refresh_user(user: User):
 
     if user.is_gated(GateDef.INTERNAL_USER):
         log(f"Beginning generation of Anki package file (.apkg) for user {user.username}...")
-        filename: str = os.path.join(app.instance_path, f"anki-export-{user.username}.apkg")
-        os.makedirs(app.instance_path, exist_ok=True)
-        notes = generate_full_apkg(user, filename)
+        deck, manifest, section_versions = generate_deck(user)
+        notes = len(deck.notes)
+        manifest_hash = get_manifest_hash(manifest)
+        latest_generation = (
+            ApkgGeneration.query.filter_by(user_id=user.id).order_by(ApkgGeneration.at.desc()).first()  # type: ignore
+        )
         if notes == 0:
             log(f"0 notes were generated for user {user.username}. Will not upload to B2.")
+        elif latest_generation and latest_generation.manifest_hash == manifest_hash:
+            log(
+                f"None of the {notes} notes changed since the last apkg for user {user.username}. Will not upload to B2."
+            )
+            # the saved manifest already matches these notes, so they can be reused as of tonight's versions
+            save_section_versions(user, section_versions)
+            db.session.commit()
         else:
-            log(f"Successfully generated apkg with {notes} notes. Beginning upload to B2...")
+            previous_manifest = get_saved_manifest(user)
+            log_manifest_changes(previous_manifest, manifest)
+            log(f"Successfully generated deck with {notes} notes. Beginning packaging & upload to B2...")
             b2_api = get_b2_api()
 
             at = datetime.utcnow()
             b2_filename = f'{at.strftime("%Y%m%d")}-{user.username}-{uuid.uuid4()}.apkg'
-            b2_file = b2_api.get_bucket_by_name("zdone-apkgs").upload_local_file(
-                local_file=filename,
-                file_name=b2_filename,
-                file_infos={
+            b2_file = upload_apkg(
+                deck,
+                b2_api.get_bucket_by_name("zdone-apkgs"),
+                b2_filename,
+                {
                     "user": user.username,
                     "user_id": str(user.id),
                     "note_count": str(notes),
@@ -80,9 +103,17 @@ def refresh_user(user: User):
             )
             db.session.add(
                 ApkgGeneration(
-                    user_id=user.id, at=at, b2_file_id=id, b2_file_name=b2_filename, file_size=size, notes=notes
+                    user_id=user.id,
+                    at=at,
+                    b2_file_id=id,
+                    b2_file_name=b2_filename,
+                    file_size=size,
+                    notes=notes,
+                    manifest_hash=manifest_hash,
                 )
             )
+            save_manifest(user, previous_manifest, manifest, deck)
+            save_section_versions(user, section_versions)
             db.session.commit()
 
             log(f"Successfully completed apkg generation & upload for user {user.username}.")
@@ -101,6 +132,15 @@ def refresh_user(user: User):
 
 
 if __name__ == "__main__":
+    # before refreshing users, since their dashboard recommendations are read from the similarities & their decks from
+    # the cleaned names
+    for job in [refresh_artist_similarities, reclean_names]:
+        try:
+            job()
+        except Exception as e:
+            log(f"Received unexpected exception in {job.__name__}:")
+            log(repr(e))
+            capture_exception(e)
     for user in db.session.query(User).order_by(User.id.asc()).all():  # type: ignore
         try:
             refresh_user(user)
@@ -0,0 +1,24 @@
+import datetime
+
+from sentry_sdk import capture_exception
+
+from app.log import log
+from app.models.base import User
+from app.spotify import get_spotify, get_deck_track_uris_to_check_playability, update_playability
+
+# tracks checked more recently than this (e.g. by play_track, or a previous run that was restarted) are skipped
+MIN_CHECK_AGE = datetime.timedelta(hours=20)
+
+# This code is scheduled to run once nightly by the Heroku Scheduler. It re-validates the playability of every track that
+# can show up in any user's deck, so dead tracks are dropped from generated apkgs and play_track can usually skip its
+# own check.
+# heroku run python app/scheduled/sweep_track_playability.py -a zdone
+if __name__ == "__main__":
+    track_uris = get_deck_track_uris_to_check_playability(datetime.datetime.utcnow() - MIN_CHECK_AGE)
+    log(f"Will check playability of {len(track_uris)} tracks.")
+    try:
+        dead = update_playability(get_spotify("zdone", User.query.filter_by(username="rsanek").one()), track_uris)
+        log(f"Completed playability sweep. Found {dead} unplayable tracks.")
+    except Exception as e:
+        log(f"Received exception during playability sweep: {e}")
+        capture_exception(e)
@@ -1,21 +1,29 @@
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional
 
 from sentry_sdk import capture_exception
 
 from app import db
 from app.log import log
 from app.models.base import User
-from app.models.spotify import SpotifyArtist, ManagedSpotifyArtist
+from app.models.spotify import SpotifyArtist
 from app.spotify import (
     get_spotify,
-    get_top_tracks,
     update_last_fm_scrobble_counts,
     update_spotify_anki_playlist,
-    add_or_get_album,
+    get_artists_with_stale_top_tracks,
+    fetch_artist_refresh,
+    store_artist_refreshes,
 )
+from app.util import chunker, JsonDict
 
-MAX_RETRIES_PER_ARTIST = 2
+# artists are fetched concurrently by this many workers (http_client additionally caps requests in flight per host)
+WORKERS = 8
+# each batch is fetched concurrently and then written with a handful of bulk statements
+ARTISTS_PER_BATCH = 40
+# stop starting new batches after this long, so the job doesn't run into the apkg generation cron
+TIME_BUDGET_SECONDS = 20 * 60
 
 # This code is scheduled to run once daily by the Heroku Scheduler. This helps avoid work that would previously be done
 # on apkg download within the request, which was very slow.
@@ -41,36 +49,36 @@ if __name__ == "__main__":
 
     log("Will update the top songs for all followed artists in table `managed_spotify_artists`.")
     log("Getting artists...")
-    managed_artists: List[Tuple[ManagedSpotifyArtist, SpotifyArtist]] = (
-        db.session.query(ManagedSpotifyArtist, SpotifyArtist).join(ManagedSpotifyArtist).filter_by(following=True).all()
-    )
-    artists: List[SpotifyArtist] = list(set([artist for _, artist in managed_artists]))
-    log(f"Got {len(artists)} distinct artists.")
+    artists: List[SpotifyArtist] = get_artists_with_stale_top_tracks()
+    log(f"Got {len(artists)} distinct artists that are due for a refresh.")
     user: User = User.query.filter_by(username="rsanek").one()
-    sp = get_spotify("zdone", user)
-    log(f"Getting top liked songs as user {user.username}...")
+    log(f"Getting top songs & albums as user {user.username}...")
 
-    for i, artist in enumerate(artists):
-        try_count = 0
-        while try_count < MAX_RETRIES_PER_ARTIST:
-            try_count += 1
-            try:
-                dropped, top_tracks = get_top_tracks(sp, artist, allow_refresh=True)
-                for album in sp.artist_albums(artist.uri, limit=50)["items"]:
-                    add_or_get_album(sp, album["uri"])
-                log(
-                    f"[{round(i / len(artists) * 100)}%] "
-                    f"Updated mappings for artist {artist.name}, dropping {dropped} & adding {len(top_tracks)}."
-                )
+    refreshed = 0
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for batch in chunker(artists, ARTISTS_PER_BATCH):
+            if time.time() - refresh_start_time > TIME_BUDGET_SECONDS:
+                # artists are processed most out of date first, so the next run picks up exactly where this one stopped
+                log(f"Out of time after refreshing {refreshed} artists. Remaining artists will be refreshed next run.")
                 break
-            except Exception as e:
-                log(f"Received exception {e}. Will try to refresh access token and try again.")
-                sp = get_spotify("zdone", user)
-                if try_count == MAX_RETRIES_PER_ARTIST:
-                    # looks like we weren't able to resolve this with just a token refresh.
-                    # publish this to Sentry so we know what's going on.
-                    log(f"Failed to update mappings for artist {artist.name}.")
+            # fetched once per batch on this thread, so a token refresh happens at most once and all workers share it
+            sp = get_spotify("zdone", user)
+
+            def fetch(artist: SpotifyArtist) -> Optional[Tuple[List[JsonDict], List[JsonDict]]]:
+                try:
+                    return fetch_artist_refresh(sp, artist.uri)
+                except Exception as e:
+                    # leave the artist stale, so it will be first in line on the next run
+                    log(f"Failed to fetch top songs & albums for artist {artist.name}: {e}")
                     capture_exception(e)
+                    return None
+
+            fetched = {
+                artist.uri: refresh for artist, refresh in zip(batch, executor.map(fetch, batch)) if refresh is not None
+            }
+            store_artist_refreshes(sp, fetched)
+            refreshed += len(fetched)
+            log(f"[{round(refreshed / len(artists) * 100)}%] Updated top songs & albums for {refreshed} artists.")
 
     log("Finished updating all followed artists.")
     log(f"Full refresh completed in {round(time.time() - refresh_start_time)} seconds.")
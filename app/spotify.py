@@ -1,25 +1,30 @@
-import collections
 import datetime
 import json
 import random
 import re
+import threading
+import time
 import unidecode
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from random import randrange
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Tuple, Dict, Iterable, Iterator, Set, Callable
 
 import pytz
-import requests
 import spotipy
 from dateutil import parser
 from flask import redirect
+from sentry_sdk import capture_exception
 from spotipy import oauth2
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import distinct, func, or_, text
+from sqlalchemy.dialects.postgresql import insert
 
-from app import kv, db
+from app import app, kv, db, http_client
+from app.backfill import BackfillJob, run_backfill
 from app.log import log
 from app.models.base import User, GateDef
+from app.name_cleaning import CLEANING_RULES_VERSION, clean_album_name, clean_track_name
 from app.models.spotify import (
     ManagedSpotifyArtist,
     SpotifyArtist,
@@ -28,8 +33,14 @@ from app.models.spotify import (
     TopTrack,
     SpotifyAlbum,
     SpotifyFeature,
+    SpotifySavedTrack,
+    SpotifyPlaylistTrack,
+    LastFmArtistPlaycount,
+    MusicDashboardStats,
+    SpotifyPlayDaily,
+    SpotifyPlayTotal,
 )
-from app.util import today_datetime, today, JsonDict
+from app.util import today_datetime, today, JsonDict, chunker, get_missing_keys
 
 # Scopes that are currently requested for public users -- only request things that are necessary
 MIN_SCOPES: str = (
@@ -58,10 +69,48 @@ ALL_SCOPES: str = (
     "playlist-modify-private"
 )
 NUM_TOP_TRACKS: int = 3
+# maximum number of ids accepted by the Spotify multi-get endpoints
+TRACKS_PER_REQUEST: int = 50
+ARTISTS_PER_REQUEST: int = 50
+ALBUMS_PER_REQUEST: int = 20
+LIKED_TRACKS_PER_PAGE: int = 50
+# maximum number of items that can be read, added or removed per playlist request
+PLAYLIST_ITEMS_PER_REQUEST: int = 100
+LAST_FM_WORKERS: int = 4
+# saved tracks are upserted in chunks of this many so a first sync of a huge library doesn't build a single giant statement
+SAVED_TRACKS_UPSERT_CHUNK_SIZE: int = 500
+# delta syncs can't detect un-liked tracks, so the whole library is re-downloaded at least this often
+SAVED_TRACKS_FULL_SYNC_INTERVAL: timedelta = timedelta(days=7)
 # randomized song playback will avoid starting within RANDOM_RANGE_MS of beginning or end of song.
 # If multiple random calls happen in succession, it will also avoid restarting within 2 * RANDOM_RANGE_MS of the most
 # recent random playback.
 RANDOM_RANGE_MS: int = 10_000
+# Spotify access tokens are cached per process by user id along with a ready-to-use client, so hot paths like
+# /api/<api_key>/play don't need to set up OAuth, look up the client secret or parse the stored token on every call.
+# Tokens are refreshed this long before they expire, and refreshed tokens are written back to the DB in the background.
+TOKEN_REFRESH_MARGIN: timedelta = timedelta(minutes=5)
+_spotify_clients: Dict[int, Tuple[JsonDict, spotipy.Spotify]] = {}
+_spotify_client_locks: Dict[int, threading.Lock] = {}
+_token_writer = ThreadPoolExecutor(max_workers=1)
+_play_recorder = ThreadPoolExecutor(max_workers=2)
+# how long a stored playability check is trusted by play_track before asking Spotify again
+PLAYABILITY_TTL: timedelta = timedelta(days=3)
+TOP_TRACKS_REFRESH_INTERVAL: timedelta = timedelta(days=7)
+# number of recommendations & next artists to follow shown on the /spotify page
+DASHBOARD_ARTISTS_SHOWN: int = 3
+BEST_SELLING_ARTISTS_SOURCE: str = "https://en.wikipedia.org/wiki/List_of_best-selling_music_artists"
+MOST_STREAMED_ARTISTS_SOURCE: str = "https://en.wikipedia.org/wiki/List_of_most-streamed_artists_on_Spotify"
+HIGHEST_CERTIFIED_ARTISTS_SOURCE: str = (
+    "https://en.wikipedia.org/wiki/List_of_highest-certified_music_artists_in_the_United_States"
+)
+# The quiz endpoints draw from candidate pools that are built with a few queries and then kept in memory for this long,
+# so that each quiz is a handful of random.choice calls no matter how many artists & tracks there are.
+QUIZ_POOL_TTL: timedelta = timedelta(minutes=30)
+QUIZ_ARTIST_CHOICES: int = 8
+FAMILY_QUIZ_USER_IDS: List[int] = [1, 4, 5]
+TOP_LIKED_QUIZ_TRACKS: int = 50
+_quiz_pools: Dict[str, Tuple[float, JsonDict]] = {}
+_quiz_pool_locks: Dict[str, threading.Lock] = {}
 
 
 def follow_unfollow_artists(user: User) -> None:
@@ -80,11 +129,6 @@ def follow_unfollow_artists(user: User) -> None:
     do_add_artists(user, [artist["uri"] for artist in results], True)
 
 
-# via https://stackoverflow.com/a/434328
-def chunker(seq, size):
-    return (seq[pos : pos + size] for pos in range(0, len(seq), size))
-
-
 def update_spotify_anki_playlist(user: User):
     if (
         user.spotify_token_json is None
@@ -106,22 +150,96 @@ def update_spotify_anki_playlist(user: User):
             "Download this playlist to make jumping to random points in Anki faster!",
         )
         user.spotify_playlist_uri = returned["uri"]
+        user.spotify_playlist_snapshot_id = returned["snapshot_id"]
+        SpotifyPlaylistTrack.query.filter_by(user_id=user.id).delete()
         db.session.commit()
 
-    unique_uris = list(set([sp.spotify_track_uri for sp in SpotifyPlay.query.filter_by(user_id=user.id).all()]))
+    # we only need to re-read the playlist if it was changed outside of this function since the last sync
+    snapshot_id = sp.playlist(user.spotify_playlist_uri, fields="snapshot_id")["snapshot_id"]
+    if snapshot_id != user.spotify_playlist_snapshot_id:
+        log(f"Playlist for user {user.username} was modified elsewhere. Will re-read its contents.")
+        _reload_playlist_tracks(sp, user)
+        db.session.commit()
 
-    # as far as I can tell, the API doesn't have an easy way to avoid adding duplicate
-    # songs to a playlist, so here we delete all tracks in the playlist before re-adding.
-    sp.playlist_replace_items(playlist_id=user.spotify_playlist_uri, items=[])
-    for track_uris in chunker(unique_uris, 100):
-        sp.playlist_add_items(
-            playlist_id=user.spotify_playlist_uri,
-            items=track_uris,
-        )
+    # the playlist should contain exactly the distinct set of tracks played through zdone, so only send the difference
+    plays_sql = f"select spotify_track_uri from spotify_play_totals where user_id = {user.id}"
+    playlist_sql = f"select spotify_track_uri from spotify_playlist_tracks where user_id = {user.id}"
+    to_add = [row[0] for row in db.engine.execute(f"{plays_sql} except {playlist_sql}")]
+    to_remove = [row[0] for row in db.engine.execute(f"{playlist_sql} except {plays_sql}")]
+
+    if not to_add and not to_remove:
+        log(f"Spotify playlist for user {user.username} is already up to date")
+        return
+
+    try:
+        for track_uris in chunker(to_add, PLAYLIST_ITEMS_PER_REQUEST):
+            snapshot_id = sp.playlist_add_items(playlist_id=user.spotify_playlist_uri, items=track_uris)["snapshot_id"]
+        for track_uris in chunker(to_remove, PLAYLIST_ITEMS_PER_REQUEST):
+            snapshot_id = sp.playlist_remove_all_occurrences_of_items(
+                playlist_id=user.spotify_playlist_uri, items=track_uris
+            )["snapshot_id"]
+    except Exception:
+        # a failed write may still have been applied (e.g. if only its response was lost), so the mirror can't be
+        # trusted until the playlist is re-read
+        log(f"Updating Spotify playlist for user {user.username} failed. Will re-read its contents.")
+        _reload_playlist_tracks(sp, user)
+        db.session.commit()
+        raise
+    _bulk_insert_ignoring_conflicts(
+        SpotifyPlaylistTrack, [{"user_id": user.id, "spotify_track_uri": uri} for uri in to_add]
+    )
+    if to_remove:
+        SpotifyPlaylistTrack.query.filter_by(user_id=user.id).filter(
+            SpotifyPlaylistTrack.spotify_track_uri.in_(to_remove)  # type: ignore
+        ).delete(synchronize_session=False)
+    # if anything besides our writes changed the playlist meanwhile, its snapshot won't be the one our last write returned
+    if sp.playlist(user.spotify_playlist_uri, fields="snapshot_id")["snapshot_id"] != snapshot_id:
+        log(f"Playlist for user {user.username} changed while it was being updated. Will re-read its contents.")
+        _reload_playlist_tracks(sp, user)
+    else:
+        user.spotify_playlist_snapshot_id = snapshot_id
+    db.session.commit()
 
     log(f"Updated Spotify playlist for user {user.username}")
 
 
+# Replaces the mirror of the playlist with its actual contents & records its snapshot. Any track that's in the playlist
+# more than once (e.g. from a write that was applied twice) is brought back down to one copy. Does not commit.
+def _reload_playlist_tracks(sp, user: User) -> None:
+    snapshot_id = sp.playlist(user.spotify_playlist_uri, fields="snapshot_id")["snapshot_id"]
+    track_uris: List[str] = []
+    offset = 0
+    while True:
+        page = sp.playlist_items(
+            user.spotify_playlist_uri,
+            fields="items(track(uri,is_local)),next",
+            limit=PLAYLIST_ITEMS_PER_REQUEST,
+            offset=offset,
+        )
+        # local files & podcast episodes can't be played through zdone, so leave them alone
+        track_uris.extend(
+            item["track"]["uri"]
+            for item in page["items"]
+            if item["track"] and not item["track"].get("is_local") and item["track"]["uri"].startswith("spotify:track:")
+        )
+        if not page["next"]:
+            break
+        offset += PLAYLIST_ITEMS_PER_REQUEST
+
+    duplicates = sorted(uri for uri, count in Counter(track_uris).items() if count > 1)
+    if duplicates:
+        log(f"Removing extra copies of {len(duplicates)} tracks from the playlist for user {user.username}.")
+    for chunk in chunker(duplicates, PLAYLIST_ITEMS_PER_REQUEST):
+        sp.playlist_remove_all_occurrences_of_items(playlist_id=user.spotify_playlist_uri, items=chunk)
+        snapshot_id = sp.playlist_add_items(playlist_id=user.spotify_playlist_uri, items=chunk)["snapshot_id"]
+
+    SpotifyPlaylistTrack.query.filter_by(user_id=user.id).delete()
+    _bulk_insert_ignoring_conflicts(
+        SpotifyPlaylistTrack, [{"user_id": user.id, "spotify_track_uri": uri} for uri in sorted(set(track_uris))]
+    )
+    user.spotify_playlist_snapshot_id = snapshot_id
+
+
 def uniform_artist_name(artist_name: str) -> str:
     name = artist_name.lower()
     name = unidecode.unidecode(name)  # Pražský výběr, Marie Rottrová
@@ -130,6 +248,24 @@ def uniform_artist_name(artist_name: str) -> str:
     return re.sub("\\W", "", name)  # Lil' Wayne, Jean-Michel Jarre, Anna K.
 
 
+def _get_last_fm_top_artists_page(last_fm_username: str, api_key: str, page: int) -> JsonDict:
+    return http_client.get(
+        f"https://ws.audioscrobbler.com/2.0/?method=user.gettopartists&user={last_fm_username}"
+        f"&api_key={api_key}&format=json&limit=1000&page={str(page)}"
+    ).json()
+
+
+# normalized_name is set whenever an artist is inserted; this catches rows that were inserted before the column existed
+def backfill_normalized_artist_names() -> None:
+    artists = db.session.query(SpotifyArtist.uri, SpotifyArtist.name).filter_by(normalized_name=None).all()
+    if artists:
+        db.session.bulk_update_mappings(
+            SpotifyArtist, [{"uri": uri, "normalized_name": uniform_artist_name(name)} for uri, name in artists]
+        )
+        db.session.commit()
+        log(f"Backfilled normalized names for {len(artists)} artists.")
+
+
 def update_last_fm_scrobble_counts(user: User):
     if user.last_fm_username is None:
         log(f"User {user.username} does not have a last.fm username set. Nothing to refresh.")
@@ -138,27 +274,39 @@ def update_last_fm_scrobble_counts(user: User):
     last_refresh_time = user.last_fm_last_refresh_time
     week_ago = today_datetime() - timedelta(days=7)
     if last_refresh_time is None or pytz.timezone("US/Pacific").localize(last_refresh_time) < week_ago:
-        done = False
-        page = 1
-        name_to_plays = {}
-        while not done:
-            top_artists_batch = json.loads(
-                requests.get(
-                    f"https://ws.audioscrobbler.com/2.0/?method=user.gettopartists&user={user.last_fm_username}"
-                    f"&api_key={kv.get('LAST_FM_API_KEY')}&format=json&limit=1000&page={str(page)}"
-                ).text
+        # fetch the first page to learn how many there are, then get the rest concurrently
+        last_fm_username, api_key = user.last_fm_username, kv.get("LAST_FM_API_KEY")
+        first_page = _get_last_fm_top_artists_page(last_fm_username, api_key, 1)
+        pages = [first_page]
+        with ThreadPoolExecutor(max_workers=LAST_FM_WORKERS) as executor:
+            pages.extend(
+                executor.map(
+                    lambda page: _get_last_fm_top_artists_page(last_fm_username, api_key, page),
+                    range(2, int(first_page["topartists"]["@attr"]["totalPages"]) + 1),
+                )
             )
-            page += 1
-            done = page >= int(top_artists_batch["topartists"]["@attr"]["totalPages"])
-            for artist in top_artists_batch["topartists"]["artist"]:
-                name_to_plays[uniform_artist_name(artist["name"])] = artist["playcount"]
-        for managed_spotify_artist, spotify_artist in (
-            db.session.query(ManagedSpotifyArtist, SpotifyArtist)
-            .join(ManagedSpotifyArtist)
-            .filter_by(user_id=user.id)
-            .all()
-        ):
-            managed_spotify_artist.last_fm_scrobbles = name_to_plays.get(uniform_artist_name(spotify_artist.name), None)
+        name_to_plays = {
+            uniform_artist_name(artist["name"]): int(artist["playcount"])
+            for page in pages
+            for artist in page["topartists"]["artist"]
+        }
+        LastFmArtistPlaycount.query.filter_by(user_id=user.id).delete()
+        for chunk in chunker(list(name_to_plays.items()), 5000):
+            _bulk_insert_ignoring_conflicts(
+                LastFmArtistPlaycount,
+                [{"user_id": user.id, "normalized_name": name, "playcount": plays} for name, plays in chunk],
+            )
+        backfill_normalized_artist_names()
+        db.engine.execute(
+            f"""
+update managed_spotify_artists msa
+set last_fm_scrobbles = lfap.playcount
+from spotify_artists sa
+         left join last_fm_artist_playcounts lfap
+                   on lfap.normalized_name = sa.normalized_name and lfap.user_id = {user.id}
+where msa.spotify_artist_uri = sa.uri
+  and msa.user_id = {user.id}"""
+        )
         user.last_fm_last_refresh_time = today_datetime()
         db.session.commit()
         log(f"Updated scrobble counts for user {user.username}")
@@ -169,80 +317,29 @@ def update_last_fm_scrobble_counts(user: User):
 def save_token_info(token_info, user: User):
     user.spotify_token_json = json.dumps(token_info)
     db.session.commit()
-
-
-def get_cached_token_info(sp_oauth, user: User) -> Optional[JsonDict]:
-    maybe_token_info = user.spotify_token_json
-    if maybe_token_info:
-        token_info = json.loads(maybe_token_info)
-        if sp_oauth.is_token_expired(token_info):
-            token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
-            save_token_info(token_info, user)
-        return token_info
-    return None
-
-
-def add_or_get_album(sp, spotify_album_uri: str):
-    album = SpotifyAlbum.query.filter_by(uri=spotify_album_uri).one_or_none()
-    if not album:
-        sp_album = sp.album(spotify_album_uri)
-        release_date: Optional[datetime.date] = None
-        try:
-            release_date = parser.parse(sp_album["release_date"]).date()
-        except Exception:
-            pass
-
-        album = SpotifyAlbum(
-            uri=spotify_album_uri,
-            name=sp_album["name"],
-            spotify_artist_uri=add_or_get_artist(sp, sp_album["artists"][0]["uri"]).uri,
-            album_type=sp_album["album_type"],
-            released_at=release_date,
-            spotify_image_url=sp_album["images"][0]["url"] if sp_album["images"] else None,
-        )
-        db.session.add(album)
-        db.session.commit()
-    return album
+    _spotify_clients.pop(user.id, None)
 
 
 # Unused right now, but nice to keep around if/when I need to do various backfills
 def populate_null(user: User) -> None:
-    sql = f"""select distinct uri
-from spotify_tracks
-where uri not in (select spotify_track_uri from spotify_features)"""
-    unpopulated = [a[0] for a in list(db.engine.execute(sql))]
-    sp = get_spotify("", user)
-
-    batchsize = 20
-    for i in range(0, len(unpopulated), batchsize):
-        batch = unpopulated[i : i + batchsize]
-        if i % 1000 == 0:
-            sp = get_spotify("", user)
-        tracks = sp.tracks(batch)["tracks"]
-        for j, track in enumerate(tracks):
-            create_features_from_artists(sp, track)
-        log(
-            f"Processed 20 more tracks. Total this run is {round(i / len(unpopulated) * 1000) / 10}%, "
-            f"{i} / {len(unpopulated)}"
-        )
-
-
-def add_or_get_artist(sp, spotify_artist_uri: str):
-    artist = SpotifyArtist.query.filter_by(uri=spotify_artist_uri).one_or_none()
-    if not artist:
-        sp_artist = sp.artist(spotify_artist_uri)
-        artist = SpotifyArtist(
-            uri=spotify_artist_uri,
-            name=sp_artist["name"],
-            spotify_image_url=sp_artist["images"][0]["url"] if sp_artist["images"] else None,
+    run_backfill(
+        BackfillJob(
+            name="spotify_track_features",
+            key_column=SpotifyTrack.uri,
+            candidates=lambda: db.session.query(SpotifyTrack.uri).filter(
+                ~db.session.query(SpotifyFeature).filter(SpotifyFeature.spotify_track_uri == SpotifyTrack.uri).exists()
+            ),
+            get_client=lambda: get_spotify("", user),
+            fetch=lambda sp, rows: [track for track in sp.tracks([row[0] for row in rows])["tracks"] if track],
+            # tracks already exist, so this will only end up inserting the missing artists & features
+            write=_upsert_tracks,
+            batch_size=TRACKS_PER_REQUEST,
         )
-        db.session.add(artist)
-        db.session.commit()
-    return artist
+    )
 
 
-def maybe_get_spotify_authorize_url(full_url: str, user: User) -> Optional[str]:
-    sp_oauth = oauth2.SpotifyOAuth(
+def _get_spotify_oauth(full_url: str, user: User) -> oauth2.SpotifyOAuth:
+    return oauth2.SpotifyOAuth(
         scope=ALL_SCOPES if user.is_gated(GateDef.USE_GENEROUS_SPOTIFY_SCOPES) else MIN_SCOPES,
         client_id="03f34cada5cc46a5929be06ff7532321",
         client_secret=kv.get("SPOTIFY_CLIENT_SECRET"),
@@ -250,11 +347,50 @@ def maybe_get_spotify_authorize_url(full_url: str, user: User) -> Optional[str]:
         if "zdone" in full_url
         else "http://127.0.0.1:5000/spotify/auth",
         cache_path=f".cache-{user.username}",
+        requests_session=http_client.get_session(),
     )
 
-    token_info = get_cached_token_info(sp_oauth, user)
 
-    if not token_info:
+def _is_token_fresh(token_info: JsonDict) -> bool:
+    return token_info["expires_at"] - TOKEN_REFRESH_MARGIN.total_seconds() > time.time()
+
+
+def _write_token_info(user_id: int, token_info: JsonDict) -> None:
+    with app.app_context():
+        try:
+            User.query.get(user_id).spotify_token_json = json.dumps(token_info)
+            db.session.commit()
+        except Exception as e:
+            log(f"Failed to save refreshed Spotify token for user {user_id}: {e}")
+            capture_exception(e)
+        finally:
+            db.session.remove()
+
+
+def _get_cached_spotify(full_url: str, user: User) -> Optional[spotipy.Spotify]:
+    cached = _spotify_clients.get(user.id)
+    if cached and _is_token_fresh(cached[0]):
+        return cached[1]
+
+    # only one request per user refreshes; the others wait here and then pick up the refreshed client
+    with _spotify_client_locks.setdefault(user.id, threading.Lock()):
+        cached = _spotify_clients.get(user.id)
+        if cached and _is_token_fresh(cached[0]):
+            return cached[1]
+        if not user.spotify_token_json:
+            return None
+        token_info = cached[0] if cached else json.loads(user.spotify_token_json)
+        if not _is_token_fresh(token_info):
+            token_info = _get_spotify_oauth(full_url, user).refresh_access_token(token_info["refresh_token"])
+            _token_writer.submit(_write_token_info, user.id, token_info)
+        client = spotipy.Spotify(auth=token_info["access_token"], requests_session=http_client.get_session())
+        _spotify_clients[user.id] = (token_info, client)
+        return client
+
+
+def maybe_get_spotify_authorize_url(full_url: str, user: User) -> Optional[str]:
+    if not _get_cached_spotify(full_url, user):
+        sp_oauth = _get_spotify_oauth(full_url, user)
         if "code" not in full_url:
             return sp_oauth.get_authorize_url()
         else:
@@ -265,115 +401,329 @@ def maybe_get_spotify_authorize_url(full_url: str, user: User) -> Optional[str]:
 
 
 def get_spotify(full_url: str, user: User):
-    sp_oauth = oauth2.SpotifyOAuth(
-        scope=ALL_SCOPES if user.is_gated(GateDef.USE_GENEROUS_SPOTIFY_SCOPES) else MIN_SCOPES,
-        client_id="03f34cada5cc46a5929be06ff7532321",
-        client_secret=kv.get("SPOTIFY_CLIENT_SECRET"),
-        redirect_uri="https://www.zdone.co/spotify/auth"
-        if "zdone" in full_url
-        else "http://127.0.0.1:5000/spotify/auth",
-        cache_path=f".cache-{user.username}",
-    )
-
-    if token_info := get_cached_token_info(sp_oauth, user):
-        return spotipy.Spotify(auth=token_info["access_token"])
+    if sp := _get_cached_spotify(full_url, user):
+        return sp
     else:
-        return sp_oauth.get_authorize_url()
+        return _get_spotify_oauth(full_url, user).get_authorize_url()
 
 
 def bulk_add_tracks(sp, track_uris: List[str]) -> None:
-    not_added_tracks = set(track_uris) - set([track.uri for track in SpotifyTrack.query.all()])
-    for track_uri in not_added_tracks:
-        add_or_get_track(sp, track_uri)
-
-
-def add_or_get_feature(track_uri: str, artist_uri: str, ordinal: int) -> SpotifyFeature:
-    feature = SpotifyFeature.query.filter_by(
-        spotify_track_uri=track_uri, spotify_artist_uri=artist_uri, ordinal=ordinal
-    ).one_or_none()
-    if not feature:
-        feature = SpotifyFeature(
-            spotify_track_uri=track_uri,
-            spotify_artist_uri=artist_uri,
-            ordinal=ordinal,
-        )
-        db.session.add(feature)
-        db.session.commit()
-    return feature
-
-
-def create_features_from_artists(sp, sp_track) -> List[SpotifyFeature]:
-    to_ret = list()
-    for i, artist in enumerate(sp_track["artists"]):
-        spotify_artist = add_or_get_artist(sp, artist["uri"])
-        to_ret.append(add_or_get_feature(sp_track["uri"], spotify_artist.uri, i))
-    return to_ret
+    hydrate_tracks(sp, track_uris)
 
 
 def add_or_get_track(sp, track_uri: str) -> SpotifyTrack:
     track = SpotifyTrack.query.filter_by(uri=track_uri).one_or_none()
     if not track:
-        sp_track = sp.track(track_uri)
-        track = SpotifyTrack(
-            uri=track_uri,
-            name=sp_track["name"],
-            spotify_artist_uri=add_or_get_artist(sp, sp_track["artists"][0]["uri"]).uri,
-            spotify_album_uri=add_or_get_album(sp, sp_track["album"]["uri"]).uri,
-            duration_milliseconds=sp_track["duration_ms"],
-            api_response=json.dumps(sp_track),
-        )
-        db.session.add(track)
-        create_features_from_artists(sp, sp_track)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()  # uh oh, let's roll back this session
-
-            # potentially another thread added the track between this thread's read & write. try reading it here again
-            track = SpotifyTrack.query.filter_by(uri=track_uri).one()
+        hydrate_tracks(sp, [track_uri])
+        track = SpotifyTrack.query.filter_by(uri=track_uri).one()
     return track
 
 
-def do_add_artists(user: User, artist_uris: List[str], remove_not_included: bool = False) -> None:
-    sp = get_spotify("", user)
-    existing_managed_artist_uris = [
-        msa.spotify_artist_uri for msa in ManagedSpotifyArtist.query.filter_by(user_id=user.id).all()
-    ]
-    # if we pass true get_followed_managed_spotify_artists_for_user, we cause infinite loop:
-    # do_add_artists -> get_followed_managed_spotify_artists_for_user -> follow_unfollow_artists -> do_add_artists
-    currently_unfollowed_managed_artist_uris = [
-        msa.spotify_artist_uri for msa in get_followed_managed_spotify_artists_for_user(user, False)
+# The hydration functions below take a set of URIs, figure out which ones we don't have yet via get_missing_keys, fetch
+# only those through Spotify's multi-get endpoints and then write each table with one bulk insert. Rows that another
+# thread/process managed to insert in the meantime are skipped via ON CONFLICT DO NOTHING. The public functions commit;
+# their underscored counterparts don't, for callers like backfills that commit their writes together with other state.
+def _bulk_insert_ignoring_conflicts(model, rows: List[JsonDict]) -> None:
+    if rows:
+        db.session.execute(insert(model.__table__).values(rows).on_conflict_do_nothing())
+
+
+def _get_release_date(sp_album: JsonDict) -> Optional[datetime.date]:
+    try:
+        return parser.parse(sp_album["release_date"]).date()
+    except Exception:
+        return None
+
+
+def hydrate_artists(sp, artist_uris: Iterable[str]) -> None:
+    _hydrate_artists(sp, artist_uris)
+    db.session.commit()
+
+
+def _hydrate_artists(sp, artist_uris: Iterable[str]) -> None:
+    missing = sorted(get_missing_keys(SpotifyArtist.uri, artist_uris))
+    sp_artists = [
+        sp_artist
+        for batch in chunker(missing, ARTISTS_PER_REQUEST)
+        for sp_artist in sp.artists(batch)["artists"]
+        if sp_artist
     ]
+    rows = {
+        sp_artist["uri"]: {
+            "uri": sp_artist["uri"],
+            "name": sp_artist["name"],
+            "normalized_name": uniform_artist_name(sp_artist["name"]),
+            "spotify_image_url": sp_artist["images"][0]["url"] if sp_artist["images"] else None,
+        }
+        for sp_artist in sp_artists
+    }
+    _bulk_insert_ignoring_conflicts(SpotifyArtist, list(rows.values()))
+
+
+def hydrate_albums(sp, album_uris: Iterable[str]) -> None:
+    missing = sorted(get_missing_keys(SpotifyAlbum.uri, album_uris))
+    upsert_albums(
+        sp,
+        [
+            sp_album
+            for batch in chunker(missing, ALBUMS_PER_REQUEST)
+            for sp_album in sp.albums(batch)["albums"]
+            if sp_album
+        ],
+    )
 
-    to_add = set(artist_uris).difference(set(existing_managed_artist_uris))
-    for artist_uri in to_add:
-        spotify_artist = add_or_get_artist(sp, artist_uri)
-        managed_artist = ManagedSpotifyArtist(
-            user_id=user.id, spotify_artist_uri=spotify_artist.uri, date_added=today()
-        )
-        db.session.add(managed_artist)
 
-    to_follow = set(artist_uris).intersection(set(currently_unfollowed_managed_artist_uris))
-    for artist_uri in to_follow:
-        artist = ManagedSpotifyArtist.query.filter_by(user_id=user.id, spotify_artist_uri=artist_uri).one()
-        artist.following = True
+# accepts either full or simplified album objects, since both contain all the fields we store
+def upsert_albums(sp, sp_albums: List[JsonDict]) -> None:
+    _upsert_albums(sp, sp_albums)
+    db.session.commit()
+
+
+def _upsert_albums(sp, sp_albums: List[JsonDict]) -> None:
+    _hydrate_artists(sp, [sp_album["artists"][0]["uri"] for sp_album in sp_albums])
+    rows = {
+        sp_album["uri"]: {
+            "uri": sp_album["uri"],
+            "name": sp_album["name"],
+            "clean_name": clean_album_name(sp_album["name"]),
+            "clean_name_version": CLEANING_RULES_VERSION,
+            "spotify_artist_uri": sp_album["artists"][0]["uri"],
+            "album_type": sp_album["album_type"],
+            "released_at": _get_release_date(sp_album),
+            "spotify_image_url": sp_album["images"][0]["url"] if sp_album["images"] else None,
+        }
+        for sp_album in sp_albums
+    }
+    _bulk_insert_ignoring_conflicts(SpotifyAlbum, list(rows.values()))
+
+
+def hydrate_tracks(sp, track_uris: Iterable[str]) -> None:
+    missing = sorted(get_missing_keys(SpotifyTrack.uri, track_uris))
+    upsert_tracks(
+        sp,
+        [
+            sp_track
+            for batch in chunker(missing, TRACKS_PER_REQUEST)
+            for sp_track in sp.tracks(batch)["tracks"]
+            if sp_track
+        ],
+    )
+
+
+# accepts full track objects, as returned by the tracks, top tracks & saved tracks endpoints. The simplified album
+# embedded in each track is enough to create the album, so no extra album requests are needed.
+def upsert_tracks(sp, sp_tracks: List[JsonDict]) -> None:
+    _upsert_tracks(sp, sp_tracks)
+    db.session.commit()
+
+
+def _upsert_tracks(sp, sp_tracks: List[JsonDict]) -> None:
+    _hydrate_artists(
+        sp,
+        [artist["uri"] for sp_track in sp_tracks for artist in sp_track["artists"]]
+        + [sp_track["album"]["artists"][0]["uri"] for sp_track in sp_tracks],
+    )
+    _upsert_albums(sp, list({sp_track["album"]["uri"]: sp_track["album"] for sp_track in sp_tracks}.values()))
+    rows = {
+        sp_track["uri"]: {
+            "uri": sp_track["uri"],
+            "name": sp_track["name"],
+            "clean_name": clean_track_name(sp_track["name"]),
+            "clean_name_version": CLEANING_RULES_VERSION,
+            "spotify_artist_uri": sp_track["artists"][0]["uri"],
+            "spotify_album_uri": sp_track["album"]["uri"],
+            "duration_milliseconds": sp_track["duration_ms"],
+            "api_response": json.dumps(sp_track),
+        }
+        for sp_track in sp_tracks
+    }
+    _bulk_insert_ignoring_conflicts(SpotifyTrack, list(rows.values()))
+    _bulk_insert_ignoring_conflicts(
+        SpotifyFeature,
+        [
+            {"spotify_track_uri": sp_track["uri"], "spotify_artist_uri": artist["uri"], "ordinal": ordinal}
+            for sp_track in sp_tracks
+            for ordinal, artist in enumerate(sp_track["artists"])
+        ],
+    )
+
+
+def _get_clean_names_backfill(model, clean: Callable[[str], str]) -> BackfillJob:
+    return BackfillJob(
+        name=f"{model.__tablename__}_clean_names_v{CLEANING_RULES_VERSION}",
+        key_column=model.uri,
+        candidates=lambda: db.session.query(model.uri, model.name).filter(
+            or_(model.clean_name_version == None, model.clean_name_version != CLEANING_RULES_VERSION)
+        ),
+        fetch=lambda _, rows: [
+            {"uri": uri, "clean_name": clean(name), "clean_name_version": CLEANING_RULES_VERSION} for uri, name in rows
+        ],
+        write=lambda _, mappings: db.session.bulk_update_mappings(model, mappings),
+        batch_size=1000,
+    )
+
+
+# Re-cleans the names of tracks & albums that were stored before the current cleaning rules (or before names were
+# cleaned at all). Makes no API calls, so it's cheap to run whenever the rules might have changed.
+def reclean_names() -> None:
+    run_backfill(_get_clean_names_backfill(SpotifyTrack, clean_track_name))
+    run_backfill(_get_clean_names_backfill(SpotifyAlbum, clean_album_name))
+
 
+def do_add_artists(user: User, artist_uris: List[str], remove_not_included: bool = False) -> None:
+    sp = get_spotify("", user)
+    uris = sorted(set(artist_uris))
+    hydrate_artists(sp, uris)
+    params = {"user_id": user.id, "uris": uris, "today": today()}
+
+    # reconcile in three set-based statements rather than one query per artist. Artists Spotify couldn't return (and so
+    # that aren't in spotify_artists) are skipped by the insert, same as hydrate_artists skips them.
+    changed = db.session.execute(
+        text(
+            """
+insert into managed_spotify_artists (user_id, spotify_artist_uri, date_added)
+select :user_id, sa.uri, :today
+from spotify_artists sa
+where sa.uri = any(:uris)
+on conflict (user_id, spotify_artist_uri) do nothing"""
+        ),
+        params,
+    ).rowcount
+    changed += db.session.execute(
+        text(
+            """
+update managed_spotify_artists
+set following = true
+where user_id = :user_id
+  and not following
+  and spotify_artist_uri = any(:uris)"""
+        ),
+        params,
+    ).rowcount
     if remove_not_included:
-        to_remove = set(existing_managed_artist_uris).difference(set(artist_uris))
-        for artist_uri in to_remove:
-            msa = ManagedSpotifyArtist.query.filter_by(user_id=user.id, spotify_artist_uri=artist_uri).one()
-            msa.following = False
+        changed += db.session.execute(
+            text(
+                """
+update managed_spotify_artists
+set following = false
+where user_id = :user_id
+  and following
+  and not spotify_artist_uri = any(:uris)"""
+            ),
+            params,
+        ).rowcount
 
     db.session.commit()
+    if changed:
+        refresh_music_dashboard_stats(user)
+
+
+def _is_playability_fresh(track: SpotifyTrack) -> bool:
+    return (
+        track.playability_checked_at is not None
+        and track.playability_checked_at > datetime.datetime.utcnow() - PLAYABILITY_TTL
+    )
 
 
-def play_track(full_url: str, track_uri: str, user: User, offset: Optional[int] = None):
+# Asks Spotify whether each track is playable (in batches of 50) and stores the answer on the track.
+def update_playability(sp, track_uris: List[str]) -> int:
+    dead = 0
+    for batch in chunker(track_uris, TRACKS_PER_REQUEST):
+        sp_tracks = sp.tracks(batch, market="US")["tracks"]
+        checked_at = datetime.datetime.utcnow()
+        mappings = [
+            {
+                "uri": uri,
+                "is_playable": bool(sp_track and sp_track.get("is_playable")),
+                "playability_checked_at": checked_at,
+            }
+            for uri, sp_track in zip(batch, sp_tracks)
+        ]
+        dead += len([m for m in mappings if not m["is_playable"]])
+        db.session.bulk_update_mappings(SpotifyTrack, mappings)
+        db.session.commit()
+    return dead
+
+
+# Tracks that can end up in any user's deck (see get_tracks) whose playability hasn't been checked since checked_before.
+def get_deck_track_uris_to_check_playability(checked_before: datetime.datetime) -> List[str]:
+    sql = f"""
+with deck_tracks as (
+    select spotify_track_uri as uri from spotify_saved_tracks
+    union
+    select spotify_track_uri from spotify_play_totals
+    union
+    select tt.track_uri
+    from top_tracks tt
+             join managed_spotify_artists msa on tt.artist_uri = msa.spotify_artist_uri
+    where msa.following and (msa.num_top_tracks is null or tt.ordinal <= msa.num_top_tracks)
+)
+select st.uri
+from spotify_tracks st
+         join deck_tracks dt on st.uri = dt.uri
+where st.playability_checked_at is null or st.playability_checked_at < '{checked_before.isoformat()}'
+order by st.playability_checked_at nulls first"""
+    return [row[0] for row in db.engine.execute(sql)]
+
+
+# Logs the play along with its spotify_play_daily & spotify_play_totals rollups. Does not commit.
+def record_spotify_play(user_id: int, track_uri: str, played_at: datetime.datetime) -> None:
+    db.session.add(SpotifyPlay(user_id=user_id, spotify_track_uri=track_uri, created_at=played_at))
+    daily = SpotifyPlayDaily.__table__
+    db.session.execute(
+        insert(daily)
+        .values(user_id=user_id, day=played_at.date(), spotify_track_uri=track_uri, plays=1)
+        .on_conflict_do_update(constraint="_user_id_day_and_spotify_track_uri", set_={"plays": daily.c.plays + 1})
+    )
+    totals = SpotifyPlayTotal.__table__
+    insert_total = insert(totals).values(
+        user_id=user_id, spotify_track_uri=track_uri, first_played_on=played_at.date(), plays=1
+    )
+    db.session.execute(
+        insert_total.on_conflict_do_update(
+            constraint="_user_id_and_played_spotify_track_uri",
+            set_={
+                "plays": totals.c.plays + 1,
+                "first_played_on": func.least(totals.c.first_played_on, insert_total.excluded.first_played_on),
+            },
+        )
+    )
+
+
+# Runs after start_playback has already returned to the user (see play_track's fast_path). If the track turns out to be
+# unplayable, that is stored on the track and no play is logged; the next attempt to play it then fails up front.
+def _record_play(
+    sp,
+    user_id: int,
+    track_uri: str,
+    played_at: datetime.datetime,
+    check_playability: bool = True,
+) -> None:
+    with app.app_context():
+        try:
+            if check_playability and update_playability(sp, [track_uri]):
+                return
+            record_spotify_play(user_id, track_uri, played_at)
+            db.session.commit()
+        except Exception as e:
+            log(f"Failed to record play of {track_uri} for user {user_id}: {e}")
+            capture_exception(e)
+        finally:
+            db.session.remove()
+
+
+# With fast_path, we return as soon as Spotify accepts the start_playback call and leave the playability check and
+# logging the play to a background worker. Any unplayable track it finds is reported on the next call instead.
+def play_track(full_url: str, track_uri: str, user: User, offset: Optional[int] = None, fast_path: bool = False):
     sp = get_spotify(full_url, user)
     if isinstance(sp, str):
         user.last_spotify_track = track_uri
         db.session.commit()
         return redirect(sp)
     track = add_or_get_track(sp, track_uri)
+    if track.is_playable is False and _is_playability_fresh(track):
+        raise ValueError("Track is not playable")
+    random_offset = None
     if offset is None:
         start = randrange(RANDOM_RANGE_MS, track.duration_milliseconds - RANDOM_RANGE_MS)
         last_random_play = user.last_random_play_offset
@@ -381,62 +731,84 @@ def play_track(full_url: str, track_uri: str, user: User, offset: Optional[int]
             # try to pick a different spot in the song from the last random selection
             while start - RANDOM_RANGE_MS < last_random_play < start + RANDOM_RANGE_MS:
                 start = randrange(RANDOM_RANGE_MS, track.duration_milliseconds - RANDOM_RANGE_MS)
-
-        user.last_random_play_offset = start
-        db.session.commit()
+        random_offset = start
     else:
         start = offset
 
     # sometimes, a song that was previously mapped to an ID becomes unplayable. Generally, it would be expensive to
     # detect this ahead of time, and our spotipy library does not thread through the status code (204) that Spotify
     # returns for the start playback call. Here, we try to start playback first anyway (to keep latency as low as
-    # possible for the happy path) and then after that call we check, was this song actually playable?
+    # possible for the happy path) and then after that call we check, was this song actually playable? A recent
+    # answer (from an earlier play or the nightly sweep in sweep_track_playability.py) saves us that extra call.
     sp.start_playback(uris=[track_uri], position_ms=start)
-    if not sp.tracks([track_uri], market="US")["tracks"][0]["is_playable"]:
+    # written before returning even with fast_path, so that a random play right after this one already avoids this spot
+    if random_offset is not None:
+        user.last_random_play_offset = random_offset
+        db.session.commit()
+    check_playability = not _is_playability_fresh(track)
+    if fast_path:
+        _play_recorder.submit(_record_play, sp, user.id, track.uri, today_datetime(), check_playability)
+        return ""
+
+    if check_playability and update_playability(sp, [track_uri]):
         raise ValueError("Track is not playable")
     else:
-        spotify_play = SpotifyPlay(user_id=user.id, spotify_track_uri=track.uri, created_at=today_datetime())
-        db.session.add(spotify_play)
+        record_spotify_play(user.id, track.uri, today_datetime())
         db.session.commit()
         return ""
 
 
-def get_liked_page(sp, offset: int) -> List[JsonDict]:
-    tries = 0
-    while tries < 10:
-        tries += 1
-        try:
-            return sp.current_user_saved_tracks(limit=50, offset=offset)["items"]
-        except Exception as e:
-            continue
-    log("returned nothing")
-    return []
+# retries & backoff happen in http_client. Failures are raised rather than swallowed, since a silently empty page
+# would make a full sync delete saved tracks.
+def get_liked_page(sp, offset: int) -> JsonDict:
+    return sp.current_user_saved_tracks(limit=LIKED_TRACKS_PER_PAGE, offset=offset)
 
 
-def get_top_tracks(sp, artist: SpotifyArtist, allow_refresh: bool = False) -> Tuple[int, List[TopTrack]]:
-    should_refresh = allow_refresh and (
-        artist.last_top_tracks_refresh is None
-        or artist.last_top_tracks_refresh < (datetime.datetime.utcnow() - timedelta(days=7))
-    )
-    if should_refresh:
-        dropped = TopTrack.query.filter_by(artist_uri=artist.uri).delete()
-        top_tracks = sp.artist_top_tracks(artist_id=artist.uri)["tracks"]
-        to_return = []
-        for ordinal, top_track in enumerate(top_tracks, 1):
-            track = add_or_get_track(sp, top_track["uri"])
-            top_track_db = TopTrack(track_uri=track.uri, artist_uri=artist.uri, ordinal=ordinal)
-            db.session.add(top_track_db)
-            to_return.append(top_track_db)
-        artist.last_top_tracks_refresh = datetime.datetime.utcnow()
-        db.session.commit()
-        return dropped, to_return
-    else:
-        return 0, (
-            db.session.query(TopTrack)
-            .filter(TopTrack.artist_uri == artist.uri)
-            .order_by(TopTrack.ordinal.asc())  # type: ignore
-            .all()
+# Artists followed by anyone whose top tracks are older than TOP_TRACKS_REFRESH_INTERVAL, most out of date first.
+def get_artists_with_stale_top_tracks() -> List[SpotifyArtist]:
+    return (
+        SpotifyArtist.query.filter(
+            SpotifyArtist.uri.in_(  # type: ignore
+                db.session.query(ManagedSpotifyArtist.spotify_artist_uri).filter_by(following=True)
+            )
+        )
+        .filter(
+            or_(
+                SpotifyArtist.last_top_tracks_refresh.is_(None),  # type: ignore
+                SpotifyArtist.last_top_tracks_refresh < datetime.datetime.utcnow() - TOP_TRACKS_REFRESH_INTERVAL,
+            )
         )
+        .order_by(SpotifyArtist.last_top_tracks_refresh.asc().nullsfirst())  # type: ignore
+        .all()
+    )
+
+
+# Fetches everything we store about an artist's catalog. Makes API calls only, so it is safe to run on worker threads.
+def fetch_artist_refresh(sp, artist_uri: str) -> Tuple[List[JsonDict], List[JsonDict]]:
+    return sp.artist_top_tracks(artist_id=artist_uri)["tracks"], sp.artist_albums(artist_uri, limit=50)["items"]
+
+
+# Writes the results of fetch_artist_refresh for many artists at once, replacing their previous top tracks.
+def store_artist_refreshes(sp, refreshes: Dict[str, Tuple[List[JsonDict], List[JsonDict]]]) -> None:
+    if not refreshes:
+        return
+    upsert_tracks(sp, [top_track for top_tracks, _ in refreshes.values() for top_track in top_tracks])
+    # the simplified albums returned by artist_albums already have everything we store, so insert them directly
+    upsert_albums(sp, [album for _, albums in refreshes.values() for album in albums])
+    artist_uris = list(refreshes.keys())
+    TopTrack.query.filter(TopTrack.artist_uri.in_(artist_uris)).delete(synchronize_session=False)  # type: ignore
+    _bulk_insert_ignoring_conflicts(
+        TopTrack,
+        [
+            {"artist_uri": artist_uri, "track_uri": top_track["uri"], "ordinal": ordinal}
+            for artist_uri, (top_tracks, _) in refreshes.items()
+            for ordinal, top_track in enumerate(top_tracks, 1)
+        ],
+    )
+    SpotifyArtist.query.filter(SpotifyArtist.uri.in_(artist_uris)).update(  # type: ignore
+        {"last_top_tracks_refresh": datetime.datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
 
 
 def get_followed_managed_spotify_artists_for_user(user: User, should_update: bool) -> List[ManagedSpotifyArtist]:
@@ -445,144 +817,351 @@ def get_followed_managed_spotify_artists_for_user(user: User, should_update: boo
     return ManagedSpotifyArtist.query.filter_by(user_id=user.id, following="true").all()
 
 
-def get_common_artists(user: User) -> List[SpotifyArtist]:
-    artists_with_at_least_three_listens_sql = f"""
-select sa.uri
-from spotify_plays sp
-         join spotify_tracks st on sp.spotify_track_uri = st.uri
-         join spotify_features sf on st.uri = sf.spotify_track_uri
-         join spotify_artists sa on sf.spotify_artist_uri = sa.uri
-where sp.user_id = {user.id}
+# artists with at least three listens
+def get_common_artists_sql(user: User) -> str:
+    return f"""
+select sf.spotify_artist_uri
+from spotify_play_totals spt
+         join spotify_features sf on spt.spotify_track_uri = sf.spotify_track_uri
+where spt.user_id = {user.id}
 group by 1
-having count(distinct st.uri) >= 3"""
-    artists = [row[0] for row in list(db.engine.execute(artists_with_at_least_three_listens_sql))]
+having count(*) >= 3"""
+
+
+def get_common_artists(user: User) -> List[SpotifyArtist]:
+    artists = [row[0] for row in list(db.engine.execute(get_common_artists_sql(user)))]
     return SpotifyArtist.query.filter(SpotifyArtist.uri.in_(artists)).all()  # type: ignore
 
 
-def get_all_liked_tracks(sp):
-    liked_tracks = list()
+# Local files show up in the saved tracks endpoint but have no catalog entry we could reference, so skip them.
+def _get_syncable_saved_items(items: List[JsonDict]) -> List[JsonDict]:
+    return [item for item in items if item["track"] and not item["track"].get("is_local")]
+
 
-    pages = sp.current_user_saved_tracks(limit=1)["total"] // 50 + 1
-    offsets = [x * 50 for x in range(0, pages)]
+def _get_added_at(item: JsonDict) -> datetime.datetime:
+    return parser.parse(item["added_at"]).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def _upsert_saved_tracks(sp, user: User, items: List[JsonDict]) -> None:
+    for chunk in chunker(items, SAVED_TRACKS_UPSERT_CHUNK_SIZE):
+        upsert_tracks(sp, list({item["track"]["uri"]: item["track"] for item in chunk}.values()))
+        rows = {
+            item["track"]["uri"]: {
+                "user_id": user.id,
+                "spotify_track_uri": item["track"]["uri"],
+                "added_at": _get_added_at(item),
+            }
+            for item in chunk
+        }
+        statement = insert(SpotifySavedTrack.__table__).values(list(rows.values()))
+        db.session.execute(
+            statement.on_conflict_do_update(
+                constraint="_user_id_and_saved_spotify_track_uri", set_={"added_at": statement.excluded.added_at}
+            )
+        )
+        db.session.commit()
+
+
+# Downloads the whole library (pages in parallel), then drops any saved track that is no longer liked.
+def _full_sync_saved_tracks(sp, user: User) -> None:
+    first_page = get_liked_page(sp, 0)
+    offsets = list(range(LIKED_TRACKS_PER_PAGE, first_page["total"], LIKED_TRACKS_PER_PAGE))
+    items = list(first_page["items"])
     with ThreadPoolExecutor() as executor:
-        for saved in executor.map(get_liked_page, [sp] * pages, offsets):
-            liked_tracks.extend(saved)
+        for page in executor.map(get_liked_page, [sp] * len(offsets), offsets):
+            items.extend(page["items"])
+    items = _get_syncable_saved_items(items)
+    _upsert_saved_tracks(sp, user, items)
+
+    removed = SpotifySavedTrack.query.filter_by(user_id=user.id)
+    if items:
+        removed = removed.filter(
+            SpotifySavedTrack.spotify_track_uri.notin_([item["track"]["uri"] for item in items])  # type: ignore
+        )
+    log(f"full saved tracks sync for {user.username}: {len(items)} saved, {removed.count()} removed")
+    removed.delete(synchronize_session=False)
+    user.last_saved_tracks_full_sync = datetime.datetime.utcnow()
+    db.session.commit()
 
-    return liked_tracks
+
+# Saved tracks come back newest-first, so we only need to page until we reach an added_at we have already stored. This
+# can't see removals, so returns False if the library is known to have shrunk and a full sync is required.
+def _delta_sync_saved_tracks(sp, user: User, latest_added_at: datetime.datetime) -> bool:
+    new_items: List[JsonDict] = []
+    offset = 0
+    while True:
+        page = get_liked_page(sp, offset)
+        if offset == 0:
+            total = page["total"]
+        new = [item for item in page["items"] if _get_added_at(item) >= latest_added_at]
+        new_items.extend(new)
+        if len(new) < len(page["items"]) or not page["next"]:
+            break
+        offset += LIKED_TRACKS_PER_PAGE
+    _upsert_saved_tracks(sp, user, _get_syncable_saved_items(new_items))
+    # total also counts local files, which we don't store, so it can only ever be larger than our count
+    return total >= SpotifySavedTrack.query.filter_by(user_id=user.id).count()
+
+
+def sync_saved_tracks(sp, user: User) -> None:
+    latest_added_at = (
+        db.session.query(func.max(SpotifySavedTrack.added_at)).filter(SpotifySavedTrack.user_id == user.id).scalar()
+    )
+    needs_full_sync = (
+        latest_added_at is None
+        or user.last_saved_tracks_full_sync is None
+        or user.last_saved_tracks_full_sync < datetime.datetime.utcnow() - SAVED_TRACKS_FULL_SYNC_INTERVAL
+    )
+    if needs_full_sync or not _delta_sync_saved_tracks(sp, user, latest_added_at):
+        _full_sync_saved_tracks(sp, user)
 
 
 def backfill_null():
-    sp = get_spotify("zdone", User.query.filter_by(username="rsanek").one())
-    all = SpotifyTrack.query.filter_by(api_response=None).all()
-    log(f"{len(all)} tracks to add API responses to.")
-    current = 0
-    for fifty_tracks in chunker(all, 50):
-        sp_tracks = sp.tracks([f.uri for f in fifty_tracks])["tracks"]
-        for track, sp_track in zip(fifty_tracks, sp_tracks):
-            track.api_response = json.dumps(sp_track)
-        db.session.commit()
-        current += 50
-        log(f"Successfully added 50 API responses. {round(current * 1000 / len(all)) / 10}% done.")
+    user = User.query.filter_by(username="rsanek").one()
+    run_backfill(
+        BackfillJob(
+            name="spotify_track_api_responses",
+            key_column=SpotifyTrack.uri,
+            candidates=lambda: db.session.query(SpotifyTrack.uri).filter(SpotifyTrack.api_response == None),
+            get_client=lambda: get_spotify("zdone", user),
+            fetch=lambda sp, rows: list(zip([row[0] for row in rows], sp.tracks([row[0] for row in rows])["tracks"])),
+            write=lambda sp, tracks: db.session.bulk_update_mappings(
+                SpotifyTrack, [{"uri": uri, "api_response": json.dumps(sp_track)} for uri, sp_track in tracks]
+            ),
+            batch_size=TRACKS_PER_REQUEST,
+        )
+    )
 
 
-def get_tracks(user: User) -> List[JsonDict]:
-    log(f"get tracks {today_datetime()}")
+# Brings the mirrors the deck's tracks are read from (followed artists & saved tracks) up to date with Spotify. Returns
+# False if the user hasn't connected Spotify.
+def sync_deck_track_inputs(user: User) -> bool:
     sp = get_spotify("zdone", user)
     if isinstance(sp, str):
-        return []
-    dedup_map = {}
-    my_managed_artists = get_followed_managed_spotify_artists_for_user(user, True)
-    managed_arists_uris = set([artist.spotify_artist_uri for artist in my_managed_artists])
-    not_following_but_liked_tracks: Dict[str, int] = collections.defaultdict(int)
-
-    # get liked tracks, then filter for artists that are in ARTISTS
-    log(f"getting liked {today_datetime()}")
-    liked_tracks = get_all_liked_tracks(sp)
-
-    for item in liked_tracks:
-        track = item["track"]
-        artists = [artist["uri"] for artist in track["artists"]]
-        if set(artists).intersection(managed_arists_uris):
-            dedup_map[track["uri"]] = track
-        else:
-            for artist in track["artists"]:
-                not_following_but_liked_tracks[artist["name"]] = not_following_but_liked_tracks[artist["name"]] + 1
-
-    print(sorted(not_following_but_liked_tracks.items(), key=lambda dict_item: -dict_item[1])[:10])
-
-    log("getting all played tracks")
-    for track in SpotifyTrack.query.join(SpotifyPlay).filter_by(user_id=user.id).distinct().all():
-        dedup_map[track.uri] = json.loads(track.api_response)
-
-    log(f"getting top 3 tracks per artist {today_datetime()}")
-    # get top 3 tracks for each artist in ARTISTS
-    for artist in my_managed_artists:
-        _, tracks = get_top_tracks(sp, SpotifyArtist.query.filter_by(uri=artist.spotify_artist_uri).one())
-        for top_track in tracks[: artist.num_top_tracks]:
-            dedup_map[top_track.track_uri] = json.loads(
-                SpotifyTrack.query.filter_by(uri=top_track.track_uri).one().api_response
-            )
-
-    output = dedup_map.values()
+        return False
+    follow_unfollow_artists(user)
+    log(f"syncing liked {today_datetime()}")
+    sync_saved_tracks(sp, user)
+    return True
+
+
+# Every track that belongs in the user's deck: liked tracks by a followed artist, every played track, and the top
+# num_top_tracks tracks of each followed artist, except tracks that are no longer playable. Assembled in a single query
+# that only reads the fields needed for cards (from the track, album & artist tables), never the api_response blob.
+def get_deck_tracks_sql(user: User) -> str:
+    return f"""
+with followed_artists as (
+    select spotify_artist_uri, num_top_tracks
+    from managed_spotify_artists
+    where user_id = {user.id}
+      and following
+),
+     ranked_top_tracks as (
+         select tt.track_uri,
+                fa.num_top_tracks,
+                row_number() over (partition by tt.artist_uri order by tt.ordinal) as rank
+         from top_tracks tt
+                  join followed_artists fa on tt.artist_uri = fa.spotify_artist_uri
+     ),
+     deck_track_uris as (
+         select sst.spotify_track_uri as uri
+         from spotify_saved_tracks sst
+                  join spotify_features sf on sst.spotify_track_uri = sf.spotify_track_uri
+                  join followed_artists fa on sf.spotify_artist_uri = fa.spotify_artist_uri
+         where sst.user_id = {user.id}
+         union
+         select spotify_track_uri
+         from spotify_play_totals
+         where user_id = {user.id}
+         union
+         select track_uri
+         from ranked_top_tracks
+         where num_top_tracks is null or rank <= num_top_tracks
+     )
+select st.uri,
+       st.name,
+       -- tracks added before spotify_features existed may not have any, so fall back to the primary artist
+       coalesce(array_agg(sa.uri order by sf.ordinal) filter (where sa.uri is not null), array [pa.uri]),
+       coalesce(array_agg(sa.name order by sf.ordinal) filter (where sa.uri is not null), array [pa.name]),
+       al.name,
+       al.released_at,
+       al.spotify_image_url
+from spotify_tracks st
+         join deck_track_uris dtu on st.uri = dtu.uri
+         join spotify_albums al on st.spotify_album_uri = al.uri
+         join spotify_artists pa on st.spotify_artist_uri = pa.uri
+         left join spotify_features sf on st.uri = sf.spotify_track_uri
+         left join spotify_artists sa on sf.spotify_artist_uri = sa.uri
+-- tracks marked unplayable by the nightly playability sweep would only make cards that fail to play
+where coalesce(st.is_playable, true)
+group by st.uri, al.uri, pa.uri"""
+
+
+# The deck's tracks (see get_deck_tracks_sql), streamed row by row. Each track looks like
+# {"uri", "name", "artists": [{"uri", "name"}], "album_name", "album_released_at", "album_image_url"}.
+# Pass sync=False if sync_deck_track_inputs was just called, to read the mirrors as they are.
+def get_tracks(user: User, sync: bool = True) -> Iterator[JsonDict]:
+    log(f"get tracks {today_datetime()}")
+    if sync and not sync_deck_track_inputs(user):
+        return
 
-    log(f"[skipped] ensuring all tracks are in db {today_datetime()}")
-    # bulk_add_tracks(sp, [track['uri'] for track in output])
-    return list(output)
+    liked_but_not_followed = [tuple(row) for row in db.engine.execute(_get_liked_but_not_followed_artists_sql(user))]
+    log(f"most liked artists that aren't followed: {liked_but_not_followed}")
+
+    log(f"getting deck tracks {today_datetime()}")
+    for (
+        uri,
+        name,
+        artist_uris,
+        artist_names,
+        album_name,
+        album_released_at,
+        album_image_url,
+    ) in db.engine.execution_options(stream_results=True).execute(get_deck_tracks_sql(user)):
+        yield {
+            "uri": uri,
+            "name": name,
+            "artists": [{"uri": u, "name": n} for u, n in zip(artist_uris, artist_names)],
+            "album_name": album_name,
+            "album_released_at": album_released_at,
+            "album_image_url": album_image_url,
+        }
+
+
+def _get_liked_but_not_followed_artists_sql(user: User) -> str:
+    return f"""
+select sa.name, count(*)
+from spotify_saved_tracks sst
+         join spotify_features sf on sst.spotify_track_uri = sf.spotify_track_uri
+         join spotify_artists sa on sf.spotify_artist_uri = sa.uri
+where sst.user_id = {user.id}
+  and not exists(select 1
+                 from spotify_features sf2
+                          join managed_spotify_artists msa on sf2.spotify_artist_uri = msa.spotify_artist_uri
+                 where sf2.spotify_track_uri = sst.spotify_track_uri
+                   and msa.user_id = {user.id}
+                   and msa.following)
+group by 1
+order by 2 desc
+limit 10"""
+
+
+def _get_quiz_pool(name: str, build: Callable[[], JsonDict]) -> JsonDict:
+    cached = _quiz_pools.get(name)
+    if cached and cached[0] > time.time() - QUIZ_POOL_TTL.total_seconds():
+        return cached[1]
+
+    # only one request rebuilds a given pool; the others wait here and then pick up the rebuilt pool. Requests for other
+    # pools, or for this one while it's fresh, don't wait.
+    with _quiz_pool_locks.setdefault(name, threading.Lock()):
+        cached = _quiz_pools.get(name)
+        if cached and cached[0] > time.time() - QUIZ_POOL_TTL.total_seconds():
+            return cached[1]
+        pool = build()
+        _quiz_pools[name] = (time.time(), pool)
+        return pool
+
+
+# the correct artist plus distinct distractors drawn from artist_names, shuffled
+def _get_quiz_artist_choices(correct_artist: str, artist_names: List[str]) -> List[str]:
+    choices = [correct_artist]
+    while len(choices) < min(QUIZ_ARTIST_CHOICES, len(set(artist_names) | {correct_artist})):
+        maybe_artist = random.choice(artist_names)
+        if maybe_artist not in choices:
+            choices.append(maybe_artist)
+    random.shuffle(choices)
+    return choices
+
+
+# The most recently liked tracks of rsanek, as (track uri, primary artist name), read from the saved tracks mirror. The
+# nightly refresh keeps the mirror up to date, so building the pool makes no Spotify calls.
+def _build_top_liked_pool() -> JsonDict:
+    user = User.query.filter_by(username="rsanek").one()
+    sql = f"""
+select st.uri, sa.name
+from spotify_saved_tracks sst
+         join spotify_tracks st on sst.spotify_track_uri = st.uri
+         join spotify_artists sa on st.spotify_artist_uri = sa.uri
+where sst.user_id = {user.id}
+order by sst.added_at desc
+limit {TOP_LIKED_QUIZ_TRACKS}"""
+    tracks = [(row[0], row[1]) for row in db.engine.execute(sql)]
+    return {"tracks": tracks, "artist_names": [name for _, name in tracks]}
 
 
 def get_top_liked() -> JsonDict:
+    pool = _get_quiz_pool("top_liked", _build_top_liked_pool)
+    track_uri, correct_artist = random.choice(pool["tracks"])
     sp = get_spotify("", User.query.filter_by(username="rsanek").one())
-    results = sp.current_user_saved_tracks(limit=50)
-    artists = []
-    tracks = []
-    for item in results["items"]:
-        track = item["track"]
-        artists.append(track["artists"][0]["name"])
-        tracks.append(track)
-
-    selected_track = random.choice(tracks)
-    sp.start_playback(uris=[selected_track["uri"]], position_ms=20000)
-    correct_artist = selected_track["artists"][0]["name"]
-
-    final_artists = [correct_artist]
-    while len(final_artists) < 8:
-        maybe_artist = random.choice(artists)
-        if maybe_artist not in final_artists:
-            final_artists.append(maybe_artist)
-
-    random.shuffle(final_artists)
-    return {"artists": final_artists, "correct_artist": correct_artist}
+    sp.start_playback(uris=[track_uri], position_ms=20000)
+    return {"artists": _get_quiz_artist_choices(correct_artist, pool["artist_names"]), "correct_artist": correct_artist}
+
+
+# For each of FAMILY_QUIZ_USER_IDS, the followed artists that have at least one playable track, along with those tracks,
+# plus the names of every artist managed by any of those users to use as distractors.
+def _build_family_pool() -> JsonDict:
+    user_ids = ", ".join(str(user_id) for user_id in FAMILY_QUIZ_USER_IDS)
+    tracks_sql = f"""
+select msa.user_id, sa.uri, sa.name, st.uri
+from managed_spotify_artists msa
+         join spotify_artists sa on msa.spotify_artist_uri = sa.uri
+         join spotify_tracks st on sa.uri = st.spotify_artist_uri
+where msa.user_id in ({user_ids})
+  and msa.following
+  and st.is_playable is not false"""
+    artists_by_user: Dict[int, Set[Tuple[str, str]]] = {}
+    # sets, since each track comes back once per user following its artist
+    tracks_by_artist: Dict[str, Set[str]] = {}
+    for user_id, artist_uri, artist_name, track_uri in db.engine.execute(tracks_sql):
+        artists_by_user.setdefault(user_id, set()).add((artist_uri, artist_name))
+        tracks_by_artist.setdefault(artist_uri, set()).add(track_uri)
+
+    distractors_sql = f"""
+select sa.name
+from managed_spotify_artists msa
+         join spotify_artists sa on msa.spotify_artist_uri = sa.uri
+where msa.user_id in ({user_ids})"""
+    return {
+        "artists_by_user": {user_id: sorted(artists) for user_id, artists in artists_by_user.items()},
+        "tracks_by_artist": {artist_uri: sorted(track_uris) for artist_uri, track_uris in tracks_by_artist.items()},
+        "artist_names": [row[0] for row in db.engine.execute(distractors_sql)],
+    }
 
 
 def get_random_song_family() -> JsonDict:
-    user_ids = [1, 4, 5]
-    user_id = random.choice(user_ids)
-    managed_artist = random.choice(ManagedSpotifyArtist.query.filter_by(following="true", user_id=user_id).all())
-    artist = SpotifyArtist.query.filter_by(uri=managed_artist.spotify_artist_uri).one()
-    song = random.choice(SpotifyTrack.query.filter_by(spotify_artist_uri=managed_artist.spotify_artist_uri).all())
+    pool = _get_quiz_pool("family", _build_family_pool)
+    artist_uri, correct_artist = random.choice(pool["artists_by_user"][random.choice(list(pool["artists_by_user"]))])
     sp = get_spotify("", User.query.filter_by(username="vsanek").one())
-    sp.start_playback(uris=[song.uri], position_ms=20000)
-    correct_artist = artist.name
-
-    random_artists_all_users = [
-        pair[1].name
-        for pair in db.session.query(ManagedSpotifyArtist, SpotifyArtist)
-        .join(ManagedSpotifyArtist)
-        .filter(ManagedSpotifyArtist.user_id.in_(user_ids))  # type: ignore
-        .all()
-    ]
+    sp.start_playback(uris=[random.choice(pool["tracks_by_artist"][artist_uri])], position_ms=20000)
+    return {"artists": _get_quiz_artist_choices(correct_artist, pool["artist_names"]), "correct_artist": correct_artist}
 
-    final_artists = [correct_artist]
-    while len(final_artists) < 8:
-        maybe_artist = random.choice(random_artists_all_users)
-        if maybe_artist not in final_artists:
-            final_artists.append(maybe_artist)
 
-    random.shuffle(final_artists)
-    return {"artists": [correct_artist], "correct_artist": correct_artist}
+# Artists most similar to the ones the user follows (see app.artist_similarity), topped up with the most popular artists
+# across all users when there aren't enough, e.g. for users who don't follow anyone yet.
+def get_top_recommendations(user: User, limit: int) -> List[Tuple[str, str]]:
+    prepared_sql = f"""with my_artists as (select spotify_artist_uri
+from managed_spotify_artists
+where user_id = {user.id})
+select sa.name, sa.uri, sum(sas.similarity)
+from spotify_artist_similarities sas
+         join managed_spotify_artists msa on sas.artist_uri = msa.spotify_artist_uri
+         join spotify_artists sa on sas.similar_artist_uri = sa.uri
+where msa.user_id = {user.id}
+  and msa.following
+  and sas.similar_artist_uri not in (select * from my_artists)
+group by 1, 2
+order by 3 desc, 2 asc
+limit {limit}"""
+    recommendations = [(row[0], row[1].split("spotify:artist:")[1]) for row in db.engine.execute(prepared_sql)]
+    for popular in _get_popular_artists(user, limit):
+        if len(recommendations) >= limit:
+            break
+        if popular not in recommendations:
+            recommendations.append(popular)
+    return recommendations
 
 
-def get_top_recommendations(user: User) -> List[Tuple[str, str]]:
+def _get_popular_artists(user: User, limit: int) -> List[Tuple[str, str]]:
     prepared_sql = f"""with my_artists as (select spotify_artist_uri
 from managed_spotify_artists
 where user_id = {user.id}),
@@ -590,17 +1169,18 @@ where user_id = {user.id}),
                 from managed_spotify_artists
                          join spotify_artists sa on managed_spotify_artists.spotify_artist_uri = sa.uri
                 where last_fm_scrobbles is not null
-                group by 1, 2
-                order by 3 desc, 4 desc)
+                group by 1, 2)
 select *
 from grouped
-where uri not in (select * from my_artists)"""
+where uri not in (select * from my_artists)
+order by 3 desc, 4 desc
+limit {limit}"""
     return [(row[0], row[1].split("spotify:artist:")[1]) for row in db.engine.execute(prepared_sql)]
 
 
 def get_percentage_best_selling_artists(user: User, source) -> int:
     prepared_sql = f"""with my_follows as (select * from managed_spotify_artists where following and user_id = {user.id})
-select round(count(following)::float / count(*) * 100)
+select coalesce(round(count(following)::float / nullif(count(*), 0) * 100), 0)
 from best_selling_artists bsa
          left join my_follows mf on mf.spotify_artist_uri = bsa.artist_uri
          left join spotify_artists sa on bsa.artist_uri = sa.uri
@@ -608,7 +1188,7 @@ from best_selling_artists bsa
     return int([row[0] for row in db.engine.execute(prepared_sql)][0])
 
 
-def get_next_to_follow(user: User) -> List:
+def get_next_to_follow(user: User, limit: int) -> List[Tuple[str, str]]:
     prepared_sql = f"""with my_follows as (select * from managed_spotify_artists where following and user_id = {user.id})
 select name, uri, count(*), sum(coalesce(claimed_sales, 0))
 from best_selling_artists bsa
@@ -616,10 +1196,34 @@ from best_selling_artists bsa
          left join spotify_artists sa on bsa.artist_uri = sa.uri
 where mf.id is null
 group by 1, 2
-order by 3 desc, 4 desc, 2 asc"""
+order by 3 desc, 4 desc, 2 asc
+limit {limit}"""
     return [(row[0], row[1].split("spotify:artist:")[1]) for row in db.engine.execute(prepared_sql)]
 
 
+def refresh_music_dashboard_stats(user: User) -> MusicDashboardStats:
+    values = {
+        "user_id": user.id,
+        "percent_best_selling": get_percentage_best_selling_artists(user, BEST_SELLING_ARTISTS_SOURCE),
+        "percent_most_streamed": get_percentage_best_selling_artists(user, MOST_STREAMED_ARTISTS_SOURCE),
+        "percent_highest_certified": get_percentage_best_selling_artists(user, HIGHEST_CERTIFIED_ARTISTS_SOURCE),
+        "recommendations_json": json.dumps(get_top_recommendations(user, DASHBOARD_ARTISTS_SHOWN)),
+        "next_to_follow_json": json.dumps(get_next_to_follow(user, DASHBOARD_ARTISTS_SHOWN)),
+        "refreshed_at": datetime.datetime.utcnow(),
+    }
+    db.session.execute(
+        insert(MusicDashboardStats.__table__)
+        .values(values)
+        .on_conflict_do_update(index_elements=[MusicDashboardStats.user_id], set_=values)
+    )
+    db.session.commit()
+    return MusicDashboardStats.query.get(user.id)
+
+
+def get_music_dashboard_stats(user: User) -> MusicDashboardStats:
+    return MusicDashboardStats.query.get(user.id) or refresh_music_dashboard_stats(user)
+
+
 def get_artists_images() -> str:
     sp = get_spotify("", User.query.filter_by(username="rsanek").one())
     to_ret = ""
@@ -638,22 +1242,20 @@ def get_artists_images() -> str:
 
 def get_distinct_songs_this_week(user: User) -> int:
     return (
-        db.session.query(SpotifyPlay)
-        .join(SpotifyTrack)
-        .filter(SpotifyPlay.user_id == user.id)
-        .filter(SpotifyPlay.created_at >= today() - datetime.timedelta(days=7))
-        .distinct(SpotifyTrack.uri)
-        .count()
+        db.session.query(func.count(distinct(SpotifyPlayDaily.spotify_track_uri)))
+        .filter(SpotifyPlayDaily.user_id == user.id)
+        .filter(SpotifyPlayDaily.day >= today() - datetime.timedelta(days=7))
+        .scalar()
     )
 
 
 def get_new_this_week(user: User) -> List[str]:
     artists_ordered_by_distinct_days_and_total_listens = f"""
-select sa.name, count(distinct date_trunc('day', sp.created_at)), count(sp.id)
+select sa.name, count(distinct spd.day), sum(spd.plays)
 from spotify_artists sa
          join spotify_tracks st on sa.uri = st.spotify_artist_uri
-         join spotify_plays sp on st.uri = sp.spotify_track_uri
-where user_id = {user.id} and sp.created_at >= current_date - interval '7 days'
+         join spotify_play_daily spd on st.uri = spd.spotify_track_uri
+where user_id = {user.id} and spd.day >= current_date - interval '7 days'
 group by 1
 order by 2 desc, 3 desc"""
     return [row[0] for row in list(db.engine.execute(artists_ordered_by_distinct_days_and_total_listens))]
@@ -661,11 +1263,7 @@ order by 2 desc, 3 desc"""
 
 def get_new_songs_this_week(user: User) -> int:
     sql = f"""
-with mins as (select spotify_track_uri, min(created_at) as min_created
-              from spotify_plays
-              where user_id = {user.id}
-              group by 1)
-select *
-from mins
-where min_created >= current_date - interval '7 days'"""
-    return len(list(db.engine.execute(sql)))
+select count(*)
+from spotify_play_totals
+where user_id = {user.id} and first_played_on >= current_date - interval '7 days'"""
+    return db.engine.execute(sql).scalar()
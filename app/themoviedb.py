@@ -6,19 +6,22 @@ import tmdbsimple
 from pyyoutube import Api
 from sentry_sdk import capture_exception
 
-from app import kv, db
+from app import kv, db, http_client
+from app.backfill import BackfillJob, run_backfill
 from app.log import log
 from app.models.base import User
 from app.models.videos import Video, VideoPerson, VideoCredit, YouTubeVideo, ManagedVideo
 
 # https://developers.themoviedb.org/3/configuration/get-api-configuration
-from app.util import today, to_tmdb_id
+from app.util import today, to_tmdb_id, get_missing_keys
 
 BASE_URL = "https://image.tmdb.org/t/p/"
 POSTER_SIZE = "w500"
 YOUTUBE_DURATIONS_CACHE: Dict[str, int] = {}
 IGNORED_VIDEO_IDS = ["zdone:video:tmdb:693874"]
 
+tmdbsimple.REQUESTS_SESSION = http_client.get_session()
+
 
 class VideoType(Enum):
     MOVIE = 1
@@ -63,13 +66,16 @@ def refresh_videos(user: User):
         + [(False, wm) for wm in _get_full_paginated(acct.watchlist_movies)]
     )
     current_item, total_items = 0, len(tvs) + len(movies)
+    new_video_ids = get_missing_keys(Video.id, [f"zdone:video:tmdb:{video['id']}" for _, video in tvs + movies])
 
     for watched, tv in tvs:
         current_item += 1
         try:
             video_id = f"zdone:video:tmdb:{tv['id']}"
             if video_id not in IGNORED_VIDEO_IDS:
-                get_or_add_tv(video_id, tv, user, watched)
+                if video_id in new_video_ids:
+                    add_video(video_id, VideoType.TV, tv)
+                upsert_managed_video(user, video_id, watched)
                 name_and_year = f"{tv['name']} ({tv['first_air_date'][:4]})"
                 log(f"[{round(current_item / total_items * 100)}%] Successfully added {name_and_year}")
                 result += f"{name_and_year}<br>"
@@ -82,7 +88,9 @@ def refresh_videos(user: User):
         try:
             video_id = f"zdone:video:tmdb:{movie['id']}"
             if video_id not in IGNORED_VIDEO_IDS:
-                get_or_add_movie(video_id, movie, user, watched)
+                if video_id in new_video_ids:
+                    add_video(video_id, VideoType.MOVIE, movie)
+                upsert_managed_video(user, video_id, watched)
                 name_and_year = f"{movie['original_title']} ({movie.get('release_date', '9999')[:4]})"
                 log(f"[{round(current_item / total_items * 100)}%] Successfully added {name_and_year}")
                 result += f"{name_and_year}<br>"
@@ -97,10 +105,38 @@ def clean_description(description, video_name, replacement):
     return description.replace(video_name, replacement).replace(video_name.lower(), replacement)
 
 
-def hydrate_credits(video_id, credits):
+# creators are only passed for TV shows, and are ordered by their position in the created_by list
+def hydrate_credits(video_id, credits, creators=()) -> None:
+    orders_by_credit_id: Dict[str, Optional[int]] = {}
     for credit in credits["cast"] + [c for c in credits["crew"] if c["job"] == "Director"]:
-        get_or_add_credit(video_id, credit.get("order", None), credit["credit_id"])
-    return
+        orders_by_credit_id.setdefault(f"zdone:credits:tmdb:{credit['credit_id']}", credit.get("order", None))
+    for i, creator in enumerate(creators):
+        orders_by_credit_id.setdefault(f"zdone:credits:tmdb:{creator['credit_id']}", i)
+
+    # only request details for credits we don't have yet, then only request the people we don't have yet
+    missing_credit_ids = get_missing_keys(VideoCredit.id, orders_by_credit_id.keys())
+    credit_details = {
+        credit_id: tmdbsimple.Credits(credit_id.split(":")[3]).info() for credit_id in sorted(missing_credit_ids)
+    }
+    missing_person_ids = get_missing_keys(
+        VideoPerson.id, [f"zdone:person:tmdb:{detail['person']['id']}" for detail in credit_details.values()]
+    )
+    for person_id in sorted(missing_person_ids):
+        db.session.add(_get_person_from_tmdb(person_id))
+    db.session.flush()
+
+    for credit_id, credit_detail in credit_details.items():
+        db.session.add(
+            VideoCredit(
+                id=credit_id,
+                video_id=video_id,
+                person_id=f"zdone:person:tmdb:{credit_detail['person']['id']}",
+                character=credit_detail.get("media").get("character", None),
+                job=credit_detail.get("job", None),
+                order=orders_by_credit_id[credit_id],
+            )
+        )
+    db.session.commit()
 
 
 def get_or_add_first_youtube_trailer(videos) -> Optional[str]:
@@ -150,7 +186,9 @@ def _get_video_duration_from_youtube(key) -> Optional[int]:
     if key in YOUTUBE_DURATIONS_CACHE:
         return YOUTUBE_DURATIONS_CACHE.get(key)
 
-    video_data = Api(api_key=kv.get("YOUTUBE_API_KEY")).get_video_by_id(video_id=key)
+    api = Api(api_key=kv.get("YOUTUBE_API_KEY"))
+    api.session = http_client.get_session()
+    video_data = api.get_video_by_id(video_id=key)
     # we won't get back metadata from YouTube if the video was deleted, set to private, etc.
     if video_data.items:
         pt_string = video_data.items[0].contentDetails.duration
@@ -160,108 +198,82 @@ def _get_video_duration_from_youtube(key) -> Optional[int]:
     return None
 
 
-def get_or_add_credit(video_id, order, tmdb_credit_id):
-    credit_id = f"zdone:credits:tmdb:{tmdb_credit_id}"
-    maybe_credit = VideoCredit.query.filter_by(id=credit_id).one_or_none()
-    if not maybe_credit:
-        credit_detail = tmdbsimple.Credits(tmdb_credit_id).info()
-        person_id = f"zdone:person:tmdb:{credit_detail['person']['id']}"
-        get_or_add_person(person_id)
-        maybe_credit = VideoCredit(
-            id=credit_id,
-            video_id=video_id,
-            person_id=f"zdone:person:tmdb:{credit_detail['person']['id']}",
-            character=credit_detail.get("media").get("character", None),
-            job=credit_detail.get("job", None),
-            order=order,
-        )
-        db.session.add(maybe_credit)
-        db.session.commit()
-    return maybe_credit
-
-
 def get_or_add_person(person_id: str) -> VideoPerson:
     maybe_person = VideoPerson.query.filter_by(id=person_id).one_or_none()
     if not maybe_person:
-        person = tmdbsimple.People(to_tmdb_id(person_id)).info()
-        maybe_person = VideoPerson(
-            id=person_id,
-            name=person["name"],
-            image_url=get_full_tmdb_image_url(person["profile_path"]),
-            birthday=person["birthday"],
-            deathday=person["deathday"],
-            known_for=person["known_for_department"],
-        )
+        maybe_person = _get_person_from_tmdb(person_id)
         db.session.add(maybe_person)
         db.session.commit()
     return maybe_person
 
 
-def get_or_add_movie(movie_id: str, tmdb_api_movie_or_tv_response, user: User, watched: bool) -> Video:
-    return get_or_add_video(movie_id, VideoType.MOVIE, tmdb_api_movie_or_tv_response, user, watched)
-
+def _get_person_from_tmdb(person_id: str) -> VideoPerson:
+    person = tmdbsimple.People(to_tmdb_id(person_id)).info()
+    return VideoPerson(
+        id=person_id,
+        name=person["name"],
+        image_url=get_full_tmdb_image_url(person["profile_path"]),
+        birthday=person["birthday"],
+        deathday=person["deathday"],
+        known_for=person["known_for_department"],
+    )
 
-def get_or_add_tv(tv_id: str, tmdb_api_movie_or_tv_response, user: User, watched: bool) -> Video:
-    return get_or_add_video(tv_id, VideoType.TV, tmdb_api_movie_or_tv_response, user, watched)
 
+def add_video(video_id: str, type: VideoType, tmdb_api_movie_or_tv_response) -> Video:
+    if type == VideoType.MOVIE:
+        m_id = tmdb_api_movie_or_tv_response["id"]
+        title = tmdb_api_movie_or_tv_response["title"]
+        original_title = tmdb_api_movie_or_tv_response["original_title"]
+        description = tmdb_api_movie_or_tv_response["overview"]
+        image = get_full_tmdb_image_url(tmdb_api_movie_or_tv_response["poster_path"])
+
+        movie_detail = tmdbsimple.Movies(m_id)
+        info = movie_detail.info()
+        maybe_budget = int(info["budget"])
+        maybe_revenue = int(info["revenue"])
+
+        m_credits = tmdbsimple.Movies(m_id).credits()
+        maybe_video = Video(
+            id=video_id,
+            name=title,
+            original_name=original_title if original_title != title else None,
+            description=clean_description(description, title, "[film]"),
+            release_date=tmdb_api_movie_or_tv_response.get("release_date", None),
+            last_air_date=None,
+            youtube_trailer_key=get_or_add_first_youtube_trailer(movie_detail.videos()),
+            poster_image_url=image,
+            film_or_tv="film",
+            budget=maybe_budget if maybe_budget > 0 else None,
+            revenue=maybe_revenue if maybe_revenue > 0 else None,
+        )
+    else:
+        tv_details = tmdbsimple.TV(tmdb_api_movie_or_tv_response["id"])
+        tv_info = tv_details.info()
+        m_credits = tmdbsimple.TV(tmdb_api_movie_or_tv_response["id"]).credits()
+        name = tmdb_api_movie_or_tv_response["name"]
+        original_name = tmdb_api_movie_or_tv_response["original_name"]
+        maybe_video = Video(
+            id=video_id,
+            name=name,
+            original_name=original_name if original_name != name else None,
+            description=clean_description(
+                tmdb_api_movie_or_tv_response["overview"], tmdb_api_movie_or_tv_response["name"], "[TV show]"
+            ),
+            release_date=tv_info["first_air_date"],
+            last_air_date=tv_info["last_air_date"],
+            youtube_trailer_key=get_or_add_first_youtube_trailer(tv_details.videos()),
+            poster_image_url=get_full_tmdb_image_url(tmdb_api_movie_or_tv_response["poster_path"]),
+            film_or_tv="TV show",
+            seasons=len([s for s in tv_info["seasons"] if s["air_date"]]),
+        )
 
-def get_or_add_video(video_id: str, type: VideoType, tmdb_api_movie_or_tv_response, user: User, watched: bool) -> Video:
-    maybe_video = Video.query.filter_by(id=video_id).one_or_none()
-    if not maybe_video:
-        if type == VideoType.MOVIE:
-            m_id = tmdb_api_movie_or_tv_response["id"]
-            title = tmdb_api_movie_or_tv_response["title"]
-            original_title = tmdb_api_movie_or_tv_response["original_title"]
-            description = tmdb_api_movie_or_tv_response["overview"]
-            image = get_full_tmdb_image_url(tmdb_api_movie_or_tv_response["poster_path"])
-
-            movie_detail = tmdbsimple.Movies(m_id)
-            info = movie_detail.info()
-            maybe_budget = int(info["budget"])
-            maybe_revenue = int(info["revenue"])
-
-            m_credits = tmdbsimple.Movies(m_id).credits()
-            maybe_video = Video(
-                id=video_id,
-                name=title,
-                original_name=original_title if original_title != title else None,
-                description=clean_description(description, title, "[film]"),
-                release_date=tmdb_api_movie_or_tv_response.get("release_date", None),
-                last_air_date=None,
-                youtube_trailer_key=get_or_add_first_youtube_trailer(movie_detail.videos()),
-                poster_image_url=image,
-                film_or_tv="film",
-                budget=maybe_budget if maybe_budget > 0 else None,
-                revenue=maybe_revenue if maybe_revenue > 0 else None,
-            )
-        else:
-            tv_details = tmdbsimple.TV(tmdb_api_movie_or_tv_response["id"])
-            tv_info = tv_details.info()
-            m_credits = tmdbsimple.TV(tmdb_api_movie_or_tv_response["id"]).credits()
-            name = tmdb_api_movie_or_tv_response["name"]
-            original_name = tmdb_api_movie_or_tv_response["original_name"]
-            maybe_video = Video(
-                id=video_id,
-                name=name,
-                original_name=original_name if original_name != name else None,
-                description=clean_description(
-                    tmdb_api_movie_or_tv_response["overview"], tmdb_api_movie_or_tv_response["name"], "[TV show]"
-                ),
-                release_date=tv_info["first_air_date"],
-                last_air_date=tv_info["last_air_date"],
-                youtube_trailer_key=get_or_add_first_youtube_trailer(tv_details.videos()),
-                poster_image_url=get_full_tmdb_image_url(tmdb_api_movie_or_tv_response["poster_path"]),
-                film_or_tv="TV show",
-                seasons=len([s for s in tv_info["seasons"] if s["air_date"]]),
-            )
+    db.session.add(maybe_video)
+    db.session.commit()
+    hydrate_credits(video_id, m_credits, tv_info["created_by"] if type == VideoType.TV else ())
+    return maybe_video
 
-        db.session.add(maybe_video)
-        db.session.commit()
-        hydrate_credits(video_id, m_credits)
-        if type == VideoType.TV:
-            for i, creator_response in enumerate(tv_info["created_by"]):
-                get_or_add_credit(video_id, i, creator_response["credit_id"])
 
+def upsert_managed_video(user: User, video_id: str, watched: bool) -> None:
     maybe_managed_video = ManagedVideo.query.filter_by(user_id=user.id, video_id=video_id).one_or_none()
     if not maybe_managed_video:
         maybe_managed_video = ManagedVideo(
@@ -278,34 +290,35 @@ def get_or_add_video(video_id: str, type: VideoType, tmdb_api_movie_or_tv_respon
             maybe_managed_video.watched = watched
             db.session.commit()
 
-    return maybe_video
+
+# returns the update mapping for a video with its current name & original name (only if it differs) from TMDB
+def _fetch_video_names(video_id: str, film_or_tv: str) -> Dict[str, str]:
+    names = {"id": video_id}
+    if film_or_tv == "film":
+        m_info = tmdbsimple.Movies(to_tmdb_id(video_id)).info()
+        names["name"] = m_info["title"]
+        if m_info["title"] != m_info["original_title"]:
+            names["original_name"] = m_info["original_title"]
+    elif film_or_tv == "TV show":
+        tv_info = tmdbsimple.TV(to_tmdb_id(video_id)).info()
+        names["name"] = tv_info["name"]
+        if tv_info["name"] != tv_info["original_name"]:
+            names["original_name"] = tv_info["original_name"]
+    return names
 
 
 def backfill_null():
-    # for person in VideoPerson.query.filter_by(deathday=None).all():
-    #     api_person = tmdbsimple.People(to_tmdb_id(person.id)).info()
-    #     person.deathday = api_person['deathday']
-    #     log(f"Added death for {person.name}")
-    #     db.session.commit()
-    for video in Video.query.all():
-        if video.is_film():
-            m_info = tmdbsimple.Movies(to_tmdb_id(video.id)).info()
-            video.name = m_info["title"]
-            if m_info["title"] != m_info["original_title"]:
-                video.original_name = m_info["original_title"]
-
-        elif video.is_tv():
-            tv_info = tmdbsimple.TV(to_tmdb_id(video.id)).info()
-            video.name = tv_info["name"]
-            if tv_info["name"] != tv_info["original_name"]:
-                video.original_name = tv_info["original_name"]
-
-        # video.youtube_trailer_key = get_or_add_first_youtube_trailer(m_videos)
-        # if video.is_tv():
-        #     tv_info = tmdbsimple.TV(to_tmdb_id(video.id)).info()
-        #     video.seasons=len([s for s in tv_info['seasons'] if s['air_date']])
-        #     db.session.commit()
-    db.session.commit()
+    # TMDB has no multi-get, so batches are small and each video is one request
+    run_backfill(
+        BackfillJob(
+            name="tmdb_video_names",
+            key_column=Video.id,
+            candidates=lambda: db.session.query(Video.id, Video.film_or_tv),
+            fetch=lambda _, rows: [_fetch_video_names(video_id, film_or_tv) for video_id, film_or_tv in rows],
+            write=lambda _, names: db.session.bulk_update_mappings(Video, names),
+            batch_size=10,
+        )
+    )
 
 
 def get_full_tmdb_image_url(path):
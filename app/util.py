@@ -1,6 +1,6 @@
 import datetime
 import re
-from typing import Dict, Any, Optional, Tuple, Union, List
+from typing import Dict, Any, Optional, Tuple, Union, List, Iterable, Set
 
 import pytz
 from b2sdk.account_info import InMemoryAccountInfo
@@ -12,6 +12,33 @@ from app import kv, db
 from app.models.base import User, GateDef
 
 JsonDict = Dict[str, Any]
+# how many candidate keys get_missing_keys sends to postgres per query
+MISSING_KEYS_CHUNK_SIZE = 1000
+
+
+# via https://stackoverflow.com/a/434328
+def chunker(seq, size):
+    return (seq[pos : pos + size] for pos in range(0, len(seq), size))
+
+
+# Returns the subset of keys that are not yet present in column's table. Only the key column of the candidate rows is
+# ever selected, so memory & latency depend on the number of keys passed in rather than on the size of the table.
+def get_missing_keys(column, keys: Iterable[str]) -> Set[str]:
+    candidates = list(set(keys))
+    existing: Set[str] = set()
+    for chunk in chunker(candidates, MISSING_KEYS_CHUNK_SIZE):
+        existing.update([row[0] for row in db.session.query(column).filter(column.in_(chunk))])
+    return set(candidates) - existing
+
+
+# A fingerprint of every row sql returns, which changes whenever any of those rows does. Computed in the database (the sum
+# of a 64-bit hash of each row), so no rows are transferred and row order doesn't matter.
+def get_rows_fingerprint(sql: str) -> str:
+    fingerprint_sql = f"""
+select count(*), coalesce(sum(('x' || left(md5(t::text), 16))::bit(64)::bigint), 0)
+from ({sql}) t"""
+    count, total = list(db.engine.execute(fingerprint_sql))[0]
+    return f"{count}:{total}"
 
 
 def to_tmdb_id(zdone_id: str) -> int:
@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+
+from app import db
+from app.models.base import User
+from utils import TEST_URI_MARKER
+
+# catalog tables & their Spotify URI columns, ordered so that rows are deleted before the rows they reference
+TEST_CATALOG_COLUMNS = [
+    ("top_tracks", "track_uri"),
+    ("top_tracks", "artist_uri"),
+    ("spotify_features", "spotify_track_uri"),
+    ("spotify_features", "spotify_artist_uri"),
+    ("spotify_artist_similarities", "artist_uri"),
+    ("spotify_artist_similarities", "similar_artist_uri"),
+    ("best_selling_artists", "artist_uri"),
+    ("spotify_tracks", "uri"),
+    ("spotify_albums", "uri"),
+    ("spotify_artists", "uri"),
+]
+
+
+# also cleans up after earlier runs that were interrupted before they could do so themselves
+def _delete_test_rows() -> None:
+    test_user_ids = f"select id from users where username like '{TEST_URI_MARKER}-%%'"
+    user_tables = [
+        row[0]
+        for row in db.engine.execute(
+            "select table_name from information_schema.columns where column_name = 'user_id' and table_schema = 'public'"
+        )
+    ]
+    # task logs reference tasks, so have to go first
+    for table in sorted(user_tables, key=lambda table: table != "task_logs"):
+        db.engine.execute(f"delete from {table} where user_id in ({test_user_ids})")
+    db.engine.execute(f"delete from users where id in ({test_user_ids})")
+    for table, column in TEST_CATALOG_COLUMNS:
+        db.engine.execute(f"delete from {table} where {column} like '%%{TEST_URI_MARKER}%%'")
+    db.engine.execute(f"delete from kv where k like '%%{TEST_URI_MARKER}%%'")
+
+
+# A user of its own for a test that uses the database. Everything belonging to it, and every catalog row & kv entry the
+# test added, is deleted afterwards.
+@pytest.fixture
+def database_user():
+    _delete_test_rows()
+    name = f"{TEST_URI_MARKER}-{uuid.uuid4().hex}"
+    user = User(username=name, email=f"{name}@zdone.co", api_key=name)
+    db.session.add(user)
+    db.session.commit()
+    try:
+        yield user
+    finally:
+        db.session.rollback()
+        db.session.remove()
+        _delete_test_rows()
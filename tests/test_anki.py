@@ -1,15 +1,45 @@
+import datetime
 import re
+import threading
+import time
+from typing import List, Tuple
 
+import genanki
 import pytest
+from jsmin import jsmin
 
-from app.card_generation.anki import generate_full_apkg, TEST_FILENAME
+from app import db, spotify
+from app.card_generation import anki
+from app.card_generation.anki import (
+    generate_deck,
+    generate_full_apkg,
+    get_saved_manifest,
+    NoteManifest,
+    Section,
+    save_manifest,
+    save_section_versions,
+    SectionVersions,
+    TEST_FILENAME,
+    get_manifest_hash,
+    diff_manifests,
+    _CancellableDeck,
+    SectionCancelled,
+)
 from app.card_generation.readwise import get_highlight_model
 from app.card_generation.spotify import get_track_model, get_artist_model
 from app.card_generation.untappd import get_beer_model
-from app.card_generation.util import AnkiCard
+from app.card_generation.util import (
+    AnkiCard,
+    cached_model,
+    get_minified_js_for_review_log,
+    get_minified_js_for_song_jump,
+    render_template,
+)
 from app.card_generation.videos import get_video_person_model, get_video_model
 from app.card_generation.people_getter import _get_person_model
-from utils import TEST_USER
+from app.models.base import GateDef, User
+from app.spotify import hydrate_tracks, record_spotify_play
+from utils import FakeSpotify, fake_track, requires_database, TEST_USER
 
 
 def test_models_reasonable():
@@ -64,3 +94,136 @@ def test_models_reasonable():
 @pytest.mark.skip(reason="integration")
 def test_generate_full_apkg():
     generate_full_apkg(TEST_USER, TEST_FILENAME)
+
+
+def test_manifest_hash_ignores_note_order():
+    manifest = {"spotify:track:1": ("tracks", "a"), "spotify:artist:1": ("artists", "b")}
+    reordered = {"spotify:artist:1": ("artists", "b"), "spotify:track:1": ("tracks", "a")}
+    assert get_manifest_hash(manifest) == get_manifest_hash(reordered)
+    assert get_manifest_hash(manifest) != get_manifest_hash({**manifest, "spotify:track:1": ("tracks", "c")})
+
+
+def test_diff_manifests():
+    previous = {"unchanged": ("tracks", "a"), "changed": ("tracks", "b"), "removed": ("artists", "c")}
+    current = {"unchanged": ("tracks", "a"), "changed": ("tracks", "B"), "added": ("videos", "d")}
+    assert diff_manifests(previous, current) == (["added"], ["changed"], ["removed"])
+
+
+def test_cancelled_deck_stops_taking_notes():
+    cancelled = threading.Event()
+    deck = _CancellableDeck(cancelled)
+    model = get_beer_model(TEST_USER)
+    deck.add_note(genanki.Note(model=model, fields=["1"] + [""] * 9))
+    cancelled.set()
+    with pytest.raises(SectionCancelled):
+        deck.add_note(genanki.Note(model=model, fields=["2"] + [""] * 9))
+    assert len(deck.notes) == 1
+
+
+@requires_database
+def test_tracks_section_is_reused_while_its_rows_are_unchanged(database_user, monkeypatch):
+    sp = FakeSpotify()
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    monkeypatch.setattr(spotify, "follow_unfollow_artists", lambda user: None)
+    monkeypatch.setattr(spotify, "sync_saved_tracks", lambda sp, user: None)
+    get_sections = anki._get_sections
+    monkeypatch.setattr(anki, "_get_sections", lambda user: [s for s in get_sections(user) if s.name == "tracks"])
+    hydrate_tracks(sp, [fake_track(i)["uri"] for i in range(2)])
+    record_spotify_play(database_user.id, fake_track(0)["uri"], datetime.datetime.now())
+    db.session.commit()
+
+    def generate_and_save() -> Tuple[NoteManifest, SectionVersions]:
+        deck, manifest, versions = generate_deck(database_user)
+        save_manifest(database_user, get_saved_manifest(database_user), manifest, deck)
+        save_section_versions(database_user, versions)
+        db.session.commit()
+        return manifest, versions
+
+    manifest, versions = generate_and_save()
+    assert ["tracks"] == [section for section, _ in manifest.values()]
+    assert ["tracks"] == list(versions)
+
+    generated = []
+    monkeypatch.setattr(anki, "generate_tracks", lambda user, deck, tags: generated.append(user.id))
+    reused_manifest, versions = generate_and_save()
+    assert [] == generated
+    assert {} == versions
+    assert manifest == reused_manifest
+
+    # the version is taken after the sync, so that what the sync brings in is generated the same night
+    def play_while_syncing(sp, user: User) -> None:
+        record_spotify_play(user.id, fake_track(1)["uri"], datetime.datetime.now())
+        db.session.commit()
+
+    monkeypatch.setattr(spotify, "sync_saved_tracks", play_while_syncing)
+    _, versions = generate_and_save()
+    assert [database_user.id] == generated
+    assert ["tracks"] == list(versions)
+
+
+@requires_database
+def test_deck_is_not_held_up_by_a_stuck_section(database_user, monkeypatch):
+    release = threading.Event()
+    model = get_beer_model(database_user)
+
+    def add_note(user: User, deck: genanki.Deck, tags: List[str]) -> None:
+        deck.add_note(genanki.Note(model=model, fields=["1"] + [""] * 9))
+
+    # stuck on something other than adding a note, so never sees that it was cancelled
+    def get_stuck(user: User, deck: genanki.Deck, tags: List[str]) -> None:
+        release.wait(10)
+
+    sections = [
+        Section("quick", [add_note], [get_beer_model]),
+        Section("stuck", [get_stuck], [get_beer_model], timeout=datetime.timedelta(seconds=0.2)),
+    ]
+    monkeypatch.setattr(anki, "_get_sections", lambda user: sections)
+    monkeypatch.setattr(anki, "CANCELLED_SECTION_GRACE", datetime.timedelta(seconds=0.2))
+    started = time.time()
+    try:
+        deck, manifest, _ = generate_deck(database_user)
+    finally:
+        release.set()
+    assert time.time() - started < 2
+    assert ["quick"] == [section for section, _ in manifest.values()]
+
+
+def test_cached_model_is_built_once_per_user_settings(monkeypatch):
+    built = []
+
+    @cached_model(GateDef.INTERNAL_USER)
+    def get_model(user: User) -> genanki.Model:
+        built.append(user.username)
+        return genanki.Model(len(built), "test")
+
+    internal = {"internal"}
+    monkeypatch.setattr(User, "is_gated", lambda user, gate: user.username in internal)
+    user = User(username="demo", api_key="key", uses_rsAnki_javascript=True)
+    assert get_model(user) is get_model(User(username="other", api_key="key", uses_rsAnki_javascript=True))
+    assert ["demo"] == built
+    get_model(User(username="demo", api_key="key", uses_rsAnki_javascript=False))
+    get_model(User(username="demo", api_key="other key", uses_rsAnki_javascript=True))
+    get_model(User(username="internal", api_key="key", uses_rsAnki_javascript=True))
+    assert 4 == len(built)
+
+
+def test_scripts_minified_at_import_match_minifying_the_filled_in_script():
+    card_type = AnkiCard.NAME_TO_BREWERY
+    review_log = f"""
+function logReview() {{
+  $.getScript("https://www.zdone.co/api/{TEST_USER.api_key}/log/{{{{{card_type.id_field_name}}}}}/{card_type.name}");
+}};
+logReview();
+"""
+    assert jsmin(review_log) == get_minified_js_for_review_log(TEST_USER.api_key, card_type)
+    assert f"https://www.zdone.co/api/{TEST_USER.api_key}/play/{{{{Track URI}}}}/pr" in get_minified_js_for_song_jump(
+        TEST_USER.api_key
+    )
+
+
+def test_templates_are_rendered_once_per_arguments():
+    render_template.cache_clear()
+    first = render_template(AnkiCard.NAME_TO_BREWERY, False, TEST_USER.api_key, True)
+    assert first is render_template(AnkiCard.NAME_TO_BREWERY, False, TEST_USER.api_key, True)
+    assert first != render_template(AnkiCard.NAME_TO_BREWERY, False, "other key", True)
+    assert (1, 2) == (render_template.cache_info().hits, render_template.cache_info().misses)
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy import sparse
+
+from app import artist_similarity
+from app.artist_similarity import get_top_similar_artists
+
+
+def test_get_top_similar_artists():
+    # users x artists. Artists 0 & 1 are always liked together, artist 2 only shares one user with them, artist 3 has
+    # no listeners in common with anyone else.
+    user_artist = sparse.csr_matrix(
+        [
+            [1, 1, 0, 0],
+            [1, 1, 1, 0],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1],
+        ],
+        dtype=float,
+    )
+    top = get_top_similar_artists(user_artist, 2)
+    by_artist = {}
+    for artist, similar_artist, similarity, ordinal in top:
+        by_artist.setdefault(artist, []).append((similar_artist, round(similarity, 3), ordinal))
+
+    assert [(1, 1.0, 1), (2, 0.5, 2)] == by_artist[0]
+    assert [(0, 1.0, 1), (2, 0.5, 2)] == by_artist[1]
+    assert [(0, 0.5, 1), (1, 0.5, 2)] == by_artist[2]
+    assert 3 not in by_artist
+
+
+def test_get_top_similar_artists_limits_to_k():
+    user_artist = sparse.csr_matrix([[1, 1, 1, 1]], dtype=float)
+    top = get_top_similar_artists(user_artist, 2)
+    assert 8 == len(top)
+    assert {1, 2} == {ordinal for _, _, _, ordinal in top}
+
+
+def test_get_top_similar_artists_bounds_the_similarity_blocks(monkeypatch):
+    user_artist = sparse.random(40, 30, density=0.2, format="csr", random_state=np.random.RandomState(0))
+    everything_at_once = get_top_similar_artists(user_artist, 5)
+
+    monkeypatch.setattr(artist_similarity, "MAX_SIMILARITY_BLOCK_ENTRIES", 4 * 30)
+    block_shapes = []
+    get_blocks = artist_similarity._get_similarity_blocks
+
+    def get_recorded_blocks(normalized):
+        for start, block in get_blocks(normalized):
+            block_shapes.append(block.shape)
+            yield start, block
+
+    monkeypatch.setattr(artist_similarity, "_get_similarity_blocks", get_recorded_blocks)
+    assert everything_at_once == get_top_similar_artists(user_artist, 5)
+    assert [(4, 30)] * 7 + [(2, 30)] == block_shapes
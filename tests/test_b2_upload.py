@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tracemalloc
+from typing import IO, cast
+
+import genanki
+from b2sdk.account_info import InMemoryAccountInfo
+from b2sdk.api import B2Api
+from b2sdk.download_dest import DownloadDestBytes
+from b2sdk.raw_simulator import RawSimulator
+
+from app.b2_upload import B2StreamUpload
+from app.card_generation.anki import _write_package, SPOTIFY_TRACK_DECK_ID
+from app.card_generation.untappd import get_beer_model
+from utils import TEST_USER
+
+
+def _get_bucket():
+    raw_api = RawSimulator()
+    application_key_id, master_key = raw_api.create_account()
+    b2_api = B2Api(InMemoryAccountInfo(), raw_api=raw_api)
+    b2_api.authorize_account("production", application_key_id, master_key)
+    return b2_api.create_bucket("bucket", "allPrivate")
+
+
+def _download(bucket, file_id: str) -> bytes:
+    destination = DownloadDestBytes()
+    bucket.download_file_by_id(file_id, destination)
+    return destination.get_bytes_written()
+
+
+def _upload_in_chunks(bucket, data: bytes, part_size: int):
+    upload = B2StreamUpload(bucket, "file.apkg", {"user": "test"}, part_size=part_size)
+    for start in range(0, len(data), 100):
+        upload.write(data[start : start + 100])
+    return upload, upload.finish()
+
+
+def test_upload_in_parts():
+    bucket = _get_bucket()
+    data = os.urandom(4500)
+    upload, file_version = _upload_in_chunks(bucket, data, part_size=1000)
+
+    assert data == _download(bucket, file_version.id_)
+    assert len(data) == upload.size == file_version.size
+    assert hashlib.sha1(data).hexdigest() == upload.sha1.hexdigest()
+    # the first part is held back until the second one is full
+    assert upload.peak_buffered < 2 * 1000 + 100
+    # B2 only stores SHA1s for the parts of large files
+    assert "none" == file_version.content_sha1
+
+
+def test_upload_smaller_than_a_part():
+    bucket = _get_bucket()
+    data = os.urandom(500)
+    upload, file_version = _upload_in_chunks(bucket, data, part_size=1000)
+
+    assert data == _download(bucket, file_version.id_)
+    assert {"user": "test"} == file_version.file_info
+
+
+def test_upload_of_a_single_part_is_not_a_large_file(monkeypatch):
+    bucket = _get_bucket()
+
+    # B2 rejects large files of a single part
+    def start_large_file(*args, **kwargs):
+        raise AssertionError("started a large file")
+
+    monkeypatch.setattr(bucket, "start_large_file", start_large_file)
+    for size in [1000, 1500]:
+        data = os.urandom(size)
+        upload, file_version = _upload_in_chunks(bucket, data, part_size=1000)
+
+        assert data == _download(bucket, file_version.id_)
+        assert {"user": "test"} == file_version.file_info
+
+
+def test_abort_cancels_large_file():
+    bucket = _get_bucket()
+    upload = B2StreamUpload(bucket, "file.apkg", {}, part_size=1000)
+    upload.write(os.urandom(2500))
+    upload.abort()
+
+    assert [] == list(bucket.list_unfinished_large_files())
+
+
+# uploads nothing, so that the parts kept by the simulated bucket don't count towards the memory packaging needed
+class _DiscardingUpload(B2StreamUpload):
+    def _upload_part(self, part: bytes) -> None:
+        self._part_sha1s.append(hashlib.sha1(part).hexdigest())
+
+
+# memory is only measured here rather than on every upload, since tracing allocations slows down everything else
+def test_packaging_does_not_hold_the_whole_package_in_memory():
+    model = get_beer_model(TEST_USER)
+    deck = genanki.Deck(SPOTIFY_TRACK_DECK_ID, "Spotify Tracks")
+    for i in range(3000):
+        deck.add_note(genanki.Note(model=model, fields=[str(i), os.urandom(2000).hex()] + [""] * 8))
+    upload = _DiscardingUpload(_get_bucket(), "file.apkg", {}, part_size=1000000)
+
+    tracemalloc.start()
+    try:
+        _write_package(deck, cast(IO[bytes], upload))
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert upload.size > 4 * upload.part_size
+    assert peak_memory < upload.size / 2
@@ -0,0 +1,62 @@
+from typing import List
+
+import pytest
+
+from app import db, kv
+from app.backfill import BackfillJob, run_backfill, _get_checkpoint_key
+from app.models.spotify import SpotifyArtist
+from utils import fake_artist, requires_database, TEST_URI_MARKER
+
+
+@requires_database
+# database_user isn't used itself, but cleans up the artists & checkpoint afterwards
+def test_interrupted_backfill_resumes_after_its_last_completed_page(database_user):
+    uris = [fake_artist(i)["uri"] for i in range(10, 20)]
+    for uri in uris:
+        db.session.add(SpotifyArtist(uri=uri, name=uri))
+    db.session.commit()
+    fetched: List[str] = []
+    failing_batch = [uris[6], uris[7]]
+
+    def fetch(client, rows: List[tuple]) -> List[str]:
+        fetched.extend(row[0] for row in rows)
+        return [row[0] for row in rows]
+
+    def write(client, batch: List[str]) -> None:
+        if batch == failing_batch:
+            raise RuntimeError("interrupted")
+        db.session.bulk_update_mappings(SpotifyArtist, [{"uri": uri, "spotify_image_url": uri} for uri in batch])
+
+    # 2 workers with batches of 2 make pages of 4
+    job = BackfillJob(
+        name=f"{TEST_URI_MARKER}-images",
+        key_column=SpotifyArtist.uri,
+        candidates=lambda: db.session.query(SpotifyArtist.uri).filter(
+            SpotifyArtist.uri.like(f"%{TEST_URI_MARKER}%"), SpotifyArtist.spotify_image_url.is_(None)
+        ),
+        fetch=fetch,
+        write=write,
+        batch_size=2,
+        workers=2,
+    )
+
+    def get_backfilled() -> List[str]:
+        return [
+            artist.uri
+            for artist in SpotifyArtist.query.filter(SpotifyArtist.uri.in_(uris)).order_by(SpotifyArtist.uri)  # type: ignore
+            if artist.spotify_image_url
+        ]
+
+    with pytest.raises(RuntimeError):
+        run_backfill(job)
+    db.session.rollback()
+    # the second page's first batch was written, but isn't committed without its checkpoint
+    assert uris[:4] == get_backfilled()
+    assert uris[3] == kv.get(_get_checkpoint_key(job))
+
+    fetched.clear()
+    failing_batch = []
+    assert 6 == run_backfill(job)
+    assert uris[4:] == fetched
+    assert uris == get_backfilled()
+    assert "" == kv.get(_get_checkpoint_key(job))
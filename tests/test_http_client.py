@@ -0,0 +1,12 @@
+from app.http_client import JitteredRetry, RETRY_METHODS, RETRY_STATUSES
+
+
+def test_writes_are_only_retried_when_rate_limited():
+    retry = JitteredRetry(total=5, status_forcelist=RETRY_STATUSES, allowed_methods=RETRY_METHODS)
+    for status in [429, 500, 502, 503, 504]:
+        assert retry.is_retry("GET", status)
+    assert retry.is_retry("POST", 429)
+    assert retry.is_retry("PUT", 429)
+    assert not retry.is_retry("POST", 503)
+    assert not retry.is_retry("PUT", 500)
+    assert not retry.is_retry("DELETE", 502)
@@ -0,0 +1,65 @@
+import json
+
+import requests
+
+from app import http_client
+from app.card_generation.untappd import SharedSessionUntappd
+from app.http_replay import REDACTED, load_fixture, save_fixture, start_replay_server
+
+
+def _record(fixtures_dir, url: str, content: str) -> None:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = content.encode()
+    save_fixture(str(fixtures_dir), requests.Request("GET", url).prepare(), response)
+
+
+def _start_replaying(monkeypatch, fixtures_dir, **kwargs):
+    server = start_replay_server(str(fixtures_dir), **kwargs)
+    monkeypatch.setattr(http_client, "HTTP_MODE", "replay")
+    monkeypatch.setattr(http_client, "REPLAY_URL", f"http://127.0.0.1:{server.server_port}")
+    return server
+
+
+def test_replay_ignores_query_order_and_credentials(monkeypatch, tmp_path):
+    _record(tmp_path, "https://api.example.com/v1/items?b=2&a=1&api_key=recorded", '{"items": [1, 2]}')
+    server = _start_replaying(monkeypatch, tmp_path)
+    try:
+        response = http_client.get("https://api.example.com/v1/items?a=1&b=2&api_key=replayed")
+        assert 200 == response.status_code
+        assert {"items": [1, 2]} == response.json()
+        assert 404 == http_client.get("https://api.example.com/v1/other").status_code
+    finally:
+        server.shutdown()
+
+
+def test_replay_rate_limit_is_retried(monkeypatch, tmp_path):
+    _record(tmp_path, "https://api.example.com/v1/items", "[]")
+    server = _start_replaying(monkeypatch, tmp_path, requests_per_second=1)
+    try:
+        # the second request is answered with a 429 & Retry-After, which http_client waits out and retries
+        assert [200, 200] == [http_client.get("https://api.example.com/v1/items").status_code for _ in range(2)]
+    finally:
+        server.shutdown()
+
+
+def test_tokens_are_redacted_from_fixtures(tmp_path):
+    _record(
+        tmp_path,
+        "https://accounts.example.com/api/token",
+        '{"access_token": "a", "refresh_token": "r", "expires_in": 1}',
+    )
+    fixture = load_fixture(str(tmp_path), "GET", "https://accounts.example.com/api/token", None)
+    assert {"access_token": REDACTED, "refresh_token": REDACTED, "expires_in": 1} == json.loads(fixture["content"])
+
+
+def test_untappd_goes_through_http_client(monkeypatch, tmp_path):
+    url = "https://api.untappd.com/v4/beer/info/1?client_id=id&client_secret=recorded"
+    _record(tmp_path, url, '{"meta": {"code": 200}, "response": {"beer": {"bid": 1}}}')
+    server = _start_replaying(monkeypatch, tmp_path)
+    try:
+        client = SharedSessionUntappd(client_id="id", client_secret="replayed")
+        assert {"bid": 1} == client.beer.info(1)["response"]["beer"]
+    finally:
+        server.shutdown()
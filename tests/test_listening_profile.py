@@ -0,0 +1,58 @@
+import datetime
+import json
+from typing import Dict, List
+
+from app import db
+from app.listening_profile import get_artist_listening_profiles, refresh_artist_listening_profiles
+from app.models.spotify import SpotifyAlbum, SpotifyFeature
+from app.spotify import hydrate_tracks, record_spotify_play
+from utils import FakeSpotify, fake_album, fake_artist, fake_track, requires_database
+
+
+@requires_database
+def test_profiles_are_recomputed_only_when_their_inputs_change(database_user):
+    hydrate_tracks(FakeSpotify(), [fake_track(i)["uri"] for i in range(7)])
+
+    def play(*tracks: int) -> None:
+        for track in tracks:
+            record_spotify_play(database_user.id, fake_track(track)["uri"], datetime.datetime.now())
+        db.session.commit()
+
+    def get_profiles() -> Dict[int, List[list]]:
+        return {
+            int(uri[-1]): [
+                json.loads(profile.top_tracks_json),
+                json.loads(profile.top_albums_json),
+                json.loads(profile.top_collaborators_json),
+            ]
+            for uri, profile in get_artist_listening_profiles(database_user).items()
+        }
+
+    # tracks 0 & 5 are by artist 0 featuring artist 5, on albums 0 & 5
+    play(5, 0, 0)
+    assert 2 == refresh_artist_listening_profiles(database_user)
+    assert {
+        0: [["Track 0", "Track 5"], [["Album 0", 1999], ["Album 5", 1999]], ["Artist 5"]],
+        5: [[], [], ["Artist 0"]],
+    } == get_profiles()
+    assert 0 == refresh_artist_listening_profiles(database_user)
+
+    # whatever order plays are committed in, the totals they update are what profiles are computed from
+    play(1)
+    assert 2 == refresh_artist_listening_profiles(database_user)
+    play(5, 5)
+    assert 2 == refresh_artist_listening_profiles(database_user)
+    assert ["Track 5", "Track 0"] == get_profiles()[0][0]
+
+    SpotifyAlbum.query.get(fake_album(0)["uri"]).clean_name = "Album Zero"
+    db.session.commit()
+    assert 2 == refresh_artist_listening_profiles(database_user)
+    assert [["Album Zero", 1999], ["Album 5", 1999]] == get_profiles()[0][1]
+
+    SpotifyFeature.query.filter_by(
+        spotify_track_uri=fake_track(1)["uri"], spotify_artist_uri=fake_artist(6)["uri"]
+    ).delete()
+    db.session.commit()
+    assert 1 == refresh_artist_listening_profiles(database_user)
+    assert [0, 1, 5] == sorted(get_profiles())
+    assert [] == get_profiles()[1][2]
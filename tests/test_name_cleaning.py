@@ -0,0 +1,57 @@
+import re
+import time
+from typing import List
+
+import pytest
+
+from app import db
+from app.name_cleaning import ALBUM_NAME_RULES, TRACK_NAME_RULES, NameCleaner
+
+TITLES: List[str] = [
+    "Twist And Shout - Remastered 2009",
+    "Get Lucky (feat. Pharrell Williams & Nile Rodgers) - Radio Edit",
+    "Sucker For Pain (with Wiz Khalifa, Imagine Dragons, Logic & Ty Dolla $ign feat. X Ambassadors)",
+    "ringtone (Remix) [feat. Charli XCX, Rico Nasty, Kero Kero Bonito]",
+    'Mrs. Robinson - From "The Graduate" Soundtrack',
+    "Satisfaction (Isak Original Extended) - Benny Benassi Presents The Biz",
+    "Folsom Prison Blues - Live at Folsom State Prison, Folsom, CA - January 1968",
+    "Song - Remix - Remastered",
+    "Song - Bonus Track (feat. Someone)",
+    "Song (with Someone) - Edit - 2011 Remaster",
+    "Led Zeppelin IV (Deluxe Edition; Remaster)",
+    "Discovery (Deluxe / Remastered 2015)",
+    "Hypnotica (Benny Benassi Presents The Biz) (Remastered)",
+    "Random Album Title (Unmixed Extended Versions)",
+    "Hey Jude",
+    "÷",
+]
+
+
+def _clean_one_rule_at_a_time(rules: List[str], name: str) -> str:
+    for rule in rules:
+        name = re.sub(rule, "", name)
+    return name
+
+
+def test_name_cleaner_matches_applying_each_rule_in_turn():
+    for rules in [TRACK_NAME_RULES, ALBUM_NAME_RULES]:
+        cleaner = NameCleaner(rules)
+        for title in TITLES:
+            assert _clean_one_rule_at_a_time(rules, title) == cleaner.clean(title)
+
+
+@pytest.mark.skip(reason="integration")
+def test_name_cleaner_benchmark():
+    for table, rules in [("spotify_tracks", TRACK_NAME_RULES), ("spotify_albums", ALBUM_NAME_RULES)]:
+        names = [row[0] for row in db.engine.execute(f"select name from {table}")]
+        started = time.time()
+        expected = [_clean_one_rule_at_a_time(rules, name) for name in names]
+        one_rule_at_a_time = time.time() - started
+
+        cleaner = NameCleaner(rules)
+        started = time.time()
+        actual = [cleaner.clean(name) for name in names]
+        compiled = time.time() - started
+
+        assert expected == actual
+        print(f"{table}: {len(names)} names, {one_rule_at_a_time:.3f}s one rule at a time, {compiled:.3f}s compiled")
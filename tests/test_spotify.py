@@ -1,8 +1,51 @@
+import datetime
+import json
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+import genanki
 import pytest
 
-from app.card_generation.spotify import clean_album_name, clean_track_name
+from app import db, spotify
+from app.card_generation.spotify import generate_tracks
 from app.models.base import User
-from app.spotify import update_spotify_anki_playlist, follow_unfollow_artists
+from app.name_cleaning import clean_album_name, clean_track_name
+from app.util import JsonDict
+from app.models.spotify import (
+    BestSellingArtist,
+    SpotifyAlbum,
+    SpotifyArtist,
+    SpotifyFeature,
+    ManagedSpotifyArtist,
+    SpotifyPlay,
+    SpotifyPlayDaily,
+    SpotifyPlayTotal,
+    SpotifyPlaylistTrack,
+    SpotifySavedTrack,
+    SpotifyTrack,
+    TopTrack,
+)
+from app.spotify import (
+    update_spotify_anki_playlist,
+    follow_unfollow_artists,
+    hydrate_tracks,
+    sync_saved_tracks,
+    get_deck_track_uris_to_check_playability,
+    get_tracks,
+    get_artists_with_stale_top_tracks,
+    fetch_artist_refresh,
+    store_artist_refreshes,
+    update_playability,
+    record_spotify_play,
+    update_last_fm_scrobble_counts,
+    do_add_artists,
+    hydrate_artists,
+    get_music_dashboard_stats,
+)
+from utils import FakeSpotify, fake_album, fake_artist, fake_saved_track, fake_track, requires_database, TEST_URI_MARKER
 
 
 @pytest.mark.skip(reason="integration")
@@ -88,3 +131,484 @@ def test_clean_album_name():
 @pytest.mark.skip(reason="integration")
 def test_follow_unfollow_artists():
     follow_unfollow_artists(User.query.filter_by(username="rsanek").one())
+
+
+# Tracks 0 & 1 are the top tracks of followed artists 0 & 1 (showing 1 and all of their top tracks), 6 is artist 1's
+# second top track, 10 is a liked track by artist 0, and 3 was played. 5 is artist 0's second top track, 2 is liked but
+# not by a followed artist, and 4 has nothing to do with the user.
+def _add_deck_tracks(sp: FakeSpotify, user: User) -> None:
+    hydrate_tracks(sp, [fake_track(i)["uri"] for i in range(11)])
+    db.session.add(ManagedSpotifyArtist(user_id=user.id, spotify_artist_uri=fake_artist(0)["uri"], num_top_tracks=1))
+    db.session.add(ManagedSpotifyArtist(user_id=user.id, spotify_artist_uri=fake_artist(1)["uri"], num_top_tracks=None))
+    for artist, track, ordinal in [(0, 0, 1), (0, 5, 2), (1, 1, 1), (1, 6, 2)]:
+        db.session.add(
+            TopTrack(artist_uri=fake_artist(artist)["uri"], track_uri=fake_track(track)["uri"], ordinal=ordinal)
+        )
+    for track in [2, 10]:
+        db.session.add(
+            SpotifySavedTrack(
+                user_id=user.id, spotify_track_uri=fake_track(track)["uri"], added_at=datetime.datetime.now()
+            )
+        )
+    record_spotify_play(user.id, fake_track(3)["uri"], datetime.datetime.now())
+    db.session.commit()
+
+
+@requires_database
+def test_hydrate_tracks_fetches_only_missing_rows_in_batches(database_user):
+    sp = FakeSpotify()
+    uris = [fake_track(i)["uri"] for i in range(60)]
+    hydrate_tracks(sp, uris)
+    # albums come embedded in the tracks, so only the tracks & their artists are fetched
+    assert Counter(tracks=2, artists=1) == sp.calls
+    assert 60 == SpotifyTrack.query.filter(SpotifyTrack.uri.in_(uris)).count()
+    assert 120 == SpotifyFeature.query.filter(SpotifyFeature.spotify_track_uri.in_(uris)).count()
+    assert 10 == SpotifyArtist.query.filter(SpotifyArtist.uri.contains(TEST_URI_MARKER)).count()
+    assert 7 == SpotifyAlbum.query.filter(SpotifyAlbum.uri.contains(TEST_URI_MARKER)).count()
+
+    sp.calls.clear()
+    hydrate_tracks(sp, uris + [fake_track(60)["uri"]])
+    assert Counter(tracks=1) == sp.calls
+    assert "Track 60" == SpotifyTrack.query.get(fake_track(60)["uri"]).name
+
+
+@requires_database
+def test_sync_saved_tracks_pages_only_until_known_tracks(database_user):
+    sp = FakeSpotify()
+    day = datetime.datetime(2020, 1, 1)
+    sp.saved_tracks = [fake_saved_track(i, day - datetime.timedelta(hours=i)) for i in range(120)]
+
+    def get_saved_uris():
+        return {row.spotify_track_uri for row in SpotifySavedTrack.query.filter_by(user_id=database_user.id)}
+
+    # the first sync downloads everything
+    sync_saved_tracks(sp, database_user)
+    assert 3 == sp.calls["current_user_saved_tracks"]
+    assert {fake_track(i)["uri"] for i in range(120)} == get_saved_uris()
+    assert database_user.last_saved_tracks_full_sync is not None
+
+    # later ones stop at the first page that has tracks that were already saved
+    sp.calls.clear()
+    sp.saved_tracks = [
+        fake_saved_track(i, day + datetime.timedelta(hours=i)) for i in range(200, 210)
+    ] + sp.saved_tracks
+    sync_saved_tracks(sp, database_user)
+    assert 1 == sp.calls["current_user_saved_tracks"]
+    assert 130 == len(get_saved_uris())
+
+    # a removal can't be seen by paging from the newest, but the library shrinking gives it away
+    sp.calls.clear()
+    del sp.saved_tracks[50:55]
+    sync_saved_tracks(sp, database_user)
+    assert 1 + 3 == sp.calls["current_user_saved_tracks"]
+    assert {item["track"]["uri"] for item in sp.saved_tracks} == get_saved_uris()
+
+
+def test_get_spotify_refreshes_an_expiring_token_once(monkeypatch):
+    refreshed, written = [], []
+
+    class FakeOAuth:
+        def refresh_access_token(self, refresh_token):
+            refreshed.append(refresh_token)
+            time.sleep(0.1)
+            return {"access_token": "new", "refresh_token": refresh_token, "expires_at": time.time() + 3600}
+
+    monkeypatch.setattr(spotify, "_get_spotify_oauth", lambda full_url, user: FakeOAuth())
+    monkeypatch.setattr(spotify, "_write_token_info", lambda user_id, token_info: written.append(token_info))
+    monkeypatch.setattr(spotify, "_spotify_clients", {})
+    token_info = {"access_token": "old", "refresh_token": "refresh", "expires_at": time.time() + 60}
+    user = User(id=4321, username="demo", spotify_token_json=json.dumps(token_info))
+
+    with ThreadPoolExecutor(4) as executor:
+        clients = list(executor.map(lambda _: spotify.get_spotify("", user), range(4)))
+    spotify._token_writer.submit(lambda: None).result()
+
+    assert ["refresh"] == refreshed
+    assert ["new"] == [token_info["access_token"] for token_info in written]
+    assert all(client is clients[0] for client in clients)
+    # until it's about to expire, the refreshed token is used without even looking at the stored one
+    user.spotify_token_json = None
+    assert clients[0] is spotify.get_spotify("", user)
+    assert 1 == len(refreshed)
+
+
+@requires_database
+def test_fast_path_play_stores_its_offset_before_returning(database_user, monkeypatch):
+    class PlayingSpotify(FakeSpotify):
+        def __init__(self):
+            super().__init__()
+            self.started_at: List[int] = []
+
+        def start_playback(self, uris, position_ms):
+            self.started_at.append(position_ms)
+
+    sp = PlayingSpotify()
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    recorder = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(spotify, "_play_recorder", recorder)
+    # holds up the background work, as if it were still running when the next play comes in
+    release = threading.Event()
+    recorder.submit(release.wait)
+    track_uri = fake_track(1)["uri"]
+    stored_offset_sql = f"select last_random_play_offset from users where id = {database_user.id}"
+    try:
+        assert "" == spotify.play_track("", track_uri, database_user, fast_path=True)
+        assert sp.started_at == [db.engine.execute(stored_offset_sql).scalar()]
+        assert 0 == SpotifyPlay.query.filter_by(user_id=database_user.id).count()
+
+        assert "" == spotify.play_track("", track_uri, database_user, fast_path=True)
+        assert abs(sp.started_at[1] - sp.started_at[0]) >= spotify.RANDOM_RANGE_MS
+        assert sp.started_at[1] == db.engine.execute(stored_offset_sql).scalar()
+    finally:
+        release.set()
+        recorder.shutdown(wait=True)
+    assert 2 == SpotifyPlayTotal.query.filter_by(user_id=database_user.id, spotify_track_uri=track_uri).one().plays
+    assert db.engine.execute(f"select is_playable from spotify_tracks where uri = '{track_uri}'").scalar()
+
+
+@requires_database
+def test_playability_sweep_checks_every_deck_track_once(database_user):
+    sp = FakeSpotify()
+    _add_deck_tracks(sp, database_user)
+    sp.unplayable = {fake_track(1)["uri"]}
+
+    def get_test_uris_to_check(checked_before: datetime.datetime) -> List[str]:
+        return [uri for uri in get_deck_track_uris_to_check_playability(checked_before) if TEST_URI_MARKER in uri]
+
+    # liked tracks of any artist count, since the sweep covers every user's deck
+    to_check = get_test_uris_to_check(datetime.datetime.utcnow())
+    assert {fake_track(i)["uri"] for i in [0, 1, 2, 3, 6, 10]} == set(to_check)
+    assert 1 == update_playability(sp, to_check)
+    assert [fake_track(1)["uri"]] == [
+        track.uri
+        for track in SpotifyTrack.query.filter(SpotifyTrack.uri.in_(to_check))  # type: ignore
+        if not track.is_playable
+    ]
+    # and once they've been checked, they aren't again until the next sweep
+    assert [] == get_test_uris_to_check(datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+
+
+@requires_database
+def test_get_tracks_assembles_the_deck_in_one_query(database_user, monkeypatch):
+    sp = FakeSpotify()
+    _add_deck_tracks(sp, database_user)
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    monkeypatch.setattr(spotify, "follow_unfollow_artists", lambda user: None)
+    monkeypatch.setattr(spotify, "sync_saved_tracks", lambda sp, user: None)
+    sp.unplayable = {fake_track(6)["uri"]}
+    update_playability(sp, [fake_track(6)["uri"]])
+
+    tracks = {track["uri"]: track for track in get_tracks(database_user)}
+    assert {fake_track(i)["uri"] for i in [0, 1, 3, 10]} == set(tracks.keys())
+    assert {
+        "uri": fake_track(0)["uri"],
+        "name": "Track 0",
+        "artists": [
+            {"uri": fake_artist(0)["uri"], "name": "Artist 0"},
+            {"uri": fake_artist(5)["uri"], "name": "Artist 5"},
+        ],
+        "album_name": "Album 0",
+        "album_released_at": datetime.date(1999, 1, 1),
+        "album_image_url": fake_track(0)["album"]["images"][0]["url"],
+    } == tracks[fake_track(0)["uri"]]
+
+
+@requires_database
+def test_generate_tracks_reads_columns_instead_of_api_response(database_user, monkeypatch):
+    sp = FakeSpotify()
+    _add_deck_tracks(sp, database_user)
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    monkeypatch.setattr(spotify, "follow_unfollow_artists", lambda user: None)
+    monkeypatch.setattr(spotify, "sync_saved_tracks", lambda sp, user: None)
+    # tracks stored before features were, or whose API response was never stored, still make complete notes
+    SpotifyFeature.query.filter_by(spotify_track_uri=fake_track(3)["uri"]).delete()
+    SpotifyTrack.query.filter(SpotifyTrack.uri.contains(TEST_URI_MARKER)).update(  # type: ignore
+        {"api_response": None}, synchronize_session=False
+    )
+    db.session.commit()
+
+    deck = genanki.Deck(1, "Spotify Tracks")
+    generate_tracks(database_user, deck, ["tag"])
+    notes = {note.fields[0]: note for note in deck.notes}
+    assert 5 == len(notes)
+    assert [
+        fake_track(3)["uri"],
+        "Track 3",
+        "Artist 3",
+        "<i>Album 3</i> (1999)",
+        f"<img src='{fake_track(3)['album']['images'][0]['url']}'>",
+    ] == notes[fake_track(3)["uri"]].fields
+    assert "Artist 1, Artist 6" == notes[fake_track(1)["uri"]].fields[2]
+    # the blob is only loaded when asked for
+    assert "api_response" not in SpotifyTrack.query.get(fake_track(3)["uri"]).__dict__
+
+
+@requires_database
+def test_stale_artists_are_refreshed_most_out_of_date_first(database_user):
+    sp = FakeSpotify()
+    now = datetime.datetime.utcnow()
+    refreshed_at = [None, now - datetime.timedelta(days=30), now - datetime.timedelta(days=8), now]
+    for i, last_refresh in enumerate(refreshed_at):
+        db.session.add(
+            SpotifyArtist(uri=fake_artist(i)["uri"], name=f"Artist {i}", last_top_tracks_refresh=last_refresh)
+        )
+    # artists nobody follows aren't refreshed
+    db.session.add(SpotifyArtist(uri=fake_artist(4)["uri"], name="Artist 4"))
+    db.session.commit()
+    for i in range(len(refreshed_at)):
+        db.session.add(ManagedSpotifyArtist(user_id=database_user.id, spotify_artist_uri=fake_artist(i)["uri"]))
+    db.session.commit()
+
+    def get_stale_test_artists() -> List[str]:
+        return [artist.uri for artist in get_artists_with_stale_top_tracks() if TEST_URI_MARKER in artist.uri]
+
+    stale = get_stale_test_artists()
+    assert [fake_artist(i)["uri"] for i in [0, 1, 2]] == stale
+    store_artist_refreshes(sp, {uri: fetch_artist_refresh(sp, uri) for uri in stale})
+    assert [] == get_stale_test_artists()
+    assert [fake_track(100 + k)["uri"] for k in range(10)] == [
+        top_track.track_uri
+        for top_track in TopTrack.query.filter_by(artist_uri=fake_artist(1)["uri"]).order_by(TopTrack.ordinal)
+    ]
+    artist_album_uris = [fake_album(100 + k)["uri"] for k in range(3)]
+    assert 3 == SpotifyAlbum.query.filter(SpotifyAlbum.uri.in_(artist_album_uris)).count()  # type: ignore
+
+
+@requires_database
+def test_playlist_sync_only_sends_the_difference(database_user, monkeypatch):
+    sp = FakeSpotify()
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    database_user.spotify_token_json = "{}"
+    hydrate_tracks(sp, [fake_track(i)["uri"] for i in range(6)])
+
+    def play(*tracks: int) -> None:
+        for track in tracks:
+            record_spotify_play(database_user.id, fake_track(track)["uri"], datetime.datetime.now())
+        db.session.commit()
+
+    def sync() -> Counter:
+        sp.calls.clear()
+        update_spotify_anki_playlist(database_user)
+        db.session.commit()
+        return sp.calls
+
+    play(0, 1, 2, 0)
+    assert Counter(user_playlist_create=1, playlist_add_items=1) == sync()
+    assert sorted(fake_track(i)["uri"] for i in [0, 1, 2]) == sorted(sp.playlist_tracks)
+    # nothing was played since, so nothing is sent
+    assert Counter() == sync()
+    play(3)
+    assert Counter(playlist_add_items=1) == sync()
+
+    # edits made elsewhere are noticed through the snapshot & undone: the duplicate is removed & added back once, then
+    # the track that was never played is removed
+    sp.edit_playlist(sp.playlist_tracks + [fake_track(5)["uri"], fake_track(0)["uri"]])
+    assert Counter(playlist_items=1, playlist_remove_all_occurrences_of_items=2, playlist_add_items=1) == sync()
+    assert sorted(fake_track(i)["uri"] for i in [0, 1, 2, 3]) == sorted(sp.playlist_tracks)
+    assert Counter() == sync()
+
+    # a write whose response is lost may still have been applied, so the playlist is read again
+    def add_but_lose_the_response(playlist_id: str, items: List[str]) -> JsonDict:
+        sp.edit_playlist(sp.playlist_tracks + items)
+        raise ConnectionError()
+
+    monkeypatch.setattr(sp, "playlist_add_items", add_but_lose_the_response)
+    play(4)
+    with pytest.raises(ConnectionError):
+        sync()
+    assert sorted(sp.playlist_tracks) == sorted(
+        row.spotify_track_uri for row in SpotifyPlaylistTrack.query.filter_by(user_id=database_user.id)
+    )
+    assert 5 == len(sp.playlist_tracks)
+
+
+@requires_database
+def test_last_fm_scrobbles_are_read_from_every_page_and_matched_by_normalized_name(database_user, monkeypatch):
+    # one artist per page; the last page used to be skipped
+    last_fm_names = ["ARTIST 0", "Artist 9", "Artist-1"]
+    requested_pages = []
+
+    def get_page(last_fm_username: str, api_key: str, page: int) -> JsonDict:
+        requested_pages.append(page)
+        artist = {"name": last_fm_names[page - 1], "playcount": str(100 * page)}
+        return {"topartists": {"@attr": {"totalPages": str(len(last_fm_names))}, "artist": [artist]}}
+
+    monkeypatch.setattr(spotify, "_get_last_fm_top_artists_page", get_page)
+    monkeypatch.setattr(spotify.kv, "get", lambda key: "api-key")
+    db.session.add(SpotifyArtist(uri=fake_artist(0)["uri"], name="Artist 0", normalized_name="artist0"))
+    # inserted before normalized names existed, so only matches once backfilled
+    db.session.add(SpotifyArtist(uri=fake_artist(1)["uri"], name="Artist 1"))
+    db.session.add(SpotifyArtist(uri=fake_artist(2)["uri"], name="Artist 2", normalized_name="artist2"))
+    db.session.commit()
+    for i in range(3):
+        db.session.add(
+            ManagedSpotifyArtist(
+                user_id=database_user.id, spotify_artist_uri=fake_artist(i)["uri"], last_fm_scrobbles=5
+            )
+        )
+    database_user.last_fm_username = database_user.username
+    db.session.commit()
+
+    update_last_fm_scrobble_counts(database_user)
+    assert [1, 2, 3] == sorted(requested_pages)
+    scrobbles = {
+        artist.spotify_artist_uri: artist.last_fm_scrobbles
+        for artist in ManagedSpotifyArtist.query.filter_by(user_id=database_user.id)
+    }
+    # artists last.fm no longer lists lose their old count
+    assert {fake_artist(0)["uri"]: 100, fake_artist(1)["uri"]: 300, fake_artist(2)["uri"]: None} == scrobbles
+
+    # refreshed at most once a week
+    update_last_fm_scrobble_counts(database_user)
+    assert 3 == len(requested_pages)
+
+
+@requires_database
+def test_follow_sync_adds_unfollows_and_refollows_artists(database_user, monkeypatch):
+    sp = FakeSpotify()
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+
+    def sync(following: range) -> Dict[str, bool]:
+        sp.followed_artists = [fake_artist(i)["uri"] for i in following]
+        follow_unfollow_artists(database_user)
+        return {
+            artist.spotify_artist_uri: artist.following
+            for artist in ManagedSpotifyArtist.query.filter_by(user_id=database_user.id)
+        }
+
+    assert {fake_artist(i)["uri"]: True for i in range(60)} == sync(range(60))
+    assert Counter(current_user_followed_artists=2, artists=2) == sp.calls
+
+    # only the newly followed artist is requested from Spotify
+    sp.calls.clear()
+    followed = sync(range(1, 61))
+    assert Counter(current_user_followed_artists=2, artists=1) == sp.calls
+    assert not followed[fake_artist(0)["uri"]]
+    assert 60 == sum(followed.values())
+
+    sp.calls.clear()
+    assert {fake_artist(i)["uri"]: True for i in range(61)} == sync(range(61))
+    assert Counter(current_user_followed_artists=2) == sp.calls
+
+
+@requires_database
+def test_dashboard_stats_are_stored_and_refreshed_when_follows_change(database_user, monkeypatch):
+    sp = FakeSpotify()
+    monkeypatch.setattr(spotify, "get_spotify", lambda full_url, user: sp)
+    sources = [f"https://{TEST_URI_MARKER}/list{i}" for i in range(6)]
+    monkeypatch.setattr(spotify, "BEST_SELLING_ARTISTS_SOURCE", sources[0])
+    monkeypatch.setattr(spotify, "MOST_STREAMED_ARTISTS_SOURCE", sources[1])
+    monkeypatch.setattr(spotify, "HIGHEST_CERTIFIED_ARTISTS_SOURCE", sources[2])
+    hydrate_artists(sp, [fake_artist(i)["uri"] for i in range(5)])
+    # artists 0-3 are on more lists than any real artist, so they're the ones suggested next
+    for i in range(4):
+        for source in [sources[0]] + sources[3:]:
+            db.session.add(BestSellingArtist(artist_uri=fake_artist(i)["uri"], claimed_sales=100 * i, source=source))
+    db.session.add(BestSellingArtist(artist_uri=fake_artist(4)["uri"], source=sources[0]))
+    db.session.add(BestSellingArtist(artist_uri=fake_artist(0)["uri"], source=sources[2]))
+    db.session.commit()
+    do_add_artists(database_user, [fake_artist(0)["uri"]])
+
+    stats = get_music_dashboard_stats(database_user)
+    # an empty list counts as 0% rather than dividing by zero
+    assert (20, 0, 100) == (stats.percent_best_selling, stats.percent_most_streamed, stats.percent_highest_certified)
+    bare_uri = {i: fake_artist(i)["uri"].split("spotify:artist:")[1] for i in range(5)}
+    assert [[f"Artist {i}", bare_uri[i]] for i in [3, 2, 1]] == json.loads(stats.next_to_follow_json)
+    assert len(json.loads(stats.recommendations_json)) <= spotify.DASHBOARD_ARTISTS_SHOWN
+
+    # following nobody new leaves the row alone
+    refreshed_at = stats.refreshed_at
+    do_add_artists(database_user, [fake_artist(0)["uri"]])
+    assert refreshed_at == get_music_dashboard_stats(database_user).refreshed_at
+
+    do_add_artists(database_user, [fake_artist(3)["uri"]])
+    stats = get_music_dashboard_stats(database_user)
+    assert refreshed_at < stats.refreshed_at
+    assert 40 == stats.percent_best_selling
+    assert [[f"Artist {i}", bare_uri[i]] for i in [2, 1]] == json.loads(stats.next_to_follow_json)[:2]
+
+
+@requires_database
+def test_recorded_plays_are_rolled_up_per_day_and_per_track(database_user):
+    hydrate_tracks(FakeSpotify(), [fake_track(i)["uri"] for i in range(2)])
+    monday, tuesday = datetime.datetime(2021, 3, 1, 9), datetime.datetime(2021, 3, 2, 9)
+    # plays can be recorded out of order, e.g. by the fast path's background workers
+    for track, played_at in [(0, tuesday), (0, tuesday), (1, tuesday), (0, monday)]:
+        record_spotify_play(database_user.id, fake_track(track)["uri"], played_at)
+    db.session.commit()
+
+    assert 4 == SpotifyPlay.query.filter_by(user_id=database_user.id).count()
+    assert {(0, monday.date(), 1), (0, tuesday.date(), 2), (1, tuesday.date(), 1)} == {
+        (int(row.spotify_track_uri.split(TEST_URI_MARKER)[1]), row.day, row.plays)
+        for row in SpotifyPlayDaily.query.filter_by(user_id=database_user.id)
+    }
+    assert {(0, monday.date(), 3), (1, tuesday.date(), 1)} == {
+        (int(row.spotify_track_uri.split(TEST_URI_MARKER)[1]), row.first_played_on, row.plays)
+        for row in SpotifyPlayTotal.query.filter_by(user_id=database_user.id)
+    }
+
+
+def test_quiz_pool_is_built_once_until_it_expires(monkeypatch):
+    monkeypatch.setattr(spotify, "_quiz_pools", {})
+    builds = []
+    release = threading.Event()
+
+    def build() -> JsonDict:
+        builds.append(1)
+        release.wait(5)
+        return {"build": len(builds)}
+
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(spotify._get_quiz_pool, "test", build) for _ in range(4)]
+        time.sleep(0.1)
+        # a pool that isn't being rebuilt doesn't wait for this one
+        assert {"build": 1} == spotify._get_quiz_pool("other", lambda: {"build": 1})
+        release.set()
+        assert [{"build": 1}] * 4 == [future.result() for future in futures]
+    assert 1 == len(builds)
+
+    now = time.time()
+    monkeypatch.setattr(spotify.time, "time", lambda: now + spotify.QUIZ_POOL_TTL.total_seconds() + 1)
+    assert {"build": 2} == spotify._get_quiz_pool("test", build)
+
+
+def test_quiz_artist_choices_are_distinct_and_include_the_answer():
+    choices = spotify._get_quiz_artist_choices("Answer", ["A", "B", "Answer", "B", "C"])
+    assert ["A", "Answer", "B", "C"] == sorted(choices)
+    names = [f"Artist {i}" for i in range(20)]
+    choices = spotify._get_quiz_artist_choices("Answer", names)
+    assert spotify.QUIZ_ARTIST_CHOICES == len(set(choices)) == len(choices)
+    assert "Answer" in choices
+
+
+@requires_database
+def test_family_quiz_pool_lists_each_playable_track_once(database_user, monkeypatch):
+    name = f"{database_user.username}-sibling"
+    sibling = User(username=name, email=f"{name}@zdone.co", api_key=name)
+    db.session.add(sibling)
+    db.session.commit()
+    sp = FakeSpotify()
+    sp.unplayable.add(fake_track(5)["uri"])
+    hydrate_tracks(sp, [fake_track(i)["uri"] for i in range(6)])
+    update_playability(sp, [fake_track(5)["uri"]])
+    for user, artist in [(database_user, 0), (sibling, 0), (sibling, 1), (sibling, 2)]:
+        db.session.add(ManagedSpotifyArtist(user_id=user.id, spotify_artist_uri=fake_artist(artist)["uri"]))
+    db.session.commit()
+    # unfollowed artists are only distractors
+    ManagedSpotifyArtist.query.filter_by(
+        user_id=sibling.id, spotify_artist_uri=fake_artist(2)["uri"]
+    ).one().following = False
+    db.session.commit()
+    monkeypatch.setattr(spotify, "FAMILY_QUIZ_USER_IDS", [database_user.id, sibling.id])
+
+    pool = spotify._build_family_pool()
+    assert {
+        database_user.id: [(fake_artist(0)["uri"], "Artist 0")],
+        sibling.id: [(fake_artist(0)["uri"], "Artist 0"), (fake_artist(1)["uri"], "Artist 1")],
+    } == pool["artists_by_user"]
+    # artist i's primary tracks are i and i + 5, and track 5 can't be played
+    assert {
+        fake_artist(0)["uri"]: [fake_track(0)["uri"]],
+        fake_artist(1)["uri"]: [fake_track(1)["uri"]],
+    } == pool["tracks_by_artist"]
+    assert ["Artist 0", "Artist 0", "Artist 1", "Artist 2"] == sorted(pool["artist_names"])
@@ -1,3 +1,4 @@
+from app import db, util
 from app.card_generation.util import (
     _sort_credit,
     AnkiCard,
@@ -5,6 +6,9 @@ from app.card_generation.util import (
     get_minified_js_for_song_jump,
     get_minified_js_for_youtube_video,
 )
+from app.models.spotify import SpotifyArtist
+from app.util import get_missing_keys
+from utils import fake_artist, requires_database
 
 
 def test__sort_credit():
@@ -26,3 +30,14 @@ def test_get_minified_js_for_song_jump():
 
 def test_get_minified_js_for_youtube_video():
     assert "{{YouTube Trailer Duration}}" in get_minified_js_for_youtube_video()
+
+
+@requires_database
+def test_get_missing_keys(database_user, monkeypatch):
+    monkeypatch.setattr(util, "MISSING_KEYS_CHUNK_SIZE", 2)
+    for i in range(3):
+        db.session.add(SpotifyArtist(uri=fake_artist(i)["uri"], name=fake_artist(i)["name"]))
+    db.session.commit()
+    uris = [fake_artist(i)["uri"] for i in range(5)]
+    assert {uris[3], uris[4]} == get_missing_keys(SpotifyArtist.uri, uris + uris[::-1])
+    assert set() == get_missing_keys(SpotifyArtist.uri, [])
@@ -1,3 +1,10 @@
+import datetime
+import os
+from collections import Counter
+from typing import List, Optional, Set
+
+import pytest
+
 from app.models.base import User
 from app.util import JsonDict
 
@@ -25,3 +32,145 @@ def get_test_highlight(
         "source_author": source_author,
         "cover_image_url": cover_image_url,
     }
+
+
+# Everything the database tests create in the shared catalog tables has this in its URI, so that it can be told apart
+# from real rows & deleted afterwards.
+TEST_URI_MARKER = "zdtest"
+# Tests that read & write the database at DATABASE_URL. Only run in the ci environment, so that they never write to a
+# database that isn't meant for tests.
+requires_database = pytest.mark.skipif(
+    not os.environ.get("DATABASE_URL") or os.environ.get("ZDONE_ENVIRONMENT") != "ci", reason="integration"
+)
+
+
+def fake_artist(i: int) -> JsonDict:
+    return {
+        "uri": f"spotify:artist:{TEST_URI_MARKER}{i}",
+        "name": f"Artist {i}",
+        "images": [{"url": f"https://i.scdn.co/image/artist{i}"}],
+    }
+
+
+def fake_album(i: int) -> JsonDict:
+    return {
+        "uri": f"spotify:album:{TEST_URI_MARKER}{i}",
+        "name": f"Album {i}",
+        "album_type": "album",
+        "release_date": "1999-01-01",
+        "images": [{"url": f"https://i.scdn.co/image/album{i}"}],
+        "artists": [{"uri": f"spotify:artist:{TEST_URI_MARKER}{i % 3}", "name": f"Artist {i % 3}"}],
+    }
+
+
+# tracks are by artist i % 5, featuring artist i % 5 + 5, on album i % 7
+def fake_track(i: int) -> JsonDict:
+    return {
+        "uri": f"spotify:track:{TEST_URI_MARKER}{i}",
+        "name": f"Track {i}",
+        "duration_ms": 200000 + i,
+        "popularity": 50,
+        "is_playable": True,
+        "artists": [
+            {"uri": f"spotify:artist:{TEST_URI_MARKER}{i % 5}", "name": f"Artist {i % 5}"},
+            {"uri": f"spotify:artist:{TEST_URI_MARKER}{i % 5 + 5}", "name": f"Artist {i % 5 + 5}"},
+        ],
+        "album": fake_album(i % 7),
+    }
+
+
+def fake_saved_track(i: int, added_at: datetime.datetime) -> JsonDict:
+    return {"added_at": added_at.strftime("%Y-%m-%dT%H:%M:%SZ"), "track": fake_track(i)}
+
+
+def _get_fake_id(uri: str) -> int:
+    return int(uri.split(TEST_URI_MARKER)[-1])
+
+
+# Stands in for a spotipy client, serving the fake catalog above & counting the requests made of it.
+class FakeSpotify:
+    def __init__(self):
+        self.calls: Counter = Counter()
+        # the user's library, newest first, as items of the saved tracks endpoint
+        self.saved_tracks: List[JsonDict] = []
+        # uris of the artists the user follows
+        self.followed_artists: List[str] = []
+        # tracks that can't be played anymore, as reported when tracks are requested for a market
+        self.unplayable: Set[str] = set()
+        # the tracks on the one playlist this user has, & its snapshot id, which changes with every edit
+        self.playlist_tracks: List[str] = []
+        self.snapshot = 0
+
+    def tracks(self, uris: List[str], market: Optional[str] = None) -> JsonDict:
+        self.calls["tracks"] += 1
+        assert len(uris) <= 50
+        tracks = [fake_track(_get_fake_id(uri)) for uri in uris]
+        for track in tracks:
+            track["is_playable"] = market is None or track["uri"] not in self.unplayable
+        return {"tracks": tracks}
+
+    def artists(self, uris: List[str]) -> JsonDict:
+        self.calls["artists"] += 1
+        assert len(uris) <= 50
+        return {"artists": [fake_artist(_get_fake_id(uri)) for uri in uris]}
+
+    def albums(self, uris: List[str]) -> JsonDict:
+        self.calls["albums"] += 1
+        assert len(uris) <= 20
+        return {"albums": [fake_album(_get_fake_id(uri)) for uri in uris]}
+
+    def current_user_saved_tracks(self, limit: int, offset: int) -> JsonDict:
+        self.calls["current_user_saved_tracks"] += 1
+        return {
+            "items": self.saved_tracks[offset : offset + limit],
+            "total": len(self.saved_tracks),
+            "next": "next" if offset + limit < len(self.saved_tracks) else None,
+        }
+
+    def current_user_followed_artists(self, limit: int, after: Optional[str] = None) -> JsonDict:
+        self.calls["current_user_followed_artists"] += 1
+        start = 0 if after is None else self.followed_artists.index(after) + 1
+        page = self.followed_artists[start : start + limit]
+        last = page[-1] if page and start + limit < len(self.followed_artists) else None
+        return {"artists": {"items": [fake_artist(_get_fake_id(uri)) for uri in page], "cursors": {"after": last}}}
+
+    # artist i's top tracks are tracks 100 * i to 100 * i + 9
+    def artist_top_tracks(self, artist_id: str) -> JsonDict:
+        self.calls["artist_top_tracks"] += 1
+        return {"tracks": [fake_track(_get_fake_id(artist_id) * 100 + k) for k in range(10)]}
+
+    def artist_albums(self, artist_id: str, limit: int) -> JsonDict:
+        self.calls["artist_albums"] += 1
+        return {"items": [fake_album(_get_fake_id(artist_id) * 100 + k) for k in range(3)]}
+
+    def me(self) -> JsonDict:
+        return {"id": "demo"}
+
+    def user_playlist_create(self, user: str, name: str, public: bool, description: str) -> JsonDict:
+        self.calls["user_playlist_create"] += 1
+        return {"uri": f"spotify:playlist:{TEST_URI_MARKER}{user}", "snapshot_id": str(self.snapshot)}
+
+    # an edit made by someone other than zdone
+    def edit_playlist(self, track_uris: List[str]) -> None:
+        self.playlist_tracks = track_uris
+        self.snapshot += 1
+
+    def playlist(self, playlist_id: str, fields: str) -> JsonDict:
+        return {"snapshot_id": str(self.snapshot)}
+
+    def playlist_items(self, playlist_id: str, fields: str, limit: int, offset: int) -> JsonDict:
+        self.calls["playlist_items"] += 1
+        return {
+            "items": [{"track": {"uri": uri}} for uri in self.playlist_tracks[offset : offset + limit]],
+            "next": "next" if offset + limit < len(self.playlist_tracks) else None,
+        }
+
+    def playlist_add_items(self, playlist_id: str, items: List[str]) -> JsonDict:
+        self.calls["playlist_add_items"] += 1
+        self.edit_playlist(self.playlist_tracks + items)
+        return {"snapshot_id": str(self.snapshot)}
+
+    def playlist_remove_all_occurrences_of_items(self, playlist_id: str, items: List[str]) -> JsonDict:
+        self.calls["playlist_remove_all_occurrences_of_items"] += 1
+        self.edit_playlist([uri for uri in self.playlist_tracks if uri not in items])
+        return {"snapshot_id": str(self.snapshot)}